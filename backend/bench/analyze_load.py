@@ -0,0 +1,119 @@
+"""
+Concurrent /analyze throughput against the local fake OpenAI server.
+
+Boots the fake OpenAI server and the backend (uvicorn subprocess, temp DB_PATH), fires --requests
+uploads with --concurrency in flight, and prints throughput and latency percentiles.
+
+    python backend/bench/analyze_load.py --requests 40 --concurrency 20 --latency 1.0
+
+To compare against another commit, check it out elsewhere and pass its backend dir:
+
+    git worktree add /tmp/nutri-old <commit>
+    python backend/bench/analyze_load.py --app-dir /tmp/nutri-old/backend
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from fake_openai import make_app, serve_in_thread
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+# Smallest valid 1x1 PNG; payload size is not what this benchmark measures
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010802000000907753de"
+    "0000000c49444154789c6338916204000356015fe81784520000000049454e44ae426082"
+)
+
+
+def start_backend(app_dir: Path, port: int, openai_port: int) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-fake",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{openai_port}/v1",
+        DB_PATH=str(Path(tempfile.mkdtemp()) / "bench.db"),
+        # Measure raw throughput, not the per-IP rate limit or the admission queue
+        ANALYZE_ANON_RATE_PER_MINUTE="1000000",
+        ANALYZE_ANON_BURST="1000000",
+        UPSTREAM_MAX_IN_FLIGHT="10000",
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("backend did not start")
+
+
+async def run_load(base: str, total: int, concurrency: int) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(client: httpx.AsyncClient, i: int):
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            r = await client.post(
+                f"{base}/analyze",
+                files={"file": ("meal.png", TINY_PNG, "image/png")},
+                # Unique description per request keeps the result cache out of the measurement
+                data={"current_conditions": "Diabetes", "concerned_conditions": "Heart disease", "user_description": f"bench {i}"},
+            )
+            latencies.append(time.perf_counter() - t0)
+            if r.status_code != 200:
+                errors += 1
+
+    async with httpx.AsyncClient(timeout=300) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(total)))
+        wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(total / wall, 2),
+        "p50_s": round(statistics.median(latencies), 3),
+        "p95_s": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=1.0, help="fake OpenAI seconds per call")
+    parser.add_argument("--app-dir", type=Path, default=BACKEND_DIR)
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--openai-port", type=int, default=9100)
+    args = parser.parse_args()
+
+    serve_in_thread(make_app(args.latency), args.openai_port)
+    proc = start_backend(args.app_dir, args.port, args.openai_port)
+    try:
+        result = asyncio.run(run_load(f"http://127.0.0.1:{args.port}", args.requests, args.concurrency))
+    finally:
+        proc.terminate()
+        proc.wait()
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
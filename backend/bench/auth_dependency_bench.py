@@ -0,0 +1,73 @@
+"""
+Microbenchmark of the authentication dependency and /auth/me handler.
+
+Calls require_user() and auth_me() directly (no HTTP) with a real token, first with the token and
+user caches cleared before every call (the uncached path: HS256 verify + JSON parse, plus a SQLite
+lookup for /auth/me), then warm.
+
+    python backend/bench/auth_dependency_bench.py --iterations 20000
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("DB_PATH", str(Path(tempfile.mkdtemp()) / "bench.db"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.security import HTTPAuthorizationCredentials  # noqa: E402
+
+import main  # noqa: E402
+
+
+def per_call_us(fn, iterations: int, before=None) -> float:
+    samples = []
+    for _ in range(5):
+        total = 0.0
+        for _ in range(iterations // 5):
+            if before:
+                before()
+            t0 = time.perf_counter()
+            fn()
+            total += time.perf_counter() - t0
+        samples.append(total / (iterations // 5))
+    return round(statistics.median(samples) * 1e6, 2)
+
+
+def clear_caches():
+    main.token_cache.clear()
+    main.user_cache.clear()
+
+
+def run(iterations: int) -> dict:
+    main.init_db()
+    main.ensure_global_admin()
+    token = main.create_access_token({"sub": main.GLOBAL_ADMIN_ID})
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    def dependency():
+        main.require_user(creds)
+
+    def me():
+        main.auth_me(main.require_user(creds))
+
+    return {
+        "iterations": iterations,
+        "require_user_uncached_us": per_call_us(dependency, iterations, clear_caches),
+        "require_user_cached_us": per_call_us(dependency, iterations),
+        "auth_me_uncached_us": per_call_us(me, iterations, clear_caches),
+        "auth_me_cached_us": per_call_us(me, iterations),
+        "token_cache": main.token_cache.stats(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.iterations)))
@@ -0,0 +1,251 @@
+"""
+Bulk history throughput: NDJSON import/export and bulk delete vs the per-row endpoints.
+
+Boots the backend (uvicorn subprocess, temp data dir) and, for one user with --rows analyses
+(the canned analysis text from fake_openai.py, ~0.6 KB each, optional inline previews):
+
+  import       POST /analyses/import, the body generated and streamed on the fly
+  export       GET /analyses/export streamed to /dev/null (time to first byte, rows/s, MB/s)
+  page_all     the pre-export way to read everything: GET /analyses?limit=200 following X-Next-Cursor
+  create_each  the pre-import way to write: POST /analyses per row (--baseline-rows rows, --concurrency at a time)
+  bulk_delete  POST /analyses/delete with 1000 ids per request, until the history is empty
+  delete_each  DELETE /analyses/{id} per row (--baseline-rows rows)
+
+Server RSS (process tree, sampled every 50 ms) is reported per phase so constant-memory streaming shows
+up as a flat peak regardless of --rows.
+
+    python backend/bench/export_import_bench.py --rows 100000
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from suite import MemorySampler, git_info, photo, wait_until_up  # noqa: E402
+
+ANALYSIS = (BENCH_DIR / "fake_openai.py").read_text().split('CANNED_ANALYSIS = """', 1)[1].split('"""', 1)[0]
+BULK_DELETE_IDS = 1000
+
+
+def ndjson_rows(rows: int, preview_every: int, preview: str):
+    """The import body in ~256-row chunks; generated lazily so the client's memory stays flat too."""
+    start = datetime(2024, 1, 1)
+    lines = []
+    for i in range(rows):
+        item = {
+            "dishName": f"Meal {i}",
+            "analysis": ANALYSIS,
+            "date": (start + timedelta(minutes=37 * i)).isoformat(),
+            "currentConditions": "Diabetes",
+            "userDescription": f"bench row {i}",
+        }
+        if preview_every and i % preview_every == 0:
+            item["preview"] = preview
+        lines.append(json.dumps(item))
+        if len(lines) == 256:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def rate(count: float, seconds: float) -> float:
+    return round(count / seconds, 1) if seconds else 0.0
+
+
+class Bench:
+    def __init__(self, args, proc: subprocess.Popen):
+        self.args = args
+        self.proc = proc
+        self.base = f"http://127.0.0.1:{args.port}"
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(base_url=self.base, timeout=600)
+
+    async def user(self, client, email: str) -> dict:
+        r = await client.post("/auth/register", json={"email": email, "password": "bench-password"})
+        r.raise_for_status()
+        return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    async def phase(self, name: str, fn) -> dict:
+        with MemorySampler(self.proc.pid) as memory:
+            t0 = time.perf_counter()
+            result = await fn()
+            result["seconds"] = round(time.perf_counter() - t0, 2)
+        result["memory"] = memory.result
+        print(json.dumps({name: result}), file=sys.stderr)
+        return result
+
+    async def run(self) -> dict:
+        args = self.args
+        preview = "data:image/jpeg;base64," + base64.b64encode(photo(640, 480, seed=1, quality=80)).decode()
+        results = {}
+        async with self.client() as client:
+            auth = await self.user(client, "bulk@example.com")
+            legacy = await self.user(client, "legacy@example.com")
+
+            async def do_import():
+                body = ndjson_rows(args.rows, args.preview_every, preview)
+                sent = 0
+
+                async def counted():
+                    nonlocal sent
+                    for chunk in body:
+                        sent += len(chunk)
+                        yield chunk
+
+                t0 = time.perf_counter()
+                r = await client.post("/analyses/import", headers={**auth, "Content-Type": "application/x-ndjson"}, content=counted())
+                r.raise_for_status()
+                seconds = time.perf_counter() - t0
+                return {**r.json(), "mb": round(sent / 1e6, 1), "rows_per_s": rate(args.rows, seconds), "mb_per_s": rate(sent / 1e6, seconds)}
+
+            results["import"] = await self.phase("import", do_import)
+
+            async def do_export():
+                t0 = time.perf_counter()
+                first_byte, received, rows = None, 0, 0
+                async with client.stream("GET", "/analyses/export", params={"previews": args.export_previews}, headers=auth) as r:
+                    r.raise_for_status()
+                    async for chunk in r.aiter_bytes():
+                        if first_byte is None:
+                            first_byte = time.perf_counter() - t0
+                        received += len(chunk)
+                        rows += chunk.count(b"\n")
+                seconds = time.perf_counter() - t0
+                return {
+                    "rows": rows, "mb": round(received / 1e6, 1), "ttfb_ms": round((first_byte or 0) * 1000, 1),
+                    "rows_per_s": rate(rows, seconds), "mb_per_s": rate(received / 1e6, seconds),
+                }
+
+            results["export"] = await self.phase("export", do_export)
+
+            async def do_page_all():
+                rows, requests, cursor = 0, 0, None
+                t0 = time.perf_counter()
+                while True:
+                    params = {"limit": 200, **({"cursor": cursor} if cursor else {})}
+                    r = await client.get("/analyses", params=params, headers=auth)
+                    r.raise_for_status()
+                    rows += len(r.json())
+                    requests += 1
+                    cursor = r.headers.get("x-next-cursor")
+                    if not cursor:
+                        break
+                return {"rows": rows, "requests": requests, "rows_per_s": rate(rows, time.perf_counter() - t0)}
+
+            results["page_all"] = await self.phase("page_all", do_page_all)
+
+            async def do_create_each():
+                limit = asyncio.Semaphore(args.concurrency)
+                ids = []
+
+                async def create(i: int):
+                    async with limit:
+                        r = await client.post("/analyses", headers=legacy, json={"dish_name": f"Meal {i}", "analysis": ANALYSIS})
+                        r.raise_for_status()
+                        ids.append(r.json()["id"])
+
+                t0 = time.perf_counter()
+                await asyncio.gather(*(create(i) for i in range(args.baseline_rows)))
+                self.legacy_ids = ids
+                return {"rows": len(ids), "rows_per_s": rate(len(ids), time.perf_counter() - t0)}
+
+            results["create_each"] = await self.phase("create_each", do_create_each)
+
+            async def do_bulk_delete():
+                ids = []
+                async with client.stream("GET", "/analyses/export", headers=auth) as r:
+                    async for line in r.aiter_lines():
+                        if line:
+                            ids.append(json.loads(line)["id"])
+                t0 = time.perf_counter()
+                deleted = 0
+                for i in range(0, len(ids), BULK_DELETE_IDS):
+                    r = await client.post("/analyses/delete", headers=auth, json={"ids": ids[i:i + BULK_DELETE_IDS]})
+                    r.raise_for_status()
+                    deleted += r.json()["deleted"]
+                return {"rows": deleted, "rows_per_s": rate(deleted, time.perf_counter() - t0)}
+
+            results["bulk_delete"] = await self.phase("bulk_delete", do_bulk_delete)
+
+            async def do_delete_each():
+                limit = asyncio.Semaphore(args.concurrency)
+
+                async def delete(aid: str):
+                    async with limit:
+                        (await client.delete(f"/analyses/{aid}", headers=legacy)).raise_for_status()
+
+                t0 = time.perf_counter()
+                await asyncio.gather(*(delete(aid) for aid in self.legacy_ids))
+                return {"rows": len(self.legacy_ids), "rows_per_s": rate(len(self.legacy_ids), time.perf_counter() - t0)}
+
+            results["delete_each"] = await self.phase("delete_each", do_delete_each)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-dir", type=Path, default=BENCH_DIR.parent)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--preview-every", type=int, default=0, help="give every Nth imported row an inline ~40 KB preview (0 = none)")
+    parser.add_argument("--export-previews", default="none", choices=["none", "url", "inline"])
+    parser.add_argument("--baseline-rows", type=int, default=2000, help="rows for the per-row create/delete baselines")
+    parser.add_argument("--concurrency", type=int, default=8, help="in-flight requests for the per-row baselines")
+    parser.add_argument("--port", type=int, default=8794)
+    parser.add_argument("--out", type=Path)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="nutri-bulk-") as tmp:
+        env = dict(
+            os.environ,
+            DB_PATH=str(Path(tmp) / "bulk.db"),
+            ANALYSIS_CACHE_PATH=str(Path(tmp) / "analysis_cache.db"),
+            PREVIEW_STORE_PATH=str(Path(tmp) / "previews"),
+            BCRYPT_ROUNDS="4",
+            IMPORT_MAX_ROWS=str(max(args.rows, 200000)),
+            LOG_LEVEL="WARNING",
+        )
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+            cwd=args.app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_until_up(f"http://127.0.0.1:{args.port}/", proc)
+            results = asyncio.run(Bench(args, proc).run())
+            db_mb = round(sum(p.stat().st_size for p in Path(tmp).glob("bulk.db*")) / 1e6, 1)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    report = {
+        "meta": {
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            **git_info(args.app_dir),
+            "rows": args.rows,
+            "preview_every": args.preview_every,
+            "db_mb_after_import": db_mb,
+        },
+        **results,
+    }
+    print(json.dumps(report, indent=1))
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(json.dumps(report, indent=1))
+
+
+if __name__ == "__main__":
+    main()
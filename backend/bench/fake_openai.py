@@ -0,0 +1,165 @@
+"""
+Local OpenAI-compatible stub for benchmarks.
+Serves POST /v1/chat/completions with a canned NutriMedAI-shaped analysis after a configurable delay.
+With "stream": true the same text is sent as SSE chunks spread evenly over the delay.
+Status codes queued on app.state.fail_next are returned (one per call) before succeeding again, and
+app.state.error_rate fails that fraction of calls at random with one of app.state.error_statuses;
+429s carry a Retry-After header. app.state.jitter adds up to that fraction of random extra latency. Requests with several images get the packed multi-image format
+(one "=== IMAGE k ===" block each plus a "=== MEAL SUMMARY ===").
+
+Run standalone:  python backend/bench/fake_openai.py --port 9100 --latency 2.0 --error-rate 0.05
+Then point the backend at it:  OPENAI_BASE_URL=http://127.0.0.1:9100/v1 OPENAI_API_KEY=sk-fake
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CANNED_ANALYSIS = """---
+DISH:
+Grilled chicken salad
+
+---
+FOOD SUMMARY:
+Grilled chicken over mixed greens with a light vinaigrette. A balanced, lean meal.
+
+---
+KEY METRICS:
+Calories: 350-420 kcal | Protein: 32g | Carbs: 14g | Fat: 18g | Fiber: 5g | Sugar: 6g | Sodium: 640mg
+
+---
+CURRENT CONDITION SUMMARY:
+Chicken: good protein.
+Dressing: moderate sodium - use less.
+[Reasoning] Lean protein and fibre help steady blood sugar.
+[Action] Use less dressing.
+
+---
+CONCERNED CONDITION SUMMARY:
+Greens: beneficial.
+[Benefit] High fibre supports heart health.
+
+---
+ALTERNATIVES:
+Request dressing on the side.
+
+---
+NUTRITION SCORE:
+78/100"""
+
+USAGE = {"prompt_tokens": 1100, "completion_tokens": 320, "total_tokens": 1420}
+
+
+def canned_response(body: dict) -> str:
+    content = body["messages"][-1]["content"]
+    images = sum(1 for part in content if part.get("type") == "image_url") if isinstance(content, list) else 0
+    if images <= 1:
+        return CANNED_ANALYSIS
+    blocks = [f"=== IMAGE {k} ===\n{CANNED_ANALYSIS}" for k in range(1, images + 1)]
+    return "\n\n".join(blocks + ["=== MEAL SUMMARY ===\nA light, protein-forward meal overall."])
+
+
+def make_app(latency: float = 1.0, jitter: float = 0.0, error_rate: float = 0.0, error_statuses=(500, 429), seed=None) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+    app.state.latency = latency
+    app.state.jitter = jitter
+    app.state.error_rate = error_rate
+    app.state.error_statuses = tuple(error_statuses)
+    app.state.calls = 0
+    app.state.errors = 0
+    app.state.streams_cancelled = 0
+    app.state.fail_next = []
+    rng = random.Random(seed)
+
+    def call_latency() -> float:
+        return app.state.latency * (1 + rng.uniform(0, app.state.jitter))
+
+    async def stream_chunks(completion_id: str, model: str, include_usage: bool):
+        # ~8 characters per chunk, roughly one token-sized piece each
+        pieces = [CANNED_ANALYSIS[i:i + 8] for i in range(0, len(CANNED_ANALYSIS), 8)]
+        delay = call_latency() / len(pieces)
+        try:
+            for piece in pieces:
+                await asyncio.sleep(delay)
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            if include_usage:
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [], "usage": USAGE,
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+        except asyncio.CancelledError:
+            app.state.streams_cancelled += 1
+            raise
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.calls += 1
+        status = None
+        if app.state.fail_next:
+            status = app.state.fail_next.pop(0)
+        elif app.state.error_rate and rng.random() < app.state.error_rate:
+            status = rng.choice(app.state.error_statuses)
+        if status is not None:
+            app.state.errors += 1
+            error = {"error": {"message": f"Injected failure ({status})", "type": "fake_error", "code": None}}
+            headers = {"retry-after": "1"} if status == 429 else None
+            return JSONResponse(error, status_code=status, headers=headers)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return StreamingResponse(stream_chunks(completion_id, body.get("model", "gpt-4o-mini"), include_usage), media_type="text/event-stream")
+        await asyncio.sleep(call_latency())
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": canned_response(body)},
+                "finish_reason": "stop",
+            }],
+            "usage": USAGE,
+        }
+
+    @app.get("/stats")
+    def stats():
+        return {"calls": app.state.calls, "errors": app.state.errors, "streams_cancelled": app.state.streams_cancelled}
+
+    return app
+
+
+def serve_in_thread(app, port: int) -> uvicorn.Server:
+    """Start an ASGI app on 127.0.0.1:port in a daemon thread; returns once it accepts connections."""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.02)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this fraction of extra random latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls failing with 500 or 429")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    app = make_app(args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,100 @@
+"""
+GET /analyses query latency at growing table sizes.
+
+Fills a temp DB (current schema via storage.migrate) with --rows analyses spread over --users users,
+then times the endpoint's queries for one user: first page, a page deep in history via the keyset
+cursor, and the sidebar projection (id, dish_name, created_at). Each is measured with the
+(user_id, created_at) index and with it dropped, which is what the pre-index schema did.
+
+    python backend/bench/list_analyses_bench.py --rows 10000 100000 1000000
+"""
+
+import argparse
+import json
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from blobs import BlobStore  # noqa: E402
+from storage import migrate  # noqa: E402
+
+FULL_COLUMNS = "id, dish_name, analysis_text, preview, preview_hash, created_at, current_conditions, concerned_conditions, user_description"
+SIDEBAR_COLUMNS = "id, dish_name, created_at"
+PAGE = 50
+
+
+def populate(conn: sqlite3.Connection, rows: int, users: int) -> str:
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    start = datetime(2024, 1, 1)
+    text = "DISH:\nGrilled chicken salad\n" + "Lorem ipsum dolor sit amet. " * 20
+    batch = []
+    for i in range(rows):
+        created = (start + timedelta(seconds=i * 37)).isoformat()
+        batch.append((str(uuid.uuid4()), random.choice(user_ids), f"Dish {i}", text, None, created, "", "", ""))
+        if len(batch) == 10000:
+            conn.executemany("INSERT INTO analyses (id, user_id, dish_name, analysis_text, preview, created_at, current_conditions, concerned_conditions, user_description) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO analyses (id, user_id, dish_name, analysis_text, preview, created_at, current_conditions, concerned_conditions, user_description) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.execute("ANALYZE")
+    return user_ids[0]
+
+
+def timed(conn: sqlite3.Connection, sql: str, params: tuple, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append(time.perf_counter() - t0)
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def measure(conn: sqlite3.Connection, user_id: str, repeat: int) -> dict:
+    first = f"SELECT {FULL_COLUMNS} FROM analyses WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?"
+    deep = f"SELECT {FULL_COLUMNS} FROM analyses WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?"
+    sidebar = f"SELECT {SIDEBAR_COLUMNS} FROM analyses WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?"
+    history = conn.execute("SELECT created_at, id FROM analyses WHERE user_id = ? ORDER BY created_at DESC, id DESC", (user_id,)).fetchall()
+    mid = history[len(history) // 2]
+    return {
+        "user_rows": len(history),
+        "first_page_ms": timed(conn, first, (user_id, PAGE + 1), repeat),
+        "deep_page_ms": timed(conn, deep, (user_id, mid[0], mid[1], PAGE + 1), repeat),
+        "sidebar_page_ms": timed(conn, sidebar, (user_id, PAGE + 1), repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(7)
+    for rows in args.rows:
+        tmp = Path(tempfile.mkdtemp())
+        conn = sqlite3.connect(tmp / "bench.db")
+        migrate(conn, preview_store=BlobStore(tmp / "previews"))
+        t0 = time.perf_counter()
+        user_id = populate(conn, rows, args.users)
+        fill_s = round(time.perf_counter() - t0, 1)
+        indexed = measure(conn, user_id, args.repeat)
+        conn.execute("DROP INDEX idx_analyses_user_created")
+        unindexed = measure(conn, user_id, max(3, args.repeat // 5))
+        conn.close()
+        shutil.rmtree(tmp)
+        print(json.dumps({"rows": rows, "fill_s": fill_s, "indexed": indexed, "no_index": unindexed}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Per-request cost of the observability middleware.
+
+Calls a tiny FastAPI app directly over ASGI (no sockets, no HTTP client) --requests times per variant,
+alternating variants call by call so machine noise hits all of them equally, and prints per-request
+latency percentiles and the overhead relative to the bare app:
+
+  bare        no middleware
+  observer    RequestObserver: request id, route histogram, one JSON access line via the log queue
+              (the listener thread formats and writes in the same process, so its GIL time is included)
+  legacy      the old @app.middleware("http") logger: logger.info + print before and after every request
+
+Log output goes to /dev/null so terminal speed does not skew the numbers. Fails (exit 1) when the
+observer's p50 overhead exceeds --budget-us.
+
+    python backend/bench/middleware_overhead_bench.py --requests 20000
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi import FastAPI  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+import observability  # noqa: E402
+
+
+def make_app(variant: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        return {"id": item_id}
+
+    if variant == "observer":
+        app.add_middleware(observability.RequestObserver)
+    elif variant == "legacy":
+        logger = logging.getLogger("legacy")
+
+        @app.middleware("http")
+        async def log_requests(request: Request, call_next):
+            logger.info("REQ %s %s", request.method, request.url.path)
+            print(f"REQ {request.method} {request.url.path}")
+            response = await call_next(request)
+            logger.info("RES %s %s -> %s", request.method, request.url.path, response.status_code)
+            print(f"RES {request.method} {request.url.path} -> {response.status_code}")
+            return response
+    return app
+
+
+async def call(app, path: str) -> None:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(apps: dict, requests: int) -> dict:
+    samples = {variant: [] for variant in apps}
+    for i in range(requests + 500):
+        for variant, app in apps.items():
+            t0 = time.perf_counter()
+            await call(app, f"/items/{i}")
+            if i >= 500:  # warm-up: route compilation, first JSON encoder use
+                samples[variant].append(time.perf_counter() - t0)
+    return samples
+
+
+def summary(samples: list) -> dict:
+    ordered = sorted(samples)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e6, 1)  # noqa: E731
+    return {"p50_us": pick(0.5), "p99_us": pick(0.99), "mean_us": round(statistics.mean(samples) * 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--budget-us", type=float, default=75.0, help="max allowed p50 overhead of the observer")
+    args = parser.parse_args()
+
+    devnull = open(os.devnull, "w")
+    sys.stdout, real_stdout = devnull, sys.stdout  # the queue listener's StreamHandler binds sys.stdout here
+    observability.setup_logging("json", "INFO")
+    apps = {variant: make_app(variant) for variant in ("bare", "observer", "legacy")}
+    with contextlib.redirect_stdout(devnull):
+        samples = asyncio.run(measure(apps, args.requests))
+    results = {variant: summary(s) for variant, s in samples.items()}
+    results["log_queue"] = observability.logging_stats()
+    observability.stop_logging()
+    sys.stdout = real_stdout
+
+    for variant in ("observer", "legacy"):
+        results[variant]["overhead_p50_us"] = round(results[variant]["p50_us"] - results["bare"]["p50_us"], 1)
+    results["budget_p50_us"] = args.budget_us
+    print(json.dumps(results, indent=1))
+    sys.exit(0 if results["observer"]["overhead_p50_us"] <= args.budget_us else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+GET /analyses/search query latency: FTS5 index vs a naive LIKE scan.
+
+Fills a temp DB (current schema via storage.migrate, so the FTS triggers are live) with --rows analyses
+built from a food vocabulary. One "heavy" user owns --heavy-share of the rows; the rest are spread over
+--users users. For each query term it times, for the heavy user and for a typical user:
+
+  like        user_id filter + LIKE '%term%' over dish_name/analysis_text/user_description, newest first
+  fts         the endpoint's query: MATCH scoped with the user_id phrase, bm25 ranked, highlights/snippet
+  fts_join    same MATCH without the user_id phrase, filtering on analyses.user_id after the join
+
+Also reports fill time with the sync triggers installed vs dropped (the write cost of the index).
+
+    python backend/bench/search_bench.py --rows 100000 300000
+"""
+
+import argparse
+import json
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from blobs import BlobStore  # noqa: E402
+from storage import migrate  # noqa: E402
+
+FOODS = [
+    "chicken", "salmon", "tofu", "paneer", "beef", "lentil", "chickpea", "rice", "quinoa", "noodle", "pasta",
+    "pizza", "burger", "salad", "curry", "soup", "taco", "sushi", "omelette", "pancake", "oatmeal", "yogurt",
+    "avocado", "spinach", "broccoli", "mushroom", "tomato", "potato", "mango", "banana", "almond", "cheese",
+]
+STYLES = ["grilled", "fried", "steamed", "roasted", "baked", "spicy", "creamy", "fresh", "smoked", "stuffed"]
+WORDS = ("protein fiber sodium sugar carbs portion sauce dressing oil butter glycemic cholesterol potassium "
+         "vegetables whole grain moderate reduce choose skip serving balanced heart kidney diabetes").split()
+# Analysis bodies draw from a Zipf-like vocabulary: the words above are common, the long tail is rare
+VOCAB = WORDS + sorted({
+    "".join(rng.choice("bdfgklmnprstvz") + rng.choice("aeiou") for _ in range(rng.randint(2, 4)))
+    for rng in (random.Random(i) for i in range(3000))
+} - set(FOODS))
+VOCAB_WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCAB))]
+PAGE = 20
+# dish-name word, style word, prefix, two words, very common body word, rare body word, no match
+TERMS = ["chicken", "grilled", "chick", "quinoa salad", "protein", VOCAB[len(WORDS) + 2500], "durian"]
+
+FTS_SQL = """SELECT a.id, highlight(analyses_fts, 1, '<mark>', '</mark>'), snippet(analyses_fts, 2, '<mark>', '</mark>', '…', 16),
+                    analyses_fts.rank
+             FROM analyses_fts JOIN analyses a ON a.rowid = analyses_fts.rowid
+             WHERE analyses_fts MATCH ? AND a.user_id = ? ORDER BY analyses_fts.rank LIMIT ?"""
+LIKE_SQL = """SELECT id FROM analyses
+              WHERE user_id = ? AND (dish_name LIKE ? OR analysis_text LIKE ? OR user_description LIKE ?)
+              ORDER BY created_at DESC, id DESC LIMIT ?"""
+
+
+def analysis_text(dish: str) -> str:
+    body = " ".join(random.choices(VOCAB, VOCAB_WEIGHTS, k=120))
+    return f"DISH:\n{dish}\n\nKEY METRICS:\nCalories: 400-500 kcal | Protein: 20g\n\nCURRENT CONDITION SUMMARY:\n{body}"
+
+
+def populate(conn: sqlite3.Connection, rows: int, users: int, heavy_share: float):
+    heavy = str(uuid.uuid4())
+    others = [str(uuid.uuid4()) for _ in range(users)]
+    start = datetime(2024, 1, 1)
+    sql = "INSERT INTO analyses (id, user_id, dish_name, analysis_text, created_at, user_description) VALUES (?, ?, ?, ?, ?, ?)"
+    batch = []
+    for i in range(rows):
+        owner = heavy if random.random() < heavy_share else random.choice(others)
+        dish = f"{random.choice(STYLES).title()} {random.choice(FOODS)} {random.choice(FOODS)}"
+        note = f"{random.choice(STYLES)} {random.choice(FOODS)} for lunch" if random.random() < 0.3 else ""
+        batch.append((str(uuid.uuid4()), owner, dish, analysis_text(dish), (start + timedelta(seconds=i * 37)).isoformat(), note))
+        if len(batch) == 5000:
+            conn.executemany(sql, batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+    conn.commit()
+    conn.execute("ANALYZE")
+    typical = conn.execute(
+        "SELECT user_id FROM analyses WHERE user_id != ? GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1", (heavy,)
+    ).fetchone()[0]
+    return heavy, typical
+
+
+def timed(conn: sqlite3.Connection, sql: str, params: tuple, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append(time.perf_counter() - t0)
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def match_expr(term: str, user_id: str = None) -> str:
+    # Same shape as main.fts_query
+    words = term.split()
+    expr = " ".join(f'"{w}"' for w in words[:-1]) + f' "{words[-1]}"*'
+    return f'user_id : "{user_id}" AND ({expr.strip()})' if user_id else expr.strip()
+
+
+def measure(conn: sqlite3.Connection, user_id: str, repeat: int) -> dict:
+    out = {"user_rows": conn.execute("SELECT COUNT(*) FROM analyses WHERE user_id = ?", (user_id,)).fetchone()[0]}
+    for term in TERMS:
+        like = f"%{term}%"
+        out[term] = {
+            "like_ms": timed(conn, LIKE_SQL, (user_id, like, like, like, PAGE), repeat),
+            "fts_ms": timed(conn, FTS_SQL, (match_expr(term, user_id), user_id, PAGE), repeat),
+            "fts_join_ms": timed(conn, FTS_SQL, (match_expr(term), user_id, PAGE), max(3, repeat // 4)),
+        }
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--heavy-share", type=float, default=0.05, help="fraction of rows owned by the heavy user")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        result = {"rows": rows}
+        for triggers in (True, False):
+            random.seed(7)
+            tmp = Path(tempfile.mkdtemp())
+            conn = sqlite3.connect(tmp / "bench.db")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            migrate(conn, preview_store=BlobStore(tmp / "previews"))
+            if not triggers:
+                for name in ("insert", "delete", "update"):
+                    conn.execute(f"DROP TRIGGER analyses_fts_{name}")
+            t0 = time.perf_counter()
+            heavy, typical = populate(conn, rows, args.users, args.heavy_share)
+            result["fill_s_with_fts" if triggers else "fill_s_without_fts"] = round(time.perf_counter() - t0, 1)
+            if triggers:
+                result["db_mb"] = round((tmp / "bench.db").stat().st_size / 1e6, 1)
+                result["heavy_user"] = measure(conn, heavy, args.repeat)
+                result["typical_user"] = measure(conn, typical, args.repeat)
+            conn.close()
+            shutil.rmtree(tmp)
+        print(json.dumps(result, indent=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Cold-start profile: how long a sleeping instance takes to answer its first requests.
+
+Each run boots the backend the way the Procfile/render.yaml do (uvicorn main:app) on an empty data dir,
+like a scale-to-zero instance with ephemeral disk waking up, and times from process spawn to:
+
+  live         first response from /healthz (from / on trees without it)
+  ready        /healthz?ready=true answers 200, i.e. warm-up finished (= live on trees without it)
+  first_login  POST /auth/login as the global admin, sent the moment the server is live
+  first_list   GET /analyses with the returned token, right after
+
+For first_login/first_list it reports both the request latency and the time since spawn. Separately,
+--import-runs fresh interpreters time `import main` alone, and one `python -X importtime` run lists the
+slowest imports made directly by main. OPENAI_API_KEY is set to a dummy value so the OpenAI client is
+built as in production; no upstream calls are made.
+
+    python backend/bench/startup_bench.py --runs 5 --out bench-results/startup.json
+
+To profile another commit: git worktree add /tmp/nutri-old <commit>, then --app-dir /tmp/nutri-old/backend.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from suite import git_info  # noqa: E402
+
+ADMIN_EMAIL = "prissol@admin.com"
+ADMIN_PASSWORD = "prissol@admin"
+
+
+def backend_env(data_dir: Path, bcrypt_rounds: int) -> dict:
+    return dict(
+        os.environ,
+        OPENAI_API_KEY="sk-fake",
+        OPENAI_BASE_URL="http://127.0.0.1:9/v1",
+        DB_PATH=str(data_dir / "cold.db"),
+        ANALYSIS_CACHE_PATH=str(data_dir / "analysis_cache.db"),
+        PREVIEW_STORE_PATH=str(data_dir / "previews"),
+        BCRYPT_ROUNDS=str(bcrypt_rounds),
+        GLOBAL_ADMIN_EMAIL=ADMIN_EMAIL,
+        GLOBAL_ADMIN_PASSWORD=ADMIN_PASSWORD,
+        LOG_LEVEL="WARNING",
+    )
+
+
+# ----- Imports -----
+def time_import(app_dir: Path, env: dict) -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=app_dir, env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def import_profile(app_dir: Path, env: dict, top: int) -> dict:
+    """Cumulative import time of main and of each module main imports directly, slowest first."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=app_dir, env=env, capture_output=True, text=True, check=True)
+    total, direct = None, []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, raw = line.split("|")
+        name = raw.strip()
+        depth = (len(raw) - len(raw.lstrip()) - 1) // 2
+        if depth == 0 and name == "main":
+            total = int(cumulative) / 1000
+        elif depth == 1:
+            direct.append((name, int(cumulative) / 1000))
+    direct.sort(key=lambda item: item[1], reverse=True)
+    return {"main_ms": total, "slowest": {name: round(ms, 1) for name, ms in direct[:top]}}
+
+
+# ----- Cold starts -----
+async def poll(client: httpx.AsyncClient, url: str, proc: subprocess.Popen, timeout: float) -> httpx.Response:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"backend exited with code {proc.returncode}")
+        try:
+            return await client.get(url)
+        except httpx.TransportError:
+            await asyncio.sleep(0.01)
+    raise RuntimeError(f"{url} did not answer within {timeout}s")
+
+
+async def cold_start(app_dir: Path, port: int, bcrypt_rounds: int, timeout: float) -> dict:
+    base = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory(prefix="nutri-cold-") as tmp:
+        spawned = time.perf_counter()
+        since = lambda: round((time.perf_counter() - spawned) * 1000, 1)  # noqa: E731
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=app_dir, env=backend_env(Path(tmp), bcrypt_rounds), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        result = {}
+        try:
+            async with httpx.AsyncClient(base_url=base, timeout=timeout) as client:
+                response = await poll(client, "/healthz", proc, timeout)
+                has_healthz = response.status_code != 404
+                if not has_healthz:
+                    await client.get("/")
+                result["live_ms"] = since()
+
+                async def ready():
+                    while has_healthz and (await client.get("/healthz", params={"ready": "true"})).status_code != 200:
+                        await asyncio.sleep(0.01)
+                    result["ready_ms"] = since()
+
+                async def first_requests():
+                    t0 = time.perf_counter()
+                    login = await client.post("/auth/login", json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD})
+                    result["first_login_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                    result["login_done_ms"] = since()
+                    login.raise_for_status()
+                    t0 = time.perf_counter()
+                    listing = await client.get("/analyses", headers={"Authorization": f"Bearer {login.json()['access_token']}"})
+                    result["first_list_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                    result["list_done_ms"] = since()
+                    listing.raise_for_status()
+
+                await asyncio.gather(ready(), first_requests())
+                if has_healthz:
+                    result["warmup"] = (await client.get("/healthz")).json().get("steps")
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return result
+
+
+def summarize(values: List[float]) -> Optional[dict]:
+    if not values:
+        return None
+    return {"median": round(statistics.median(values), 1), "min": round(min(values), 1), "max": round(max(values), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-dir", type=Path, default=BENCH_DIR.parent)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts")
+    parser.add_argument("--import-runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12, help="imports to list in the profile")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12, help="production default; the admin hash is created on an empty DB")
+    parser.add_argument("--port", type=int, default=8793)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--out", type=Path)
+    args = parser.parse_args()
+    app_dir = args.app_dir.resolve()
+
+    with tempfile.TemporaryDirectory(prefix="nutri-import-") as tmp:
+        env = backend_env(Path(tmp), args.bcrypt_rounds)
+        imports = [time_import(app_dir, env) * 1000 for _ in range(args.import_runs)]
+        profile = import_profile(app_dir, env, args.top)
+
+    runs = []
+    for i in range(args.runs):
+        run = asyncio.run(cold_start(app_dir, args.port, args.bcrypt_rounds, args.timeout))
+        print(json.dumps({"run": i, **run}), file=sys.stderr)
+        runs.append(run)
+
+    keys = ("live_ms", "ready_ms", "first_login_ms", "login_done_ms", "first_list_ms", "list_done_ms")
+    results = {
+        "meta": {
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "app_dir": str(app_dir),
+            **git_info(app_dir),
+            "python": sys.version.split()[0],
+            "bcrypt_rounds": args.bcrypt_rounds,
+        },
+        "import_main_ms": summarize(imports),
+        "import_profile": profile,
+        "cold_start": {key: summarize([run[key] for run in runs if key in run]) for key in keys},
+        "runs": runs,
+    }
+    print(json.dumps({k: v for k, v in results.items() if k != "runs"}, indent=1))
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(json.dumps(results, indent=1))
+
+
+if __name__ == "__main__":
+    main()
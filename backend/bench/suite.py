@@ -0,0 +1,523 @@
+"""
+End-to-end benchmark suite: realistic request mixes against a booted backend and a fake OpenAI server.
+
+Starts bench/fake_openai.py and the backend (uvicorn subprocesses; temp DB_PATH, preview store and
+analysis cache; /analyze rate limits lifted, everything else at its defaults), seeds users and analyses,
+then runs each scenario and reports throughput, p50/p95/p99/max latency per operation (successful
+requests only), errors by status, upstream calls, and backend memory (RSS of the server process and
+its worker processes, sampled every 50 ms). Results are saved as JSON; --compare prints the changes
+against an earlier run.
+
+Scenarios:
+  login_burst     every seeded user logs in at once, --rounds times (bcrypt at --bcrypt-rounds)
+  dashboard       dashboard sessions: /auth/me, /analyses, every thumbnail on the page (6 at a time,
+                  like a browser) and one full preview; users own --analyses-per-user large-preview rows
+  analyze         /analyze uploads, image sizes drawn from small/medium/large photos, cache misses
+  analyze_stream  /analyze/stream; reports time to first token and to the done event
+  mixed           the above interleaved by --mix weights for --duration seconds
+
+    python backend/bench/suite.py --out bench-results/base.json
+    python backend/bench/suite.py --scenarios analyze mixed --error-rate 0.05 --out new.json --compare base.json
+
+To benchmark another commit, check it out elsewhere and pass its backend dir (the harness and fake
+server always come from this checkout, so both runs use identical load):
+
+    git worktree add /tmp/nutri-old <commit>
+    python backend/bench/suite.py --app-dir /tmp/nutri-old/backend --out old.json
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+from PIL import Image, ImageFilter
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent
+SCENARIOS = ["login_burst", "dashboard", "analyze", "analyze_stream", "mixed"]
+# Phone-camera style uploads; the backend downsizes them before the vision call
+IMAGE_SIZES = {"small": (640, 480), "medium": (1600, 1200), "large": (4032, 3024)}
+PASSWORD = "bench-password"
+
+
+# ----- Processes -----
+def wait_until_up(url: str, proc: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {proc.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{url} did not start")
+
+
+def start_fake_openai(args) -> subprocess.Popen:
+    cmd = [
+        sys.executable, str(BENCH_DIR / "fake_openai.py"), "--port", str(args.openai_port),
+        "--latency", str(args.latency), "--jitter", str(args.jitter), "--error-rate", str(args.error_rate),
+        "--seed", str(args.seed),
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_until_up(f"http://127.0.0.1:{args.openai_port}/stats", proc)
+    return proc
+
+
+def start_backend(args, data_dir: Path) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-fake",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{args.openai_port}/v1",
+        DB_PATH=str(data_dir / "bench.db"),
+        ANALYSIS_CACHE_PATH=str(data_dir / "analysis_cache.db"),
+        PREVIEW_STORE_PATH=str(data_dir / "previews"),
+        BCRYPT_ROUNDS=str(args.bcrypt_rounds),
+        # The suite measures capacity, not the per-caller limits (every request comes from one IP)
+        ANALYZE_RATE_PER_MINUTE="1000000",
+        ANALYZE_BURST="1000000",
+        ANALYZE_ANON_RATE_PER_MINUTE="1000000",
+        ANALYZE_ANON_BURST="1000000",
+        LOG_LEVEL="WARNING",
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=args.app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_until_up(f"http://127.0.0.1:{args.port}/", proc)
+    return proc
+
+
+def process_tree(pid: int) -> List[int]:
+    pids, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def rss_mb(pid: int, tree: bool = False) -> Optional[float]:
+    """Resident set size from /proc (Linux only; None elsewhere)."""
+    total = 0
+    for p in process_tree(pid) if tree else [pid]:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            if p == pid:
+                return None
+    return round(total / 1024, 1)
+
+
+class MemorySampler:
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            value = rss_mb(self.pid, tree=True)
+            if value is not None:
+                self.samples.append(value)
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self.start = rss_mb(self.pid)
+        self.start_tree = rss_mb(self.pid, tree=True)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+        self.result = {
+            "server_start_mb": self.start,
+            "server_end_mb": rss_mb(self.pid),
+            "tree_start_mb": self.start_tree,
+            "tree_end_mb": rss_mb(self.pid, tree=True),
+            "tree_peak_mb": max(self.samples) if self.samples else None,
+        }
+
+
+# ----- Test data -----
+def photo(width: int, height: int, seed: int, quality: int = 90) -> bytes:
+    """A JPEG with photo-like entropy: blurred colour noise over a gradient, so sizes resemble real uploads."""
+    rng = random.Random(seed)
+    small = Image.new("RGB", (max(1, width // 16), max(1, height // 16)))
+    small.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(small.width * small.height)])
+    image = small.resize((width, height), Image.BICUBIC)
+    # Seeded (Image.effect_noise is not), so every run uploads byte-identical photos
+    noise = Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3)).filter(ImageFilter.GaussianBlur(1))
+    image = Image.blend(image, noise, 0.15)
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=quality)
+    return out.getvalue()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.count = 0
+
+    def record(self, op: str, seconds: float, status, request: bool = True) -> None:
+        """request=False for derived timings (a whole session, time to first token) that are not extra requests."""
+        self.count += request
+        if status == 200 or status == 304:
+            self.latencies[op].append(seconds)
+        else:
+            self.errors[op][str(status)] += 1
+
+    async def timed(self, op: str, request):
+        """Await an httpx request coroutine, recording its latency under op."""
+        t0 = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError as e:
+            self.record(op, time.perf_counter() - t0, type(e).__name__)
+            return None
+        self.record(op, time.perf_counter() - t0, response.status_code)
+        return response
+
+    def summary(self) -> dict:
+        ops = {}
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            samples = sorted(self.latencies.get(op, []))
+            ops[op] = {"ok": len(samples), "errors": dict(self.errors.get(op, {}))}
+            if samples:
+                ops[op].update({
+                    "p50_ms": percentile(samples, 0.50),
+                    "p95_ms": percentile(samples, 0.95),
+                    "p99_ms": percentile(samples, 0.99),
+                    "mean_ms": round(sum(samples) / len(samples) * 1000, 1),
+                    "max_ms": round(samples[-1] * 1000, 1),
+                })
+        return ops
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    # Nearest rank
+    index = max(0, min(len(ordered) - 1, int(round(q * len(ordered) + 0.5)) - 1))
+    return round(ordered[index] * 1000, 1)
+
+
+# ----- Sessions -----
+class Suite:
+    def __init__(self, args, base: str):
+        self.args = args
+        self.base = base
+        self.rng = random.Random(args.seed)
+        self.users: List[dict] = []
+        self.photos = {
+            size: [photo(w, h, seed=args.seed * 100 + i) for i in range(args.photo_variants)]
+            for size, (w, h) in IMAGE_SIZES.items()
+        }
+        self.request_seq = 0
+
+    def client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(max_connections=self.args.concurrency * 8, max_keepalive_connections=self.args.concurrency * 8)
+        return httpx.AsyncClient(base_url=self.base, timeout=300, limits=limits)
+
+    async def seed(self) -> dict:
+        started = time.perf_counter()
+        async with self.client() as client:
+            limit = asyncio.Semaphore(8)
+
+            async def register(i: int):
+                async with limit:
+                    email = f"bench{i}@example.com"
+                    r = await client.post("/auth/register", json={"email": email, "password": PASSWORD})
+                    r.raise_for_status()
+                    self.users.append({"email": email, "token": r.json()["access_token"]})
+
+            await asyncio.gather(*(register(i) for i in range(self.args.users)))
+            # Large previews like the frontend stores (a downsized camera photo as a data URL)
+            previews = [
+                "data:image/jpeg;base64," + base64.b64encode(photo(1280, 960, seed=self.args.seed * 1000 + i, quality=85)).decode()
+                for i in range(self.args.photo_variants)
+            ]
+            analysis = (BENCH_DIR / "fake_openai.py").read_text().split('CANNED_ANALYSIS = """', 1)[1].split('"""', 1)[0]
+
+            async def create(user: dict, i: int):
+                async with limit:
+                    r = await client.post(
+                        "/analyses",
+                        headers={"Authorization": f"Bearer {user['token']}"},
+                        json={"dish_name": f"Meal {i}", "analysis": analysis, "preview": previews[i % len(previews)], "user_description": f"meal {i}"},
+                    )
+                    r.raise_for_status()
+
+            await asyncio.gather(*(
+                create(user, i) for user in self.users[:self.args.dashboard_users] for i in range(self.args.analyses_per_user)
+            ))
+        return {
+            "users": len(self.users),
+            "analyses": self.args.dashboard_users * self.args.analyses_per_user,
+            "preview_kb": round(sum(len(p) for p in previews) / len(previews) * 3 / 4 / 1024, 1),
+            "photo_kb": {size: round(sum(map(len, items)) / len(items) / 1024, 1) for size, items in self.photos.items()},
+            "seconds": round(time.perf_counter() - started, 1),
+        }
+
+    def unique_description(self) -> str:
+        # The result cache keys on the description, so every upload is a cache miss
+        self.request_seq += 1
+        return f"bench request {self.request_seq}"
+
+    async def login(self, client, rec: Recorder, user: dict):
+        await rec.timed("login", client.post("/auth/login", json={"email": user["email"], "password": PASSWORD}))
+
+    async def dashboard(self, client, rec: Recorder, user: dict):
+        t0 = time.perf_counter()
+        headers = {"Authorization": f"Bearer {user['token']}"}
+        await rec.timed("auth_me", client.get("/auth/me", headers=headers))
+        r = await rec.timed("list_analyses", client.get("/analyses", headers=headers))
+        rows = r.json() if r is not None and r.status_code == 200 else []
+        browser = asyncio.Semaphore(6)
+
+        async def image(op: str, url: str):
+            async with browser:
+                await rec.timed(op, client.get(url))
+
+        urls = [row["thumbnail"] for row in rows if (row.get("thumbnail") or "").startswith("/")]
+        await asyncio.gather(*(image("thumbnail", url) for url in urls))
+        if rows and (rows[0].get("preview") or "").startswith("/"):
+            await image("preview", rows[0]["preview"])
+        rec.record("dashboard_session", time.perf_counter() - t0, 200, request=False)
+
+    async def analyze(self, client, rec: Recorder, size: Optional[str] = None):
+        size = size or self.rng.choices(list(IMAGE_SIZES), weights=self.args.size_weights)[0]
+        data = self.rng.choice(self.photos[size])
+        await rec.timed(f"analyze_{size}", client.post(
+            "/analyze",
+            files={"file": (f"{size}.jpg", data, "image/jpeg")},
+            data={"current_conditions": "Diabetes", "concerned_conditions": "Heart disease", "user_description": self.unique_description()},
+        ))
+
+    async def analyze_stream(self, client, rec: Recorder):
+        data = self.rng.choice(self.photos["medium"])
+        t0 = time.perf_counter()
+        first = None
+        status = None
+        try:
+            async with client.stream(
+                "POST", "/analyze/stream",
+                files={"file": ("medium.jpg", data, "image/jpeg")},
+                data={"current_conditions": "Diabetes", "user_description": self.unique_description()},
+            ) as r:
+                status = r.status_code
+                async for line in r.aiter_lines():
+                    if first is None and line.startswith("event: token"):
+                        first = time.perf_counter() - t0
+                    if line.startswith("event: error"):
+                        status = "sse_error"
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        if first is not None:
+            rec.record("stream_first_token", first, 200, request=False)
+        rec.record("stream_done", time.perf_counter() - t0, status)
+
+    # ----- Scenarios -----
+    async def run_scenario(self, name: str, pid: int) -> dict:
+        rec = Recorder()
+        calls_before = httpx.get(f"http://127.0.0.1:{self.args.openai_port}/stats").json()
+        async with self.client() as client:
+            with MemorySampler(pid) as memory:
+                t0 = time.perf_counter()
+                await getattr(self, f"scenario_{name}")(client, rec)
+                wall = time.perf_counter() - t0
+        calls_after = httpx.get(f"http://127.0.0.1:{self.args.openai_port}/stats").json()
+        return {
+            "wall_s": round(wall, 2),
+            "requests": rec.count,
+            "throughput_rps": round(rec.count / wall, 2) if wall else None,
+            "ops": rec.summary(),
+            "memory": memory.result,
+            "upstream": {k: calls_after[k] - calls_before[k] for k in calls_after},
+        }
+
+    async def closed_loop(self, count: int, job):
+        """Run job(i) count times with --concurrency in flight."""
+        queue = iter(range(count))
+
+        async def worker():
+            for i in queue:
+                await job(i)
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+    async def scenario_login_burst(self, client, rec):
+        for _ in range(self.args.rounds):
+            await asyncio.gather(*(self.login(client, rec, user) for user in self.users))
+
+    async def scenario_dashboard(self, client, rec):
+        users = self.users[:self.args.dashboard_users]
+        await self.closed_loop(self.args.requests, lambda i: self.dashboard(client, rec, users[i % len(users)]))
+
+    async def scenario_analyze(self, client, rec):
+        await self.closed_loop(self.args.requests, lambda i: self.analyze(client, rec))
+
+    async def scenario_analyze_stream(self, client, rec):
+        await self.closed_loop(self.args.requests, lambda i: self.analyze_stream(client, rec))
+
+    async def scenario_mixed(self, client, rec):
+        kinds = list(self.args.mix)
+        weights = [self.args.mix[k] for k in kinds]
+        deadline = time.perf_counter() + self.args.duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                kind = self.rng.choices(kinds, weights=weights)[0]
+                user = self.rng.choice(self.users[:self.args.dashboard_users] if kind == "dashboard" else self.users)
+                if kind == "login":
+                    await self.login(client, rec, user)
+                elif kind == "dashboard":
+                    await self.dashboard(client, rec, user)
+                elif kind == "analyze":
+                    await self.analyze(client, rec)
+                else:
+                    await self.analyze_stream(client, rec)
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+
+# ----- Results -----
+def git_info(app_dir: Path) -> dict:
+    def git(*cmd):
+        try:
+            return subprocess.run(["git", "-C", str(app_dir), *cmd], capture_output=True, text=True, timeout=30).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+
+    return {"commit": git("rev-parse", "--short", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--", "."))}
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """Print per-op latency/throughput changes; return the regressions beyond threshold (fraction)."""
+    regressions = []
+    print(f"\nvs {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')})")
+    for name, result in current["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            continue
+        print(f"{name}: throughput {base['throughput_rps']} -> {result['throughput_rps']} rps, "
+              f"peak RSS {base['memory']['tree_peak_mb']} -> {result['memory']['tree_peak_mb']} MB")
+        for op, stats in result["ops"].items():
+            old = base["ops"].get(op)
+            if not old or "p50_ms" not in old or "p50_ms" not in stats:
+                continue
+            cells = []
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                change = (stats[key] - old[key]) / old[key] if old[key] else 0.0
+                cells.append(f"{key[:3]} {old[key]} -> {stats[key]} ({change:+.0%})")
+                if change > threshold:
+                    regressions.append(f"{name}/{op} {key} {change:+.0%}")
+            print(f"  {op:20} " + "  ".join(cells))
+    return regressions
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--out", type=Path, help="write results JSON here")
+    parser.add_argument("--compare", type=Path, help="earlier results JSON to diff against")
+    parser.add_argument("--regression-threshold", type=float, default=0.10, help="fractional p50/p95/p99 increase flagged")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit 1 if --compare finds regressions")
+    parser.add_argument("--app-dir", type=Path, default=BACKEND_DIR)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=64, help="sessions/uploads per count-based scenario")
+    parser.add_argument("--duration", type=float, default=20, help="seconds for the mixed scenario")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("login=1,dashboard=6,analyze=2,stream=1"))
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=2, help="login_burst repetitions")
+    parser.add_argument("--dashboard-users", type=int, default=10)
+    parser.add_argument("--analyses-per-user", type=int, default=30)
+    parser.add_argument("--size-weights", type=float, nargs=3, default=[0.3, 0.5, 0.2], metavar=("SMALL", "MEDIUM", "LARGE"))
+    parser.add_argument("--photo-variants", type=int, default=4)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=1.0, help="fake OpenAI seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.2, help="fake OpenAI extra random latency (fraction)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake OpenAI fraction of failed calls")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=9210)
+    parser.add_argument("--openai-port", type=int, default=9110)
+    args = parser.parse_args()
+    args.dashboard_users = min(args.dashboard_users, args.users)
+
+    data_dir = Path(tempfile.mkdtemp(prefix="nutri-bench-"))
+    fake = start_fake_openai(args)
+    backend = None
+    try:
+        backend = start_backend(args, data_dir)
+        suite = Suite(args, f"http://127.0.0.1:{args.port}")
+        seeded = asyncio.run(suite.seed())
+        print(json.dumps({"seed": seeded}))
+        results = {
+            "meta": {
+                **git_info(args.app_dir),
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "args": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+                "seed_data": seeded,
+            },
+            "scenarios": {},
+        }
+        for name in args.scenarios:
+            result = asyncio.run(suite.run_scenario(name, backend.pid))
+            results["scenarios"][name] = result
+            print(json.dumps({name: result}))
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait()
+        fake.terminate()
+        fake.wait()
+
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(json.dumps(results, indent=1))
+    if args.compare:
+        regressions = compare(json.loads(args.compare.read_text()), results, args.regression_threshold)
+        if regressions:
+            print("regressions: " + ", ".join(regressions))
+            if args.fail_on_regression:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Local vision backend throughput: micro-batching on vs off.
+
+Drives LocalBackend directly (no HTTP) with the deterministic stub engine, whose simulated cost is
+--batch-ms per forward pass plus --item-ms per request, i.e. the shape of batched CPU inference.
+For each --batch-sizes value it submits --requests analyses with --concurrency in flight and prints
+throughput, latency percentiles and the observed batch sizes. Batch size 1 is the unbatched baseline.
+
+    python backend/bench/vision_batch_bench.py --requests 64 --concurrency 16 --batch-sizes 1 4 8
+
+Pass --engine smolvlm (needs torch + transformers and the weights) to measure the real model.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from imaging import PreparedImage  # noqa: E402
+from vision import LocalBackend  # noqa: E402
+
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010802000000907753de"
+    "0000000c49444154789c6338916204000356015fe81784520000000049454e44ae426082"
+)
+
+
+def image(i: int) -> PreparedImage:
+    # Distinct bytes per request so the stub output differs; the trailing bytes are ignored by decoders
+    data = TINY_PNG + hashlib.sha256(str(i).encode()).digest()
+    return PreparedImage(
+        data_url="data:image/png;base64," + base64.b64encode(data).decode(), mime="image/png", detail="low",
+        bytes_in=len(data), bytes_out=len(data), width=1, height=1, seconds=0.0,
+    )
+
+
+def percentile(samples, q: float) -> float:
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+
+async def run(args, batch_size: int) -> dict:
+    backend = LocalBackend(
+        args.engine, args.model, workers=args.workers, max_batch=batch_size, max_wait=args.wait_ms / 1000,
+        max_queue=args.requests, max_new_tokens=args.max_new_tokens,
+        options={"stub_batch_ms": args.batch_ms, "stub_item_ms": args.item_ms},
+    )
+    backend.start()
+    # Warm-up outside the timed window: spawning workers and loading the engine
+    await backend.complete("warm-up", [image(-1)], args.max_new_tokens)
+    limit = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with limit:
+            t0 = time.perf_counter()
+            await backend.complete("Analyze this food image.", [image(i)], args.max_new_tokens)
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(args.requests)])
+    elapsed = time.perf_counter() - t0
+    sizes = backend.stats()["scheduler"]["batch_size"].get("total", {})
+    await backend.close()
+    return {
+        "batch_size": batch_size,
+        "throughput_rps": round(args.requests / elapsed, 2),
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+        # includes the warm-up request
+        "mean_batch": round(sizes["sum"] / sizes["count"], 2) if sizes else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engine", default="stub")
+    parser.add_argument("--model", default="stub")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--wait-ms", type=float, default=25)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--batch-ms", type=float, default=200, help="stub: simulated cost per forward pass")
+    parser.add_argument("--item-ms", type=float, default=40, help="stub: simulated cost per request in a batch")
+    parser.add_argument("--max-new-tokens", type=int, default=700)
+    args = parser.parse_args()
+    for batch_size in args.batch_sizes:
+        print(json.dumps(asyncio.run(run(args, batch_size))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+NutriMedAI preview blob store.
+Content-addressed files on disk (deduplicated by SHA-256) with lazily generated, cached JPEG thumbnails.
+Pillow is optional; without it thumbnail requests fall back to the original image.
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+try:
+    from .imaging import load_pillow
+except ImportError:  # started as `uvicorn main:app` from inside backend/
+    from imaging import load_pillow
+
+THUMBNAIL_SIZES = (128, 256, 512)
+
+_DATA_URL_RE = re.compile(r"^data:(image/[a-zA-Z0-9.+-]+);base64,", re.IGNORECASE)
+# Previews are served back with their stored MIME type from the app's origin, so only raster formats a browser
+# can't execute are accepted (no SVG, which may carry <script>)
+_EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp", "image/gif": ".gif"}
+PREVIEW_TYPES = frozenset(_EXTENSIONS)
+
+
+def sniff_image_type(data: bytes) -> Optional[str]:
+    """The PREVIEW_TYPES format the bytes actually are (by magic number), or None."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def parse_data_url(value: Optional[str]) -> Optional[Tuple[str, bytes]]:
+    """Return (mime, bytes) for a base64 JPEG/PNG/WebP/GIF data URL whose bytes are that format, or None for anything else."""
+    if not value:
+        return None
+    m = _DATA_URL_RE.match(value)
+    if not m:
+        return None
+    mime = m.group(1).lower()
+    mime = "image/jpeg" if mime == "image/jpg" else mime
+    if mime not in PREVIEW_TYPES:
+        return None
+    try:
+        data = base64.b64decode(value[m.end():], validate=False)
+    except (binascii.Error, ValueError):
+        return None
+    return (mime, data) if sniff_image_type(data) == mime else None
+
+
+class KeyedLocks:
+    """One lock per key, created on first use and dropped once nobody holds or waits for it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks: Dict[Hashable, list] = {}  # key -> [lock, holders + waiters]
+
+    @contextmanager
+    def hold(self, key: Hashable):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+
+class BlobStore:
+    """Files live at root/ab/<sha256><ext>; thumbnails at root/thumbs/<size>/<sha256>.jpg."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._blob_locks = KeyedLocks()
+        self._thumb_locks = KeyedLocks()
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @contextmanager
+    def locked(self, digests: Iterable[str]):
+        """Hold the locks of these blobs, taken in sorted order so two holders can't deadlock.
+
+        Writers hold them from put() until the rows referencing the blobs are committed; cleanup holds them
+        from its "still referenced?" check through delete(). Otherwise a put() that finds the file already
+        on disk could be followed by that file being deleted under the new row.
+        """
+        with ExitStack() as stack:
+            for digest in sorted(set(digests)):
+                stack.enter_context(self._blob_locks.hold(digest))
+            yield
+
+    def _path(self, digest: str, mime: str) -> Path:
+        return self.root / digest[:2] / f"{digest}{_EXTENSIONS.get(mime, '.bin')}"
+
+    def _write_atomic(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def put(self, data: bytes, mime: str, digest: Optional[str] = None) -> str:
+        """Store bytes (no-op if already present) and return their SHA-256 digest (pass it if already computed)."""
+        digest = digest or self.digest(data)
+        path = self._path(digest, mime)
+        if not path.exists():
+            self._write_atomic(path, data)
+        return digest
+
+    def path(self, digest: str, mime: str) -> Optional[Path]:
+        path = self._path(digest, mime)
+        return path if path.exists() else None
+
+    def delete(self, digest: str, mime: str) -> None:
+        """Remove a blob and its thumbnails; callers check no row still references it while holding locked()."""
+        for path in [self._path(digest, mime)] + [self.root / "thumbs" / str(size) / f"{digest}.jpg" for size in THUMBNAIL_SIZES]:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def thumbnail(self, digest: str, mime: str, size: int) -> Optional[Tuple[Path, str]]:
+        """Return (path, mime) of a max-`size` JPEG thumbnail, generating it on first request."""
+        original = self.path(digest, mime)
+        if original is None:
+            return None
+        Image, ImageOps = load_pillow()
+        if Image is None:
+            return original, mime
+        thumb = self.root / "thumbs" / str(size) / f"{digest}.jpg"
+        if thumb.exists():
+            return thumb, "image/jpeg"
+        # Per (blob, size): concurrent requests for one thumbnail render it once, other thumbnails proceed in parallel
+        with self._thumb_locks.hold((digest, size)):
+            if not thumb.exists():
+                try:
+                    img = Image.open(original)
+                    img.draft("RGB", (size, size))
+                    img = ImageOps.exif_transpose(img)
+                    img.thumbnail((size, size), Image.LANCZOS)
+                    out = io.BytesIO()
+                    img.convert("RGB").save(out, format="JPEG", quality=80, optimize=True)
+                except (OSError, SyntaxError, ValueError):
+                    return original, mime
+                self._write_atomic(thumb, out.getvalue())
+        return thumb, "image/jpeg"
@@ -0,0 +1,244 @@
+"""
+NutriMedAI caches.
+Content-addressed two-tier cache for /analyze: in-memory LRU in front of a persistent SQLite tier
+with TTL and size-based eviction. Keys hash the image bytes plus every input that feeds the prompt.
+Also a small in-memory TTL/LRU cache for hot-path lookups (verified tokens, user rows).
+"""
+
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger("uvicorn.error")
+
+# Bump when build_prompt changes so stale analyses are not served for the new prompt
+CACHE_KEY_VERSION = "1"
+
+
+def _normalize_conditions(value: str) -> str:
+    parts = [re.sub(r"\s+", " ", p).strip().lower() for p in (value or "").split(",")]
+    return ",".join(sorted(p for p in parts if p))
+
+
+def _normalize_text(value: str) -> str:
+    return re.sub(r"\s+", " ", value or "").strip().lower()
+
+
+def image_digest(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def make_key(image_sha256: str, model: str, current_conditions: str, concerned_conditions: str, user_description: str) -> str:
+    """Cache key for one analysis: image hash + model + normalized medical profile and description."""
+    material = "\x1f".join([
+        CACHE_KEY_VERSION,
+        image_sha256,
+        model,
+        _normalize_conditions(current_conditions),
+        _normalize_conditions(concerned_conditions),
+        _normalize_text(user_description),
+    ])
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class TTLCache:
+    """Thread-safe in-memory LRU with a per-entry absolute expiry (wall-clock seconds)."""
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = max(1, maxsize)
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            if entry[0] <= time.time():
+                del self._data[key]
+                self._counters["expired"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, expires_at: Optional[float] = None) -> None:
+        """Store value until min(expires_at, now + ttl)."""
+        deadline = time.time() + self.ttl_seconds
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            self._data[key] = (deadline, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._counters["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "size": len(self._data), "maxsize": self.maxsize}
+
+
+class AnalysisCache:
+    """Memory LRU + SQLite tier. All methods are thread-safe; disk access is synchronous, call off the event loop."""
+
+    def __init__(self, path: Path, ttl_seconds: float = 7 * 24 * 3600, memory_entries: int = 256, max_disk_bytes: int = 200 * 1024 * 1024):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = max(0, memory_entries)
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_bytes = 0
+        self._counters = {
+            "hits_memory": 0, "hits_disk": 0, "misses": 0, "stores": 0,
+            "evictions_memory": 0, "evictions_disk": 0, "expired": 0,
+        }
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._memory_lock:
+            self._counters[name] += n
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._disk is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_accessed ON analysis_cache(accessed_at)")
+            conn.commit()
+            self._disk_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM analysis_cache").fetchone()[0]
+            self._disk = conn
+        return self._disk
+
+    def _remember(self, key: str, created_at: float, value: str) -> None:
+        if not self.memory_entries:
+            return
+        with self._memory_lock:
+            self._memory[key] = (created_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+                self._counters["evictions_memory"] += 1
+
+    def get(self, key: str) -> Tuple[Optional[str], str]:
+        """Return (value, tier) where tier is "memory", "disk" or "miss"."""
+        now = time.time()
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._counters["hits_memory"] += 1
+                    return entry[1], "memory"
+                del self._memory[key]
+                self._counters["expired"] += 1
+        try:
+            with self._disk_lock:
+                conn = self._conn()
+                row = conn.execute("SELECT value, size, created_at FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[2] > self.ttl_seconds:
+                    conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    self._disk_bytes -= row[1]
+                    self._count("expired")
+                    row = None
+                elif row is not None:
+                    conn.execute("UPDATE analysis_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                    conn.commit()
+        except sqlite3.Error:
+            logger.exception("Analysis cache read failed")
+            row = None
+        if row is None:
+            self._count("misses")
+            return None, "miss"
+        self._count("hits_disk")
+        self._remember(key, row[2], row[0])
+        return row[0], "disk"
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        self._remember(key, now, value)
+        size = len(value.encode())
+        try:
+            with self._disk_lock:
+                conn = self._conn()
+                old = conn.execute("SELECT size FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO analysis_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now),
+                )
+                self._disk_bytes += size - (old[0] if old else 0)
+                self._evict_disk(conn)
+                conn.commit()
+        except sqlite3.Error:
+            logger.exception("Analysis cache write failed")
+            return
+        self._count("stores")
+
+    def _evict_disk(self, conn: sqlite3.Connection) -> None:
+        # Caller holds _disk_lock. Drop expired rows first, then least recently used until under budget.
+        cutoff = time.time() - self.ttl_seconds
+        count, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analysis_cache WHERE created_at < ?", (cutoff,)
+        ).fetchone()
+        if count:
+            conn.execute("DELETE FROM analysis_cache WHERE created_at < ?", (cutoff,))
+            self._disk_bytes -= size
+            self._count("expired", count)
+        evicted = 0
+        while self._disk_bytes > self.max_disk_bytes:
+            rows = conn.execute("SELECT key, size FROM analysis_cache ORDER BY accessed_at LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+                conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                self._disk_bytes -= size
+                evicted += 1
+        if evicted:
+            self._count("evictions_disk", evicted)
+
+    def stats(self) -> Dict[str, int]:
+        with self._memory_lock:
+            out = dict(self._counters)
+            out["memory_entries"] = len(self._memory)
+        out["disk_bytes"] = self._disk_bytes
+        return out
+
+    def close(self) -> None:
+        with self._disk_lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
@@ -0,0 +1,95 @@
+"""
+NutriMedAI image preprocessing.
+Normalizes uploads before they are sent to the vision model: applies EXIF orientation then strips
+metadata, downsizes to a max dimension and re-encodes to JPEG/WebP. Pillow is optional; without it
+uploads pass through unchanged.
+"""
+
+import base64
+import io
+import logging
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def load_pillow():
+    """(Image, ImageOps), or (None, None) without Pillow. Imported on first use: only uploads and thumbnails need it."""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None, None
+    return Image, ImageOps
+
+
+# OpenAI "low" detail sends a fixed 512px rendition; larger images only pay off with "high"
+LOW_DETAIL_MAX_DIMENSION = 512
+
+
+class ImageDecodeError(ValueError):
+    """Upload could not be decoded as an image (corrupt, truncated or a decompression bomb)."""
+
+
+@dataclass
+class PreparedImage:
+    data_url: str
+    mime: str
+    detail: str
+    bytes_in: int
+    bytes_out: int
+    width: int
+    height: int
+    seconds: float
+
+
+def _choose_detail(width: int, height: int, detail: str) -> str:
+    if detail != "auto":
+        return detail
+    return "low" if max(width, height) <= LOW_DETAIL_MAX_DIMENSION else "high"
+
+
+def prepare_image(data: bytes, mime: str, max_dimension: int = 1024, fmt: str = "JPEG", quality: int = 85, detail: str = "auto") -> PreparedImage:
+    """Downsize and re-encode one upload; CPU-bound, run it in a worker pool."""
+    start = time.perf_counter()
+    Image, ImageOps = load_pillow()
+    if Image is None:
+        encoded = base64.b64encode(data).decode()
+        return PreparedImage(f"data:{mime};base64,{encoded}", mime, detail, len(data), len(data), 0, 0, time.perf_counter() - start)
+    try:
+        img = Image.open(io.BytesIO(data))
+        original_size = img.size
+        # JPEG draft mode decodes at a reduced DCT scale, far cheaper than a full decode for phone photos
+        img.draft("RGB", (max_dimension, max_dimension))
+        has_exif = bool(img.info.get("exif"))
+        img = ImageOps.exif_transpose(img)
+        if max(img.size) > max_dimension:
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        resized = img.size != original_size
+        if img.mode not in ("RGB", "L") and fmt == "JPEG":
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+        out = io.BytesIO()
+        img.save(out, format=fmt, quality=quality, optimize=fmt == "JPEG")
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageDecodeError(str(e)) from e
+    encoded_bytes = out.getvalue()
+    out_mime = f"image/{fmt.lower()}"
+    # Small, metadata-free originals can come out larger after re-encoding; keep the original then
+    if not resized and not has_exif and len(encoded_bytes) >= len(data):
+        encoded_bytes, out_mime = data, mime
+    width, height = img.size
+    return PreparedImage(
+        data_url=f"data:{out_mime};base64,{base64.b64encode(encoded_bytes).decode()}",
+        mime=out_mime,
+        detail=_choose_detail(width, height, detail),
+        bytes_in=len(data),
+        bytes_out=len(encoded_bytes),
+        width=width,
+        height=height,
+        seconds=time.perf_counter() - start,
+    )
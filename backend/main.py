@@ -4,36 +4,76 @@ FastAPI server for food image analysis (OpenAI GPT-4 Vision) + user auth and per
 """
 
 import os
-import logging
+import asyncio
 import base64
+import binascii
+import hashlib
+import hmac
+import html
+import json
+import logging
+import re
 import sqlite3
+import threading
+import time
 import uuid
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends
+from functools import partial
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import Response
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
 from pydantic import BaseModel
-from typing import Optional, List
-from openai import OpenAI
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from typing import Callable, Iterator, Optional, List, Tuple, Union
+import anyio
 
-# Load .env from backend folder or project root
 try:
-    from dotenv import load_dotenv
-    _env_path = Path(__file__).resolve().parent / ".env"
-    if _env_path.exists():
+    from .blobs import PREVIEW_TYPES, THUMBNAIL_SIZES, BlobStore, parse_data_url
+    from .cache import AnalysisCache, TTLCache, image_digest, make_key
+    from .imaging import ImageDecodeError, PreparedImage, prepare_image
+    from .metrics import Gauge, Histogram, render_prometheus
+    from .observability import ERRORS, HTTP_IN_FLIGHT, HTTP_LATENCY, RequestObserver, logging_stats, request_route, setup_logging, stop_logging
+    from .parsing import SectionStreamParser, extract_facts, meal_summary, split_packed, split_sections
+    from .passwords import HasherOverloaded, PasswordHasher, hash_password_sync
+    from .singleflight import SingleFlight
+    from .storage import FACT_COLUMNS, ConnectionPool, PoolTimeout, migrate, schema_version
+    from .upstream import AdmissionQueue, CircuitBreaker, RateLimiter, Rejected, RetryPolicy, loaded_openai, retry_after_seconds
+    from .vision import LocalBackend, OpenAIBackend, TextStream
+    from .warmup import Warmup
+except ImportError:  # started as `uvicorn main:app` from inside backend/
+    from blobs import PREVIEW_TYPES, THUMBNAIL_SIZES, BlobStore, parse_data_url
+    from cache import AnalysisCache, TTLCache, image_digest, make_key
+    from imaging import ImageDecodeError, PreparedImage, prepare_image
+    from metrics import Gauge, Histogram, render_prometheus
+    from observability import ERRORS, HTTP_IN_FLIGHT, HTTP_LATENCY, RequestObserver, logging_stats, request_route, setup_logging, stop_logging
+    from parsing import SectionStreamParser, extract_facts, meal_summary, split_packed, split_sections
+    from passwords import HasherOverloaded, PasswordHasher, hash_password_sync
+    from singleflight import SingleFlight
+    from storage import FACT_COLUMNS, ConnectionPool, PoolTimeout, migrate, schema_version
+    from upstream import AdmissionQueue, CircuitBreaker, RateLimiter, Rejected, RetryPolicy, loaded_openai, retry_after_seconds
+    from vision import LocalBackend, OpenAIBackend, TextStream
+    from warmup import Warmup
+
+# Load .env from backend folder or project root; python-dotenv is only imported when there is one
+# (hosted deploys set real environment variables)
+_env_path = next((p for p in (Path(__file__).resolve().parent / ".env", Path(__file__).resolve().parent.parent / ".env") if p.exists()), None)
+if _env_path is not None:
+    try:
+        from dotenv import load_dotenv
         load_dotenv(_env_path)
-    else:
-        load_dotenv(Path(__file__).resolve().parent.parent / ".env")
-except ImportError:
-    pass
+    except ImportError:
+        pass
 
-logging.basicConfig(level=logging.INFO)
+# JSON lines (or LOG_FORMAT=text) via a queue drained by a background thread; never blocks the event loop
+LOG_FORMAT = (os.environ.get("LOG_FORMAT", "json").strip().lower() or "json")
+LOG_LEVEL = (os.environ.get("LOG_LEVEL", "INFO").strip().upper() or "INFO")
+setup_logging(LOG_FORMAT, LOG_LEVEL)
 logger = logging.getLogger("uvicorn.error")
 
 app = FastAPI(title="NutriMedAI API", version="1.0")
@@ -57,20 +97,8 @@ app.add_middleware(
 )
 
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    # Use both logger and print to ensure Railway captures output
-    logger.info("REQ %s %s", request.method, request.url.path)
-    print(f"REQ {request.method} {request.url.path}")
-    try:
-        response = await call_next(request)
-    except Exception:
-        logger.exception("Unhandled request error")
-        print("Unhandled request error")
-        raise
-    logger.info("RES %s %s -> %s", request.method, request.url.path, response.status_code)
-    print(f"RES {request.method} {request.url.path} -> {response.status_code}")
-    return response
+# Outermost: request ids, per-route latency histograms and the access log line (not for scrapes and probes)
+app.add_middleware(RequestObserver, skip_paths=("/metrics", "/healthz"))
 
 
 def ensure_global_admin():
@@ -79,7 +107,7 @@ def ensure_global_admin():
         row = conn.execute("SELECT id FROM users WHERE email = ?", (GLOBAL_ADMIN_EMAIL,)).fetchone()
         if row:
             return
-        password_hash = pwd_context.hash(GLOBAL_ADMIN_PASSWORD)
+        password_hash = hash_password_sync(GLOBAL_ADMIN_PASSWORD, BCRYPT_ROUNDS)
         created = datetime.utcnow().isoformat()
         conn.execute(
             "INSERT INTO users (id, email, password_hash, created_at) VALUES (?, ?, ?, ?)",
@@ -87,18 +115,122 @@ def ensure_global_admin():
         )
         conn.commit()
     logger.info("Global admin user created: %s", GLOBAL_ADMIN_EMAIL)
-    print(f"Global admin user created: {GLOBAL_ADMIN_EMAIL}")
+
+
+# Startup work runs after the server starts listening, so a cold instance answers its first request
+# without waiting for migrations or bcrypt; requests that need a step first wait for it (see /healthz)
+warmup = Warmup(busy=lambda: HTTP_IN_FLIGHT.value() > 0)
 
 
 @app.on_event("startup")
 async def log_startup():
-    ensure_global_admin()
-    logger.info("NutriMedAI startup complete")
-    print("NutriMedAI startup complete")
+    # One after another, in the order requests need them: small instances have a single (shared) CPU, and
+    # parallel steps would only compete with each other and with the first request. The vision client
+    # (~0.4 s of imports) is only needed by /analyze, which builds it on demand, so it waits for a lull
+    warmup.start("db", init_db)
+    warmup.start("auth", warm_up_auth, after=("db",))
+    warmup.start("admin", ensure_global_admin, after=("auth",))
+    warmup.start("vision", vision_backend.start, after=("admin",), when_idle=True)
+    logger.info("NutriMedAI accepting requests; warm-up continues in the background")
+
+
+@app.on_event("shutdown")
+async def log_shutdown():
+    warmup.cancel()
+    await vision_backend.close()
+    analysis_cache.close()
+    _image_pool.shutdown(wait=False)
+    password_hasher.shutdown()
+    close_db()
+    stop_logging()
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "").strip()
 # Use gpt-4o-mini for faster (and cheaper) analysis; gpt-4o for best quality. Both support vision.
 OPENAI_VISION_MODEL = os.environ.get("OPENAI_VISION_MODEL", "gpt-4o-mini").strip() or "gpt-4o-mini"
+# Shared HTTP pool for OpenAI calls (OPENAI_BASE_URL is honoured by the SDK for OpenAI-compatible servers)
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "90"))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "60"))
+
+# Upstream protection for /analyze: token buckets per user (per client IP when anonymous), a bounded
+# admission queue in front of OpenAI, jittered retries and a circuit breaker
+ANALYZE_RATE_PER_MINUTE = float(os.environ.get("ANALYZE_RATE_PER_MINUTE", "10"))
+ANALYZE_BURST = int(os.environ.get("ANALYZE_BURST", "5"))
+ANALYZE_ANON_RATE_PER_MINUTE = float(os.environ.get("ANALYZE_ANON_RATE_PER_MINUTE", "5"))
+ANALYZE_ANON_BURST = int(os.environ.get("ANALYZE_ANON_BURST", "3"))
+# Number of proxies in front of the app (e.g. 1 on Render/Railway) that append the address they saw to X-Forwarded-For.
+# The client is that many entries from the right; anything further left is client-supplied. 0 uses the peer address.
+# TRUST_FORWARDED_FOR=1 from older configs means one proxy.
+_trust_forwarded_for = os.environ.get("TRUST_FORWARDED_FOR", "").strip().lower() in ("1", "true", "yes")
+TRUSTED_PROXY_HOPS = max(0, int(os.environ.get("TRUSTED_PROXY_HOPS", "1" if _trust_forwarded_for else "0")))
+UPSTREAM_MAX_IN_FLIGHT = int(os.environ.get("UPSTREAM_MAX_IN_FLIGHT", "16"))
+UPSTREAM_MAX_QUEUE = int(os.environ.get("UPSTREAM_MAX_QUEUE", "64"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get("UPSTREAM_QUEUE_TIMEOUT", "30"))
+UPSTREAM_MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", "3"))
+UPSTREAM_RETRY_BASE = float(os.environ.get("UPSTREAM_RETRY_BASE", "0.5"))
+UPSTREAM_RETRY_MAX = float(os.environ.get("UPSTREAM_RETRY_MAX", "20"))
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+
+user_rate_limiter = RateLimiter(ANALYZE_RATE_PER_MINUTE, ANALYZE_BURST)
+ip_rate_limiter = RateLimiter(ANALYZE_ANON_RATE_PER_MINUTE, ANALYZE_ANON_BURST)
+upstream_admission = AdmissionQueue(UPSTREAM_MAX_IN_FLIGHT, UPSTREAM_MAX_QUEUE, UPSTREAM_QUEUE_TIMEOUT)
+upstream_retry = RetryPolicy(UPSTREAM_MAX_RETRIES, UPSTREAM_RETRY_BASE, UPSTREAM_RETRY_MAX)
+upstream_breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_RESET_SECONDS)
+
+# Vision model behind /analyze: "openai" (chat completions), "local" (LOCAL_VISION_ENGINE in a CPU worker
+# pool with micro-batching) or "stub" (local with the deterministic stub engine, no weights needed)
+VISION_BACKEND = (os.environ.get("VISION_BACKEND", "openai").strip().lower() or "openai")
+LOCAL_VISION_ENGINE = (os.environ.get("LOCAL_VISION_ENGINE", "smolvlm").strip() or "smolvlm")
+LOCAL_VISION_MODEL = (os.environ.get("LOCAL_VISION_MODEL", "HuggingFaceTB/SmolVLM-Instruct").strip() or "HuggingFaceTB/SmolVLM-Instruct")
+LOCAL_VISION_WORKERS = int(os.environ.get("LOCAL_VISION_WORKERS", "1"))
+# torch threads per worker; 0 = torch default (all cores), set cores // LOCAL_VISION_WORKERS when running several
+LOCAL_VISION_THREADS = int(os.environ.get("LOCAL_VISION_THREADS", "0"))
+LOCAL_BATCH_SIZE = int(os.environ.get("LOCAL_BATCH_SIZE", "4"))
+LOCAL_BATCH_WAIT_MS = float(os.environ.get("LOCAL_BATCH_WAIT_MS", "25"))
+LOCAL_MAX_QUEUE = int(os.environ.get("LOCAL_MAX_QUEUE", "64"))
+LOCAL_MAX_NEW_TOKENS = int(os.environ.get("LOCAL_MAX_NEW_TOKENS", "700"))
+# Simulated cost of the stub engine: per forward pass + per request in the batch
+STUB_BATCH_MS = float(os.environ.get("STUB_BATCH_MS", "200"))
+STUB_ITEM_MS = float(os.environ.get("STUB_ITEM_MS", "40"))
+
+
+def create_vision_backend():
+    if VISION_BACKEND in ("local", "stub"):
+        engine = "stub" if VISION_BACKEND == "stub" else LOCAL_VISION_ENGINE
+        return LocalBackend(
+            engine, LOCAL_VISION_MODEL if engine != "stub" else "stub",
+            workers=LOCAL_VISION_WORKERS,
+            max_batch=LOCAL_BATCH_SIZE,
+            max_wait=LOCAL_BATCH_WAIT_MS / 1000,
+            max_queue=LOCAL_MAX_QUEUE,
+            max_new_tokens=LOCAL_MAX_NEW_TOKENS,
+            options={"threads": LOCAL_VISION_THREADS, "stub_batch_ms": STUB_BATCH_MS, "stub_item_ms": STUB_ITEM_MS},
+        )
+    if VISION_BACKEND != "openai":
+        logger.warning("Unknown VISION_BACKEND=%r, using openai", VISION_BACKEND)
+    return OpenAIBackend(
+        OPENAI_API_KEY, OPENAI_VISION_MODEL, OPENAI_TIMEOUT, OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE,
+        OPENAI_KEEPALIVE_EXPIRY, upstream_retry, upstream_breaker,
+    )
+
+
+vision_backend = create_vision_backend()
+
+# Upload preprocessing: uploads are downsized/re-encoded off the event loop before base64 encoding
+MAX_UPLOAD_MB = float(os.environ.get("MAX_UPLOAD_MB", "15"))
+IMAGE_MAX_DIMENSION = int(os.environ.get("IMAGE_MAX_DIMENSION", "1024"))
+IMAGE_FORMAT = (os.environ.get("IMAGE_FORMAT", "JPEG").strip().upper() or "JPEG")
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "85"))
+IMAGE_DETAIL = (os.environ.get("IMAGE_DETAIL", "auto").strip().lower() or "auto")  # auto | low | high
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# /analyze/batch: images per request, concurrent analyses per batch, or one packed vision request per batch
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "6"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "3"))
+BATCH_PACK_IMAGES = os.environ.get("BATCH_PACK_IMAGES", "0").strip().lower() in ("1", "true", "yes")
+_image_pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
 
 # Auth & DB
 _default_db_path = Path(__file__).resolve().parent / "data" / "nutrimedai.db"
@@ -106,7 +238,13 @@ DB_PATH = Path(os.environ.get("DB_PATH", str(_default_db_path)))
 SECRET_KEY = os.environ.get("SECRET_KEY", "change-me-in-production-use-env")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 30
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost; changing it upgrades existing hashes transparently on next successful login
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_MAX_PENDING = int(os.environ.get("PASSWORD_MAX_PENDING", str(PASSWORD_WORKERS * 8)))
+password_hasher = PasswordHasher(BCRYPT_ROUNDS, PASSWORD_WORKERS, PASSWORD_MAX_PENDING)
+AUTH_LATENCY = Histogram("auth_request_seconds", "Latency of /auth/register and /auth/login by endpoint and status")
+PASSWORD_LATENCY = Histogram("password_hash_seconds", "bcrypt job latency including queue wait, by operation")
 security = HTTPBearer(auto_error=False)
 
 # Global admin login (single shared account)
@@ -115,70 +253,115 @@ GLOBAL_ADMIN_PASSWORD = os.environ.get("GLOBAL_ADMIN_PASSWORD", "prissol@admin")
 GLOBAL_ADMIN_ID = "00000000-0000-0000-0000-000000000001"
 
 
-def _ensure_db_dir():
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+# Pool sizing: FastAPI runs sync endpoints on a 40-thread pool; 8 connections covers it without lock thrash
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+DB_CACHE_SIZE_KIB = int(os.environ.get("DB_CACHE_SIZE_KIB", "4096"))
+
+_db_pool: Optional[ConnectionPool] = None
+_db_pool_lock = threading.Lock()
+
+
+def init_db() -> ConnectionPool:
+    """Open the shared connection pool and apply pending schema migrations (once per process)."""
+    global _db_pool
+    if _db_pool is not None:
+        return _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            pool = ConnectionPool(DB_PATH, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, cache_size_kib=DB_CACHE_SIZE_KIB)
+            try:
+                with pool.connection() as conn:
+                    version = migrate(conn, preview_store=preview_store)
+                    pruned = prune_tombstones(conn)
+                    conn.commit()
+            except Exception:
+                logger.exception("DB init failed at %s", DB_PATH)
+                pool.close()
+                raise
+            logger.info("DB ready at %s (schema v%s, pool size %s, %s expired tombstones pruned)", DB_PATH, version, DB_POOL_SIZE, pruned)
+            _db_pool = pool
+    return _db_pool
+
+
+def close_db():
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None:
+            _db_pool.close()
+            _db_pool = None
+
+
+# Analysis preview images (content-addressed files + thumbnails next to the main DB)
+PREVIEW_STORE_PATH = Path(os.environ.get("PREVIEW_STORE_PATH", str(DB_PATH.parent / "previews")))
+PREVIEW_CACHE_MAX_AGE = 365 * 24 * 3600  # a preview URL never changes content, so browsers may cache it for good
+# Opened directly (not as <img>), a preview must still render as an inert image
+PREVIEW_SECURITY_HEADERS = {"X-Content-Type-Options": "nosniff", "Content-Security-Policy": "default-src 'none'; sandbox"}
+preview_store = BlobStore(PREVIEW_STORE_PATH)
+
+# /analyze result cache (memory LRU + SQLite tier next to the main DB)
+ANALYSIS_CACHE_PATH = Path(os.environ.get("ANALYSIS_CACHE_PATH", str(DB_PATH.parent / "analysis_cache.db")))
+ANALYSIS_CACHE_TTL = float(os.environ.get("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+ANALYSIS_CACHE_MEMORY_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_MEMORY_ENTRIES", "256"))
+ANALYSIS_CACHE_MAX_MB = float(os.environ.get("ANALYSIS_CACHE_MAX_MB", "200"))
+analysis_cache = AnalysisCache(
+    ANALYSIS_CACHE_PATH,
+    ttl_seconds=ANALYSIS_CACHE_TTL,
+    memory_entries=ANALYSIS_CACHE_MEMORY_ENTRIES,
+    max_disk_bytes=int(ANALYSIS_CACHE_MAX_MB * 1024 * 1024),
+)
+# Identical /analyze requests in flight at the same time share one upstream call
+analyze_inflight = SingleFlight()
 
 
 @contextmanager
 def get_db():
-    _ensure_db_dir()
-    try:
-        conn = sqlite3.connect(DB_PATH)
-    except Exception:
-        logger.exception("DB connection failed at %s", DB_PATH)
-        raise
-    conn.row_factory = sqlite3.Row
     try:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id TEXT PRIMARY KEY,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS analyses (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                dish_name TEXT NOT NULL,
-                analysis_text TEXT NOT NULL,
-                preview TEXT,
-                created_at TEXT NOT NULL,
-                current_conditions TEXT DEFAULT '',
-                concerned_conditions TEXT DEFAULT '',
-                user_description TEXT DEFAULT '',
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        """)
-        conn.commit()
-        # Add columns for existing DBs (ignore if already exist)
-        for col in ("current_conditions", "concerned_conditions", "user_description"):
-            try:
-                conn.execute(f"ALTER TABLE analyses ADD COLUMN {col} TEXT DEFAULT ''")
-                conn.commit()
-            except sqlite3.OperationalError:
-                pass
-        yield conn
-    except Exception:
-        logger.exception("DB init/query failed")
-        raise
-    finally:
-        conn.close()
+        with init_db().connection(route=request_route()) as conn:
+            yield conn
+    except PoolTimeout:
+        logger.warning("DB pool exhausted: %s", _db_pool.stats() if _db_pool else {})
+        raise HTTPException(status_code=503, detail="Database busy. Try again shortly.")
 
 
 def create_access_token(data: dict) -> str:
+    from jose import jwt  # imported by the "auth" warm-up step; only auth routes need it
+
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+# Verified token -> claims, so the auth dependency skips HS256 verification on the hot path.
+# Entries never outlive the token's own exp; invalid tokens are never cached.
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", "300"))
+token_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+# user_id -> {"id", "email"} for /auth/me; invalidated whenever the users row is written
+user_cache = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+
 def decode_token(token: str) -> Optional[dict]:
+    claims = token_cache.get(token)
+    if claims is not None:
+        return claims
+    from jose import JWTError, jwt
+
     try:
-        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         return None
+    exp = claims.get("exp")
+    token_cache.set(token, claims, expires_at=float(exp) if isinstance(exp, (int, float)) else None)
+    return claims
+
+
+def warm_up_auth() -> None:
+    """Startup step: load python-jose and spawn a bcrypt worker before the first sign-in needs them."""
+    import jose.jwt  # noqa: F401
+
+    password_hasher.warm_up()
 
 
 def get_current_user_id(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> Optional[str]:
@@ -264,6 +447,95 @@ def root():
     return {"message": "NutriMedAI API", "status": "ok"}
 
 
+@app.get("/healthz")
+async def healthz(ready: bool = Query(False, description="Readiness probe: 503 until the startup warm-up has finished")):
+    """Liveness: 200 whenever the process answers. Reports warm-up progress; ?ready=true makes it a readiness probe."""
+    # async: answers on the event loop even if the threadpool is saturated
+    steps = warmup.stats()
+    if steps["ready"]:
+        status = "ready"
+    elif any(step["state"] == "failed" for step in steps["steps"].values()):
+        status = "failed"
+    else:
+        status = "starting"
+    body = {"status": status, "live": True, **steps}
+    return JSONResponse(body, status_code=503 if ready and not steps["ready"] else 200)
+
+
+@app.get("/health/db")
+def health_db():
+    """Connection pool stats and schema version for monitoring."""
+    with get_db() as conn:
+        version = schema_version(conn)
+    return {"status": "ok", "schema_version": version, "pool": init_db().stats()}
+
+
+@app.get("/health/auth")
+def health_auth():
+    """Password hashing pool state and auth latency histograms."""
+    return {
+        "status": "ok",
+        "password_hasher": password_hasher.stats(),
+        "token_cache": token_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "auth_request_seconds": AUTH_LATENCY.snapshot(),
+        "password_hash_seconds": PASSWORD_LATENCY.snapshot(),
+    }
+
+
+@app.get("/health/cache")
+def health_cache():
+    """Hit/miss/eviction counters for the /analyze result cache."""
+    return {"status": "ok", "analysis_cache": analysis_cache.stats(), "analyze_inflight": analyze_inflight.stats()}
+
+
+@app.get("/health/upstream")
+def health_upstream():
+    """Admission queue depth/wait times, rate-limit rejections, retries, circuit breaker and vision backend state for /analyze."""
+    return {
+        "status": "degraded" if upstream_breaker.state != "closed" else "ok",
+        "admission": upstream_admission.stats(),
+        "breaker": upstream_breaker.stats(),
+        "vision": vision_backend.stats(),
+        "retry": upstream_retry.stats(),
+        "rate_limit": {"user": user_rate_limiter.stats(), "ip": ip_rate_limiter.stats()},
+    }
+
+
+# Prometheus scrape endpoint; set METRICS_TOKEN to require "Authorization: Bearer <token>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "").strip()
+UPSTREAM_GAUGE = Gauge("upstream_requests", "/analyze vision calls holding or waiting for an admission slot, by state")
+DB_POOL_GAUGE = Gauge("db_pool_connections", "Pooled SQLite connections by state")
+BREAKER_GAUGE = Gauge("upstream_circuit_open", "1 while the upstream circuit breaker is open or half-open")
+LOG_QUEUE_GAUGE = Gauge("log_queue_records", "Log records waiting for the writer thread, and records dropped because the queue was full")
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics(request: Request):
+    if METRICS_TOKEN:
+        supplied = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(supplied.encode(), METRICS_TOKEN.encode()):
+            raise HTTPException(status_code=401, detail="Not authenticated")
+    admission = upstream_admission.stats()
+    UPSTREAM_GAUGE.set(admission["in_flight"], state="in_flight")
+    UPSTREAM_GAUGE.set(admission["queued"], state="queued")
+    BREAKER_GAUGE.set(0 if upstream_breaker.state == "closed" else 1)
+    collected = [
+        HTTP_LATENCY, HTTP_IN_FLIGHT, ERRORS, AUTH_LATENCY, PASSWORD_LATENCY,
+        upstream_admission.wait_seconds, UPSTREAM_GAUGE, BREAKER_GAUGE, LOG_QUEUE_GAUGE,
+        *vision_backend.metrics(),
+    ]
+    if _db_pool is not None:
+        pool = _db_pool.stats()
+        DB_POOL_GAUGE.set(pool["in_use"], state="in_use")
+        DB_POOL_GAUGE.set(pool["idle"], state="idle")
+        collected += [DB_POOL_GAUGE, _db_pool.hold_seconds]
+    log_stats = logging_stats()
+    LOG_QUEUE_GAUGE.set(log_stats["queued"], state="queued")
+    LOG_QUEUE_GAUGE.set(log_stats["dropped"], state="dropped")
+    return PlainTextResponse(render_prometheus(collected), media_type="text/plain; version=0.0.4")
+
+
 # ----- Auth & user dashboard (per-user analyses) -----
 class RegisterBody(BaseModel):
     email: str
@@ -288,96 +560,388 @@ class AnalysisPatch(BaseModel):
     dish_name: Optional[str] = None
 
 
-@app.post("/auth/register")
-def register(body: RegisterBody):
+class AnalysesDelete(BaseModel):
+    ids: List[str]
+
+
+@contextmanager
+def auth_timer(endpoint: str):
+    start = time.perf_counter()
+    status = 200
     try:
-        email = body.email.strip().lower()
-        if not email or "@" not in email:
-            raise HTTPException(status_code=400, detail="Valid email required")
-        if len(body.password) < 6:
-            raise HTTPException(status_code=400, detail="Password must be at least 6 characters")
-        logger.info("Register password length=%s", len(body.password))
-        print(f"Register password length={len(body.password)}")
-        if len(body.password) > 72:
-            raise HTTPException(status_code=400, detail="Password must be 72 characters or less")
-        user_id = str(uuid.uuid4())
-        password_hash = pwd_context.hash(body.password)
-        created = datetime.utcnow().isoformat()
-        with get_db() as conn:
-            try:
-                conn.execute(
-                    "INSERT INTO users (id, email, password_hash, created_at) VALUES (?, ?, ?, ?)",
-                    (user_id, email, password_hash, created),
-                )
-                conn.commit()
-            except sqlite3.IntegrityError:
-                raise HTTPException(status_code=400, detail="Email already registered")
-        token = create_access_token({"sub": user_id})
-        return {"access_token": token, "user": {"id": user_id, "email": email}}
-    except HTTPException:
+        yield
+    except HTTPException as e:
+        status = e.status_code
         raise
     except Exception:
-        logger.exception("Register failed")
-        raise HTTPException(status_code=500, detail="Server error")
+        status = 500
+        raise
+    finally:
+        AUTH_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, status=status)
 
 
-@app.post("/auth/login")
-def login(body: LoginBody):
+async def run_password_job(op: str, job):
+    """Await a password_hasher job, mapping overload to 503 + Retry-After."""
     try:
-        email = body.email.strip().lower()
-        if len(body.password) > 72:
-            raise HTTPException(status_code=400, detail="Password must be 72 characters or less")
-        with get_db() as conn:
-            row = conn.execute(
-                "SELECT id, password_hash FROM users WHERE email = ?", (email,)
-            ).fetchone()
-        if not row:
-            raise HTTPException(status_code=401, detail="Invalid email or password")
-        user_id = row["id"]
-        if not pwd_context.verify(body.password, row["password_hash"]):
-            raise HTTPException(status_code=401, detail="Invalid email or password")
-        token = create_access_token({"sub": user_id})
-        return {"access_token": token, "user": {"id": user_id, "email": email}}
-    except HTTPException:
-        raise
-    except Exception:
-        logger.exception("Login failed")
-        raise HTTPException(status_code=500, detail="Server error")
+        with PASSWORD_LATENCY.time(op=op):
+            return await job
+    except HasherOverloaded as e:
+        logger.warning("Password hashing overloaded: %s", password_hasher.stats())
+        raise HTTPException(
+            status_code=503,
+            detail="Too many sign-in requests right now. Try again shortly.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+def _insert_user(user_id: str, email: str, password_hash: str, created: str):
+    with get_db() as conn:
+        try:
+            conn.execute(
+                "INSERT INTO users (id, email, password_hash, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, email, password_hash, created),
+            )
+            conn.commit()
+        except sqlite3.IntegrityError:
+            raise HTTPException(status_code=400, detail="Email already registered")
+    user_cache.invalidate(user_id)
+
+
+def _find_user_by_email(email: str):
+    with get_db() as conn:
+        return conn.execute(
+            "SELECT id, password_hash FROM users WHERE email = ?", (email,)
+        ).fetchone()
+
+
+def _update_password_hash(user_id: str, password_hash: str):
+    with get_db() as conn:
+        conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (password_hash, user_id))
+        conn.commit()
+    user_cache.invalidate(user_id)
+
+
+@app.post("/auth/register")
+async def register(body: RegisterBody):
+    with auth_timer("register"):
+        try:
+            email = body.email.strip().lower()
+            if not email or "@" not in email:
+                raise HTTPException(status_code=400, detail="Valid email required")
+            if len(body.password) < 6:
+                raise HTTPException(status_code=400, detail="Password must be at least 6 characters")
+            if len(body.password) > 72:
+                raise HTTPException(status_code=400, detail="Password must be 72 characters or less")
+            if email == GLOBAL_ADMIN_EMAIL:
+                # Reserved for the admin account, which a startup step creates after the server is already accepting
+                # requests; the same answer as once it exists, without waiting for (or depending on) that step
+                raise HTTPException(status_code=400, detail="Email already registered")
+            user_id = str(uuid.uuid4())
+            password_hash = await run_password_job("hash", password_hasher.hash(body.password))
+            created = datetime.utcnow().isoformat()
+            await run_in_threadpool(_insert_user, user_id, email, password_hash, created)
+            token = create_access_token({"sub": user_id})
+            return {"access_token": token, "user": {"id": user_id, "email": email}}
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Register failed")
+            raise HTTPException(status_code=500, detail="Server error")
+
+
+@app.post("/auth/login")
+async def login(body: LoginBody):
+    with auth_timer("login"):
+        try:
+            email = body.email.strip().lower()
+            if len(body.password) > 72:
+                raise HTTPException(status_code=400, detail="Password must be 72 characters or less")
+            if email == GLOBAL_ADMIN_EMAIL:
+                await warmup.wait("admin")  # created by a startup step; a cold instance may not have it yet
+            row = await run_in_threadpool(_find_user_by_email, email)
+            if not row:
+                raise HTTPException(status_code=401, detail="Invalid email or password")
+            user_id = row["id"]
+            ok, new_hash = await run_password_job("verify", password_hasher.verify(body.password, row["password_hash"]))
+            if not ok:
+                raise HTTPException(status_code=401, detail="Invalid email or password")
+            if new_hash:
+                await run_in_threadpool(_update_password_hash, user_id, new_hash)
+                logger.info("Upgraded password hash to %s rounds for user %s", BCRYPT_ROUNDS, user_id)
+            token = create_access_token({"sub": user_id})
+            return {"access_token": token, "user": {"id": user_id, "email": email}}
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Login failed")
+            raise HTTPException(status_code=500, detail="Server error")
 
 
 @app.get("/auth/me")
 def auth_me(user_id: str = Depends(require_user)):
-    with get_db() as conn:
-        row = conn.execute("SELECT id, email FROM users WHERE id = ?", (user_id,)).fetchone()
-    if not row:
-        raise HTTPException(status_code=401, detail="User not found")
-    return {"id": row["id"], "email": row["email"]}
+    user = user_cache.get(user_id)
+    if user is None:
+        with get_db() as conn:
+            row = conn.execute("SELECT id, email FROM users WHERE id = ?", (user_id,)).fetchone()
+        if not row:
+            raise HTTPException(status_code=401, detail="User not found")
+        user = {"id": row["id"], "email": row["email"]}
+        user_cache.set(user_id, user)
+    return dict(user)
+
+
+def preview_signature(analysis_id: str) -> str:
+    """URL signature so <img> tags can load a preview without sending the bearer token."""
+    return hmac.new(SECRET_KEY.encode(), f"preview:{analysis_id}".encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def preview_urls(analysis_id: str, preview_hash: Optional[str], legacy_preview: Optional[str] = None) -> dict:
+    if not preview_hash:
+        return {"preview": legacy_preview, "thumbnail": legacy_preview}
+    base = f"/analyses/{analysis_id}/preview?sig={preview_signature(analysis_id)}"
+    return {"preview": base, "thumbnail": f"{base}&size={THUMBNAIL_SIZES[1]}"}
+
+
+INVALID_PREVIEW = "preview must be a JPEG, PNG, WebP or GIF image as a base64 data URL"
+
+
+@contextmanager
+def stored_previews(previews: List[Optional[str]]):
+    """Yield (legacy_preview, preview_hash, preview_mime) per preview; the images go to the blob store.
+
+    Raises 400 unless every preview is empty or a data URL parse_data_url accepts. Keep the block open
+    until the rows referencing the blobs are committed: it holds the blobs' locks, so release_previews
+    can't delete one that put() found already on disk. Enter it after get_db(), the same lock order
+    release_previews uses.
+    """
+    parsed = [parse_data_url(preview) for preview in previews]
+    if any(preview and p is None for preview, p in zip(previews, parsed)):
+        raise HTTPException(status_code=400, detail=INVALID_PREVIEW)
+    digests = [BlobStore.digest(p[1]) if p else None for p in parsed]
+    with preview_store.locked(d for d in digests if d):
+        yield [(None, preview_store.put(p[1], p[0], digest), p[0]) if p else (None, None, None) for p, digest in zip(parsed, digests)]
+
+
+def release_previews(conn, previews) -> None:
+    """Delete blobs of (hash, mime) pairs no remaining analysis references."""
+    for preview_hash, mime in set(previews):
+        if not preview_hash:
+            continue
+        with preview_store.locked([preview_hash]):
+            if not conn.execute("SELECT 1 FROM analyses WHERE preview_hash = ? LIMIT 1", (preview_hash,)).fetchone():
+                preview_store.delete(preview_hash, mime)
+
+
+# API field name -> SQL columns it needs. id and date are always returned (the cursor is built from them).
+ANALYSIS_FIELDS = {
+    "id": ("id",),
+    "dishName": ("dish_name",),
+    "analysis": ("analysis_text",),
+    "preview": ("preview", "preview_hash"),
+    "thumbnail": ("preview", "preview_hash"),
+    "date": ("created_at",),
+    "currentConditions": ("COALESCE(current_conditions, '') AS current_conditions",),
+    "concernedConditions": ("COALESCE(concerned_conditions, '') AS concerned_conditions",),
+    "userDescription": ("COALESCE(user_description, '') AS user_description",),
+    "metrics": ("calories_min", "calories_max", "protein_g", "carbs_g", "fat_g", "fiber_g", "sugar_g", "sodium_mg"),
+    "nutritionScore": ("nutrition_score",),
+}
+ANALYSIS_ROW_KEYS = {
+    "id": "id", "dishName": "dish_name", "analysis": "analysis_text", "date": "created_at",
+    "currentConditions": "current_conditions", "concernedConditions": "concerned_conditions",
+    "userDescription": "user_description", "nutritionScore": "nutrition_score",
+}
+METRIC_KEYS = {
+    "caloriesMin": "calories_min", "caloriesMax": "calories_max", "proteinG": "protein_g", "carbsG": "carbs_g",
+    "fatG": "fat_g", "fiberG": "fiber_g", "sugarG": "sugar_g", "sodiumMg": "sodium_mg",
+}
+ANALYSES_PAGE_SIZE = 50
+ANALYSES_MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(created_at: str, analysis_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, analysis_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, analysis_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(analysis_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def encode_sync_cursor(version: int, rowid: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([version, rowid]).encode()).decode().rstrip("=")
+
+
+def decode_sync_cursor(cursor: str, since: int) -> int:
+    """Return the rowid a delta page resumes after; the cursor is only valid together with the since it came with."""
+    try:
+        version, rowid = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if int(version) == since:
+            return int(rowid)
+    except (ValueError, TypeError, binascii.Error):
+        pass
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(ANALYSIS_FIELDS)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in ANALYSIS_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(ANALYSIS_FIELDS)}")
+    return [f for f in ANALYSIS_FIELDS if f in requested or f in ("id", "date")]
+
 
+def analysis_row_to_dict(r, fields: List[str]) -> dict:
+    composite = preview_urls(r["id"], r["preview_hash"], r["preview"]) if "preview" in fields or "thumbnail" in fields else {}
+    if "metrics" in fields:
+        composite["metrics"] = {key: r[col] for key, col in METRIC_KEYS.items()}
+    return {f: composite[f] if f in composite else r[ANALYSIS_ROW_KEYS[f]] for f in fields}
 
-@app.get("/analyses", response_model=List[dict])
-def list_analyses(user_id: str = Depends(require_user)):
+
+def metrics_to_dict(facts: dict) -> dict:
+    return {key: facts[col] for key, col in METRIC_KEYS.items()}
+
+
+def bump_sync_version(conn, user_id: str) -> int:
+    """Advance the user's change counter inside the caller's transaction and return the new version."""
+    conn.execute(
+        """INSERT INTO user_sync (user_id, version, updated_at) VALUES (?, 1, ?)
+           ON CONFLICT(user_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at""",
+        (user_id, datetime.utcnow().isoformat()),
+    )
+    return conn.execute("SELECT version FROM user_sync WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+# Deletions stay visible to `since=` delta sync for this long; clients that last synced before then get 410
+SYNC_TOMBSTONE_DAYS = float(os.environ.get("SYNC_TOMBSTONE_DAYS", "30"))
+
+
+def prune_tombstones(conn, user_id: Optional[str] = None) -> int:
+    """Delete tombstones older than SYNC_TOMBSTONE_DAYS (one user's, or everyone's) inside the caller's
+    transaction, recording the newest pruned version per user. Returns the number of tombstones removed."""
+    if SYNC_TOMBSTONE_DAYS <= 0:
+        return 0
+    cutoff = (datetime.utcnow() - timedelta(days=SYNC_TOMBSTONE_DAYS)).isoformat()
+    if user_id is None:
+        users = [r[0] for r in conn.execute("SELECT DISTINCT user_id FROM analysis_tombstones").fetchall()]
+    else:
+        users = [user_id]
+    removed = 0
+    for uid in users:
+        newest = conn.execute(
+            "SELECT MAX(version) FROM analysis_tombstones WHERE user_id = ? AND deleted_at < ?", (uid, cutoff)
+        ).fetchone()[0]
+        if newest is None:
+            continue
+        conn.execute("UPDATE user_sync SET pruned_version = MAX(pruned_version, ?) WHERE user_id = ?", (newest, uid))
+        removed += conn.execute("DELETE FROM analysis_tombstones WHERE user_id = ? AND deleted_at < ?", (uid, cutoff)).rowcount
+    return removed
+
+
+def sync_validators(conn, request: Request, user_id: str, resolved: str = "", dated: bool = True) -> Tuple[dict, bool]:
+    """ETag/Last-Modified/X-Sync-Version headers for a per-user read, and whether the client's copy is still current.
+
+    `resolved` is mixed into the ETag for reads whose result also depends on something other than the URL and
+    the user's data (e.g. a date range defaulted from today). Pass dated=False when that something can change
+    without the data changing, so Last-Modified/If-Modified-Since can't revalidate a stale copy.
+    """
+    sync = conn.execute("SELECT version, updated_at FROM user_sync WHERE user_id = ?", (user_id,)).fetchone()
+    version = sync["version"] if sync else 0
+    last_modified = datetime.fromisoformat(sync["updated_at"]).replace(tzinfo=timezone.utc) if sync and dated else None
+    variant = hashlib.sha1(f"{user_id}?{request.url.path}?{request.url.query}?{resolved}".encode()).hexdigest()[:12]
+    etag = f'W/"{version}-{variant}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "X-Sync-Version": str(version)}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    return headers, not_modified(request, etag, last_modified)
+
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in if_none_match or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@app.get("/analyses", response_model=Union[List[dict], dict])
+def list_analyses(
+    request: Request,
+    response: Response,
+    user_id: str = Depends(require_user),
+    limit: int = Query(ANALYSES_PAGE_SIZE, ge=1, le=ANALYSES_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="Comma-separated subset, e.g. id,dishName,date"),
+    since: Optional[int] = Query(None, ge=0, description="Sync version from X-Sync-Version; returns only changes after it"),
+):
+    """Newest first, keyset-paginated. When more rows exist the X-Next-Cursor header holds the cursor for the next page.
+
+    Responses carry an ETag/Last-Modified derived from the user's change counter (304 when unchanged)
+    and X-Sync-Version. With ?since=<version> the response is a delta instead:
+    {"version", "changes": [rows], "deleted": [ids], "hasMore", "cursor"}; while hasMore, repeat with
+    since=version&cursor=cursor. Many rows can share a version (migrated rows, imports), so a page may end
+    partway through one and the cursor says where to resume. Deletions are kept for SYNC_TOMBSTONE_DAYS:
+    an older since gets 410, and the client should drop its copy and sync again from since=0.
+    """
+    wanted = parse_fields(fields)
+    columns = list(dict.fromkeys(col for f in wanted for col in ANALYSIS_FIELDS[f]))
     with get_db() as conn:
+        headers, fresh = sync_validators(conn, request, user_id)
+        if fresh:
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        version = int(headers["X-Sync-Version"])
+
+        if since is not None:
+            pruned = conn.execute("SELECT pruned_version FROM user_sync WHERE user_id = ?", (user_id,)).fetchone()
+            if since and pruned and since < pruned[0]:
+                raise HTTPException(status_code=410, detail="Sync version too old: deletions since then are no longer kept. Sync again from since=0.")
+            # Keyset on (updated_version, rowid); idx_analyses_user_version carries the rowid, so no sort step
+            position, params = "updated_version > ?", [user_id, since]
+            if cursor:
+                position, params = "(updated_version, rowid) > (?, ?)", params + [decode_sync_cursor(cursor, since)]
+            rows = conn.execute(
+                f"""SELECT {', '.join(columns + ["updated_version", "rowid"])} FROM analyses
+                    WHERE user_id = ? AND {position} ORDER BY updated_version, rowid LIMIT ?""",
+                (*params, limit + 1),
+            ).fetchall()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            upper = rows[-1]["updated_version"] if has_more else version
+            deleted = conn.execute(
+                "SELECT id FROM analysis_tombstones WHERE user_id = ? AND version > ? AND version <= ? ORDER BY version",
+                (user_id, since, upper),
+            ).fetchall()
+            return {
+                "version": upper,
+                "changes": [analysis_row_to_dict(r, wanted) for r in rows],
+                "deleted": [r["id"] for r in deleted],
+                "hasMore": has_more,
+                "cursor": encode_sync_cursor(upper, rows[-1]["rowid"]) if has_more else None,
+            }
+
+        where, params = "user_id = ?", [user_id]
+        if cursor:
+            where += " AND (created_at, id) < (?, ?)"
+            params += list(decode_cursor(cursor))
         rows = conn.execute(
-            """SELECT id, dish_name, analysis_text, preview, created_at,
-                      COALESCE(current_conditions, '') AS current_conditions,
-                      COALESCE(concerned_conditions, '') AS concerned_conditions,
-                      COALESCE(user_description, '') AS user_description
-               FROM analyses WHERE user_id = ? ORDER BY created_at DESC LIMIT 50""",
-            (user_id,),
+            f"SELECT {', '.join(columns)} FROM analyses WHERE {where} ORDER BY created_at DESC, id DESC LIMIT ?",
+            (*params, limit + 1),
         ).fetchall()
-    return [
-        {
-            "id": r["id"],
-            "dishName": r["dish_name"],
-            "analysis": r["analysis_text"],
-            "preview": r["preview"],
-            "date": r["created_at"],
-            "currentConditions": r["current_conditions"],
-            "concernedConditions": r["concerned_conditions"],
-            "userDescription": r["user_description"],
-        }
-        for r in rows
-    ]
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return [analysis_row_to_dict(r, wanted) for r in rows]
 
 
 @app.post("/analyses")
@@ -387,32 +951,234 @@ def create_analysis(body: AnalysisCreate, user_id: str = Depends(require_user)):
     cc = (body.current_conditions or "").strip()
     coc = (body.concerned_conditions or "").strip()
     ud = (body.user_description or "").strip()
-    with get_db() as conn:
+    facts = extract_facts(body.analysis)
+    dish_name = body.dish_name.strip() or facts["dish_name"] or "Food"
+    with get_db() as conn, stored_previews([body.preview]) as [(preview, preview_hash, preview_mime)]:
+        version = bump_sync_version(conn, user_id)
         conn.execute(
-            """INSERT INTO analyses (id, user_id, dish_name, analysis_text, preview, created_at, current_conditions, concerned_conditions, user_description)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (aid, user_id, body.dish_name, body.analysis, body.preview, created, cc, coc, ud),
+            f"""INSERT INTO analyses (id, user_id, dish_name, analysis_text, preview, preview_hash, preview_mime, created_at, current_conditions, concerned_conditions, user_description, updated_version, {', '.join(FACT_COLUMNS)})
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {', '.join('?' * len(FACT_COLUMNS))})""",
+            (aid, user_id, dish_name, body.analysis, preview, preview_hash, preview_mime, created, cc, coc, ud, version, *(facts[c] for c in FACT_COLUMNS)),
         )
         conn.commit()
     return {
         "id": aid,
-        "dishName": body.dish_name,
+        "dishName": dish_name,
         "analysis": body.analysis,
-        "preview": body.preview,
+        **preview_urls(aid, preview_hash, preview),
         "date": created,
         "currentConditions": cc,
         "concernedConditions": coc,
         "userDescription": ud,
+        "metrics": metrics_to_dict(facts),
+        "nutritionScore": facts["nutrition_score"],
+    }
+
+
+STATS_PERIODS = {
+    # SQLite date modifiers mapping a (local) timestamp to the first day of its bucket; weeks start on Monday
+    "day": "date({ts})",
+    "week": "date({ts}, '-6 days', 'weekday 1')",
+}
+STATS_MAX_DAYS = 366
+
+
+@app.get("/analyses/stats")
+def analyses_stats(
+    request: Request,
+    response: Response,
+    user_id: str = Depends(require_user),
+    period: str = Query("day", description="Bucket size: day or week"),
+    start: Optional[str] = Query(None, description="First local date (YYYY-MM-DD); default 30 days before end"),
+    end: Optional[str] = Query(None, description="Last local date (YYYY-MM-DD), inclusive; default today"),
+    tz_offset: int = Query(0, ge=-14 * 60, le=14 * 60, description="Minutes east of UTC used to assign analyses to local days"),
+):
+    """Per-day or per-week nutrition aggregates over a date range, computed in SQL from the typed fact columns.
+
+    Each bucket has the analysis count, calorie range and macro/sodium sums, and min/avg/max nutrition
+    score. Only buckets containing analyses are returned. Same ETag/304 behaviour as GET /analyses, except
+    that the ETag also covers the resolved date range, so a default range that rolls over to a new day is
+    not revalidated as current.
+    """
+    if period not in STATS_PERIODS:
+        raise HTTPException(status_code=400, detail=f"period must be one of: {', '.join(STATS_PERIODS)}")
+    offset = timedelta(minutes=tz_offset)
+    try:
+        end_date = datetime.fromisoformat(end).date() if end else (datetime.utcnow() + offset).date()
+        start_date = datetime.fromisoformat(start).date() if start else end_date - timedelta(days=29)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be dates (YYYY-MM-DD)")
+    if start_date > end_date or (end_date - start_date).days >= STATS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"start must not be after end, and the range may span at most {STATS_MAX_DAYS} days")
+    # created_at is naive UTC ISO text, so local-day bounds become a UTC string range on idx_analyses_user_created
+    lower = (datetime.combine(start_date, datetime.min.time()) - offset).isoformat()
+    upper = (datetime.combine(end_date + timedelta(days=1), datetime.min.time()) - offset).isoformat()
+    bucket = STATS_PERIODS[period].format(ts=f"datetime(created_at, '{tz_offset:+d} minutes')")
+    aggregates = """COUNT(*) AS count, COUNT(nutrition_score) AS scored,
+        MIN(nutrition_score) AS min_score, AVG(nutrition_score) AS avg_score, MAX(nutrition_score) AS max_score,
+        SUM(calories_min) AS calories_min, SUM(calories_max) AS calories_max, SUM(protein_g) AS protein_g,
+        SUM(carbs_g) AS carbs_g, SUM(fat_g) AS fat_g, SUM(fiber_g) AS fiber_g, SUM(sugar_g) AS sugar_g,
+        SUM(sodium_mg) AS sodium_mg"""
+    where = "user_id = ? AND created_at >= ? AND created_at < ?"
+    with get_db() as conn:
+        # A defaulted end moves with the calendar, so the ETag covers the resolved range and dates aren't trusted
+        window = f"{start_date.isoformat()}/{end_date.isoformat()}/{tz_offset}"
+        headers, fresh = sync_validators(conn, request, user_id, resolved=window, dated=end is not None)
+        if fresh:
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        rows = conn.execute(
+            f"SELECT {bucket} AS bucket, {aggregates} FROM analyses WHERE {where} GROUP BY bucket ORDER BY bucket",
+            (user_id, lower, upper),
+        ).fetchall()
+        total = conn.execute(f"SELECT {aggregates} FROM analyses WHERE {where}", (user_id, lower, upper)).fetchone()
+
+    def stats_dict(r) -> dict:
+        return {
+            "count": r["count"],
+            "scored": r["scored"],
+            "nutritionScore": {
+                "min": r["min_score"],
+                "avg": round(r["avg_score"], 1) if r["avg_score"] is not None else None,
+                "max": r["max_score"],
+            },
+            **{key: round(r[col], 1) if r[col] is not None else None for key, col in METRIC_KEYS.items()},
+        }
+
+    return {
+        "period": period,
+        "start": start_date.isoformat(),
+        "end": end_date.isoformat(),
+        "tzOffset": tz_offset,
+        "buckets": [{"start": r["bucket"], **stats_dict(r)} for r in rows],
+        "total": stats_dict(total),
     }
 
 
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_OFFSET = 1000
+_SEARCH_TERM_RE = re.compile(r"\w+")
+# Sentinels FTS5 wraps around matched terms; swapped for <mark> after the text is HTML-escaped
+_MARK_OPEN, _MARK_CLOSE = "\x02", "\x03"
+
+
+def fts_query(q: str, user_id: str) -> Optional[str]:
+    """FTS5 MATCH expression: every word must match (the last one as a prefix), scoped to the user's rows."""
+    terms = _SEARCH_TERM_RE.findall(q)[:12]
+    if not terms:
+        return None
+    words = " ".join(f'"{t}"' for t in terms[:-1]) + f' "{terms[-1]}"*'
+    owner = user_id.replace('"', '""')
+    return f'user_id : "{owner}" AND ({words.strip()})'
+
+
+def marked_html(text: Optional[str]) -> str:
+    return html.escape(text or "").replace(_MARK_OPEN, "<mark>").replace(_MARK_CLOSE, "</mark>")
+
+
+@app.get("/analyses/search")
+def search_analyses(
+    request: Request,
+    response: Response,
+    user_id: str = Depends(require_user),
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=ANALYSES_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+):
+    """Full-text search over the user's dish names, analyses and descriptions, best match first.
+
+    Words match on their stem and the last word also as a prefix. Results carry HTML-escaped,
+    <mark>-highlighted dishName/userDescription and an analysis snippet. When more results exist
+    the X-Next-Offset header holds the offset of the next page.
+    """
+    match = fts_query(q, user_id)
+    if match is None:
+        raise HTTPException(status_code=400, detail="Search query must contain at least one word")
+    with get_db() as conn:
+        headers, fresh = sync_validators(conn, request, user_id)
+        if fresh:
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        # rank is the column-weighted bm25 configured in migration 7 (lower is better)
+        rows = conn.execute(
+            """SELECT a.id, a.dish_name, a.created_at, a.nutrition_score, a.preview, a.preview_hash,
+                      highlight(analyses_fts, 1, ?, ?) AS dish_highlight,
+                      highlight(analyses_fts, 3, ?, ?) AS description_highlight,
+                      snippet(analyses_fts, 2, ?, ?, '…', 16) AS snippet,
+                      analyses_fts.rank AS score
+               FROM analyses_fts JOIN analyses a ON a.rowid = analyses_fts.rowid
+               WHERE analyses_fts MATCH ? AND a.user_id = ?
+               ORDER BY analyses_fts.rank LIMIT ? OFFSET ?""",
+            (*(_MARK_OPEN, _MARK_CLOSE) * 3, match, user_id, limit + 1, offset),
+        ).fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Offset"] = str(offset + limit)
+    return [
+        {
+            "id": r["id"],
+            "dishName": r["dish_name"],
+            "date": r["created_at"],
+            "nutritionScore": r["nutrition_score"],
+            **preview_urls(r["id"], r["preview_hash"], r["preview"]),
+            "highlights": {"dishName": marked_html(r["dish_highlight"]), "userDescription": marked_html(r["description_highlight"])},
+            "snippet": marked_html(r["snippet"]),
+            "score": round(-r["score"], 4),
+        }
+        for r in rows
+    ]
+
+
+@app.get("/analyses/{analysis_id}/preview")
+def get_analysis_preview(
+    analysis_id: str,
+    request: Request,
+    sig: Optional[str] = None,
+    size: Optional[int] = Query(None, description=f"Thumbnail max dimension: one of {THUMBNAIL_SIZES}"),
+    user_id: Optional[str] = Depends(get_current_user_id),
+):
+    """Serve a stored preview (or thumbnail) with long-lived caching and ETag/304 support.
+
+    The URL is on the app's origin (via the /api rewrite), so responses forbid MIME sniffing and any
+    active content, and blobs of a type outside PREVIEW_TYPES (stored before it was enforced) are not served.
+    """
+    if size is not None and size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {list(THUMBNAIL_SIZES)}")
+    signed = sig is not None and hmac.compare_digest(sig, preview_signature(analysis_id))
+    with get_db() as conn:
+        row = conn.execute("SELECT user_id, preview_hash, preview_mime FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+    if not row or not row["preview_hash"] or not (signed or row["user_id"] == user_id) or row["preview_mime"] not in PREVIEW_TYPES:
+        raise HTTPException(status_code=404, detail="Preview not found")
+    etag = f'"{row["preview_hash"][:32]}-{size or "orig"}"'
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={PREVIEW_CACHE_MAX_AGE}, immutable", **PREVIEW_SECURITY_HEADERS}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    if size is None:
+        path, mime = preview_store.path(row["preview_hash"], row["preview_mime"]), row["preview_mime"]
+    else:
+        path, mime = preview_store.thumbnail(row["preview_hash"], row["preview_mime"], size) or (None, None)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Preview not found")
+    return FileResponse(path, media_type=mime, headers=headers)
+
+
 @app.delete("/analyses/{analysis_id}")
 def delete_analysis(analysis_id: str, user_id: str = Depends(require_user)):
     with get_db() as conn:
-        cur = conn.execute("DELETE FROM analyses WHERE id = ? AND user_id = ?", (analysis_id, user_id))
+        previews = conn.execute(
+            "SELECT preview_hash, preview_mime FROM analyses WHERE id = ? AND user_id = ?", (analysis_id, user_id)
+        ).fetchall()
+        if not previews:
+            raise HTTPException(status_code=404, detail="Analysis not found")
+        version = bump_sync_version(conn, user_id)
+        conn.execute(
+            "INSERT INTO analysis_tombstones (id, user_id, version, deleted_at) VALUES (?, ?, ?, ?)",
+            (analysis_id, user_id, version, datetime.utcnow().isoformat()),
+        )
+        conn.execute("DELETE FROM analyses WHERE id = ? AND user_id = ?", (analysis_id, user_id))
+        prune_tombstones(conn, user_id)
         conn.commit()
-    if cur.rowcount == 0:
-        raise HTTPException(status_code=404, detail="Analysis not found")
+        release_previews(conn, [tuple(r) for r in previews])
     return {"ok": True}
 
 
@@ -421,48 +1187,330 @@ def patch_analysis(analysis_id: str, body: AnalysisPatch, user_id: str = Depends
     if body.dish_name is None:
         return {"ok": True}
     with get_db() as conn:
+        version = bump_sync_version(conn, user_id)
         cur = conn.execute(
-            "UPDATE analyses SET dish_name = ? WHERE id = ? AND user_id = ?",
-            (body.dish_name.strip(), analysis_id, user_id),
+            "UPDATE analyses SET dish_name = ?, updated_version = ? WHERE id = ? AND user_id = ?",
+            (body.dish_name.strip(), version, analysis_id, user_id),
         )
+        if cur.rowcount == 0:
+            conn.rollback()
+            raise HTTPException(status_code=404, detail="Analysis not found")
         conn.commit()
-    if cur.rowcount == 0:
-        raise HTTPException(status_code=404, detail="Analysis not found")
     return {"ok": True}
 
 
 @app.delete("/analyses")
 def delete_all_analyses(user_id: str = Depends(require_user)):
     with get_db() as conn:
+        previews = conn.execute(
+            "SELECT DISTINCT preview_hash, preview_mime FROM analyses WHERE user_id = ? AND preview_hash IS NOT NULL", (user_id,)
+        ).fetchall()
+        version = bump_sync_version(conn, user_id)
+        conn.execute(
+            """INSERT INTO analysis_tombstones (id, user_id, version, deleted_at)
+               SELECT id, user_id, ?, ? FROM analyses WHERE user_id = ?""",
+            (version, datetime.utcnow().isoformat(), user_id),
+        )
         conn.execute("DELETE FROM analyses WHERE user_id = ?", (user_id,))
+        prune_tombstones(conn, user_id)
         conn.commit()
+        release_previews(conn, [tuple(r) for r in previews])
     return {"ok": True}
 
 
-# ----- Analyze (no auth required; frontend can call with or without user) -----
-@app.post("/analyze")
-async def analyze(
-    file: UploadFile = File(...),
-    current_conditions: str = Form("No current medical conditions"),
-    concerned_conditions: str = Form("None specified"),
-    user_description: Optional[str] = Form(""),
+BULK_DELETE_MAX_IDS = 1000
+
+
+@app.post("/analyses/delete")
+def delete_analyses(body: AnalysesDelete, user_id: str = Depends(require_user)):
+    """Delete up to BULK_DELETE_MAX_IDS analyses by id in one transaction; ids that are not the user's come back in notFound."""
+    ids = list(dict.fromkeys(body.ids))
+    if len(ids) > BULK_DELETE_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_DELETE_MAX_IDS} ids per request")
+    rows = []
+    if ids:
+        with get_db() as conn:
+            rows = conn.execute(
+                # Unary + keeps the planner on the primary key instead of scanning the user's whole index range
+                f"SELECT id, preview_hash, preview_mime FROM analyses WHERE id IN ({','.join('?' * len(ids))}) AND +user_id = ?",
+                (*ids, user_id),
+            ).fetchall()
+            if rows:
+                found = [r["id"] for r in rows]
+                version = bump_sync_version(conn, user_id)
+                deleted_at = datetime.utcnow().isoformat()
+                conn.executemany(
+                    "INSERT INTO analysis_tombstones (id, user_id, version, deleted_at) VALUES (?, ?, ?, ?)",
+                    [(aid, user_id, version, deleted_at) for aid in found],
+                )
+                conn.execute(f"DELETE FROM analyses WHERE id IN ({','.join('?' * len(found))}) AND +user_id = ?", (*found, user_id))
+                prune_tombstones(conn, user_id)
+                conn.commit()
+                release_previews(conn, [(r["preview_hash"], r["preview_mime"]) for r in rows])
+    found_ids = {r["id"] for r in rows}
+    return {"deleted": len(found_ids), "notFound": [aid for aid in ids if aid not in found_ids]}
+
+
+# ----- Export / import (NDJSON, one analysis per line) -----
+EXPORT_PREVIEWS = ("none", "url", "inline")
+EXPORT_FIELDS = [f for f in ANALYSIS_FIELDS if f not in ("preview", "thumbnail")]
+EXPORT_PAGE_ROWS = 500
+# Inline previews are 100 KB+ each as data URLs; smaller pages keep every chunk of the stream small
+EXPORT_INLINE_PAGE_ROWS = 20
+IMPORT_BATCH_ROWS = int(os.environ.get("IMPORT_BATCH_ROWS", "1000"))
+IMPORT_BATCH_BYTES = 8 * 1024 * 1024
+IMPORT_MAX_ROWS = int(os.environ.get("IMPORT_MAX_ROWS", "200000"))
+# A line may carry an upload-sized preview as base64 plus the analysis text
+IMPORT_MAX_LINE_BYTES = int(MAX_UPLOAD_MB * 1024 * 1024 * 4 / 3) + 256 * 1024
+IMPORT_MAX_ERRORS = 20
+IMPORT_TEXT_FIELDS = ("dishName", "currentConditions", "concernedConditions", "userDescription")
+# One encoder for every line; json.dumps(..., separators=...) would build a new one per row
+_ndjson_encode = json.JSONEncoder(separators=(",", ":")).encode
+
+
+def inline_preview(preview_hash: str, mime: str) -> Optional[str]:
+    path = preview_store.path(preview_hash, mime)
+    if path is None:
+        return None
+    return f"data:{mime};base64,{base64.b64encode(path.read_bytes()).decode()}"
+
+
+def export_row(r, previews: str) -> dict:
+    row = analysis_row_to_dict(r, EXPORT_FIELDS)
+    if previews == "url":
+        row.update(preview_urls(r["id"], r["preview_hash"], r["preview"]))
+    elif previews == "inline":
+        row["preview"] = inline_preview(r["preview_hash"], r["preview_mime"]) if r["preview_hash"] else r["preview"]
+    return row
+
+
+def export_chunks(user_id: str, previews: str) -> Iterator[str]:
+    """NDJSON pages, oldest first. Each page is its own short keyset query on (created_at, id), so memory stays
+    at one page and a slow download never holds a pooled connection or a read transaction open."""
+    columns = list(dict.fromkeys(col for f in EXPORT_FIELDS for col in ANALYSIS_FIELDS[f]))
+    if previews != "none":
+        columns += ["preview", "preview_hash", "preview_mime"]
+    page = EXPORT_INLINE_PAGE_ROWS if previews == "inline" else EXPORT_PAGE_ROWS
+    after = ("", "")
+    while True:
+        with get_db() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(columns)} FROM analyses WHERE user_id = ? AND (created_at, id) > (?, ?) ORDER BY created_at, id LIMIT ?",
+                (user_id, *after, page),
+            ).fetchall()
+        if rows:
+            yield "".join(_ndjson_encode(export_row(r, previews)) + "\n" for r in rows)
+        if len(rows) < page:
+            return
+        after = (rows[-1]["created_at"], rows[-1]["id"])
+
+
+@app.get("/analyses/export")
+def export_analyses(
+    user_id: str = Depends(require_user),
+    previews: str = Query("none", description="none, url (signed preview/thumbnail URLs) or inline (data URLs, portable to another account)"),
 ):
-    if not OPENAI_API_KEY:
-        raise HTTPException(status_code=500, detail="OpenAI API key not configured. Set OPENAI_API_KEY.")
-    # OpenAI accepts only png, jpeg, gif, webp
-    allowed_types = {"image/png", "image/jpeg", "image/jpg", "image/gif", "image/webp"}
+    """The full history as NDJSON, one analysis per line in the GET /analyses shape, streamed in constant memory.
+
+    POST /analyses/import accepts the output as-is.
+    """
+    if previews not in EXPORT_PREVIEWS:
+        raise HTTPException(status_code=400, detail=f"previews must be one of: {', '.join(EXPORT_PREVIEWS)}")
+    filename = f"nutrimedai-analyses-{datetime.utcnow():%Y%m%d}.ndjson"
+    return StreamingResponse(
+        export_chunks(user_id, previews),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
+
+
+def parse_import_line(line: bytes) -> dict:
+    """Validate one NDJSON line; raises ValueError with a client-facing reason."""
+    try:
+        item = json.loads(line)
+    except ValueError:
+        raise ValueError("invalid JSON")
+    if not isinstance(item, dict):
+        raise ValueError("expected a JSON object")
+    analysis = item.get("analysis")
+    if not isinstance(analysis, str) or not analysis.strip():
+        raise ValueError("analysis is required")
+    text = {}
+    for key in IMPORT_TEXT_FIELDS:
+        value = item.get(key) or ""
+        if not isinstance(value, str):
+            raise ValueError(f"{key} must be a string")
+        text[key] = value.strip()
+    created = datetime.utcnow()
+    if item.get("date"):
+        try:
+            created = datetime.fromisoformat(str(item["date"]))
+        except ValueError:
+            raise ValueError("date must be an ISO 8601 timestamp")
+        if created.tzinfo is not None:
+            created = created.astimezone(timezone.utc).replace(tzinfo=None)
+    # Only data URLs are portable; preview URLs from another export point at the old rows
+    preview = item.get("preview")
+    if not (isinstance(preview, str) and preview.startswith("data:")):
+        preview = None
+    elif parse_data_url(preview) is None:
+        raise ValueError(INVALID_PREVIEW)
+    facts = extract_facts(analysis)
+    return {
+        **text,
+        "dishName": text["dishName"] or facts["dish_name"] or "Food",
+        "analysis": analysis,
+        "date": created.isoformat(),
+        "preview": preview,
+        "facts": facts,
+    }
+
+
+def import_batch(user_id: str, lines: List[Tuple[int, bytes]]) -> Tuple[int, List[dict]]:
+    """Insert the valid lines of one batch in a single transaction.
+
+    The whole batch shares one sync version; delta sync pages by (updated_version, rowid), so a page
+    boundary inside the batch resumes from the cursor instead of skipping the rest of it.
+    """
+    items, errors = [], []
+    for line_no, line in lines:
+        try:
+            items.append(parse_import_line(line))
+        except ValueError as e:
+            errors.append({"line": line_no, "error": str(e)})
+    if not items:
+        return 0, errors
+    with get_db() as conn, stored_previews([item["preview"] for item in items]) as previews:
+        version = bump_sync_version(conn, user_id)
+        conn.executemany(
+            f"""INSERT INTO analyses (id, user_id, dish_name, analysis_text, preview, preview_hash, preview_mime, created_at, current_conditions, concerned_conditions, user_description, updated_version, {', '.join(FACT_COLUMNS)})
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {', '.join('?' * len(FACT_COLUMNS))})""",
+            [
+                (
+                    str(uuid.uuid4()), user_id, item["dishName"], item["analysis"], *preview, item["date"],
+                    item["currentConditions"], item["concernedConditions"], item["userDescription"], version,
+                    *(item["facts"][c] for c in FACT_COLUMNS),
+                )
+                for item, preview in zip(items, previews)
+            ],
+        )
+        conn.commit()
+    return len(items), errors
+
+
+@app.post("/analyses/import")
+async def import_analyses(request: Request, user_id: str = Depends(require_user)):
+    """Create analyses from an NDJSON body (the /analyses/export format), read as a stream and inserted in batches.
+
+    Every line becomes a new analysis with a new id. dishName, date, conditions, userDescription and inline
+    (data URL) previews are kept; nutrition facts are re-parsed from the analysis text. Invalid lines are
+    skipped and reported (the first IMPORT_MAX_ERRORS). Batches committed before an error stay imported.
+    """
+    started = time.perf_counter()
+    imported, skipped, errors = 0, 0, []
+    batch: List[Tuple[int, bytes]] = []
+    batch_bytes = 0
+    line_no = 0
+    # The unterminated tail of the body so far, as received chunks; joined once its newline arrives
+    pending: List[bytes] = []
+    pending_bytes = 0
+
+    async def flush():
+        nonlocal imported, skipped, batch, batch_bytes
+        count, bad = await run_in_threadpool(import_batch, user_id, batch)
+        imported += count
+        skipped += len(bad)
+        errors.extend(bad[:IMPORT_MAX_ERRORS - len(errors)])
+        batch, batch_bytes = [], 0
+
+    async def add(line: bytes):
+        nonlocal line_no, batch_bytes
+        line_no += 1
+        if not line.strip():
+            return
+        if imported + skipped + len(batch) >= IMPORT_MAX_ROWS:
+            if batch:
+                await flush()
+            raise HTTPException(status_code=413, detail=f"At most {IMPORT_MAX_ROWS} analyses per import; the first {imported} were imported")
+        batch.append((line_no, line))
+        batch_bytes += len(line)
+        if len(batch) >= IMPORT_BATCH_ROWS or batch_bytes >= IMPORT_BATCH_BYTES:
+            await flush()
+
+    async for chunk in request.stream():
+        if b"\n" not in chunk:
+            pending.append(chunk)
+            pending_bytes += len(chunk)
+            if pending_bytes > IMPORT_MAX_LINE_BYTES:
+                raise HTTPException(status_code=413, detail=f"Line {line_no + 1} is too long; {imported} analyses were imported")
+            continue
+        first, *lines, tail = chunk.split(b"\n")
+        await add(b"".join(pending + [first]))
+        for line in lines:
+            await add(line)
+        pending, pending_bytes = [tail], len(tail)
+    await add(b"".join(pending))
+    if batch:
+        await flush()
+    logger.info("Imported %s analyses for user %s (%s lines skipped) in %.1f s", imported, user_id, skipped, time.perf_counter() - started)
+    return {"imported": imported, "skipped": skipped, "errors": errors}
+
+
+# ----- Analyze (no auth required; frontend can call with or without user) -----
+async def read_upload_limited(file: UploadFile, max_bytes: int) -> bytes:
+    """Read an upload in chunks, rejecting it as soon as it exceeds max_bytes."""
+    too_large = HTTPException(status_code=413, detail=f"Image too large. Maximum size is {MAX_UPLOAD_MB:g} MB.")
+    if file.size is not None and file.size > max_bytes:
+        raise too_large
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(1 << 16)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+# OpenAI accepts only png, jpeg, gif, webp
+ALLOWED_IMAGE_TYPES = {"image/png", "image/jpeg", "image/jpg", "image/gif", "image/webp"}
+
+
+def validate_image_type(file: UploadFile) -> str:
+    """Return the MIME type to send upstream, or raise 400 for unsupported uploads."""
     ct = (file.content_type or "").strip().lower()
-    if ct not in allowed_types:
+    if ct not in ALLOWED_IMAGE_TYPES:
         raise HTTPException(
             status_code=400,
             detail="Image must be PNG, JPEG, GIF, or WebP. Other formats (e.g. HEIC) are not supported.",
         )
-
-    contents = await file.read()
-    img_base64 = base64.b64encode(contents).decode()
     # Use correct MIME type in data URL (OpenAI rejects wrong type)
-    mime = "image/jpeg" if ct == "image/jpg" else ct
+    return "image/jpeg" if ct == "image/jpg" else ct
+
 
+async def preprocess_upload(contents: bytes, mime: str, headers) -> PreparedImage:
+    """Normalize the upload in the image pool and report before/after sizes on the response headers."""
+    try:
+        image = await asyncio.get_running_loop().run_in_executor(
+            _image_pool,
+            partial(prepare_image, contents, mime, IMAGE_MAX_DIMENSION, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_DETAIL),
+        )
+    except ImageDecodeError:
+        raise HTTPException(status_code=400, detail="Could not read image. The file may be corrupt or not a supported image.")
+    headers["X-Image-Bytes-In"] = str(image.bytes_in)
+    headers["X-Image-Bytes-Out"] = str(image.bytes_out)
+    headers["X-Image-Preprocess-Ms"] = f"{image.seconds * 1000:.1f}"
+    logger.info(
+        "Image preprocessed: %s -> %s bytes (%sx%s, detail=%s) in %.1f ms",
+        image.bytes_in, image.bytes_out, image.width, image.height, image.detail, image.seconds * 1000,
+    )
+    return image
+
+
+def analysis_prompt(current_conditions: str, concerned_conditions: str, user_description: Optional[str]) -> str:
     has_current = current_conditions and "no current" not in current_conditions.lower() and "none" not in current_conditions.lower()
     has_concerned = concerned_conditions and "none" not in concerned_conditions.lower()
     prompt = build_prompt(current_conditions, concerned_conditions, has_current, has_concerned)
@@ -475,31 +1523,390 @@ async def analyze(
 Use the above to tailor your analysis. Then provide the full assessment below.
 
 {prompt}"""
+    return prompt
+
+
+def packed_prompt(count: int, prompt: str) -> str:
+    """Ask for several images in one completion, each answered in the single-image format of build_prompt."""
+    return f"""You are given {count} food images from one meal, numbered 1 to {count} in the order attached.
+For each image write a line "=== IMAGE k ===" (k = the image number), then the complete assessment for that image in the format below.
+After the last image write a line "=== MEAL SUMMARY ===", then 2-3 plain sentences on the meal as a whole for this user's profile.
+
+{prompt}"""
+
+
+def client_ip(request: Request) -> str:
+    """Rate-limit key for anonymous callers; the leftmost X-Forwarded-For entries are whatever the client sent."""
+    if TRUSTED_PROXY_HOPS:
+        hops = [h.strip() for h in ",".join(request.headers.getlist("x-forwarded-for")).split(",") if h.strip()]
+        # Fewer entries than trusted proxies: the request did not come through them, so fall back to the peer
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
 
+def rejected_http_error(e: Rejected) -> HTTPException:
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after is not None else None
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+
+
+def check_analyze_rate(request: Request, user_id: Optional[str], cost: int = 1) -> None:
+    """Spend cost tokens from the caller's bucket (user id when signed in, else client IP) or raise 429 (400 if cost exceeds the burst)."""
     try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        response = client.chat.completions.create(
-            model=OPENAI_VISION_MODEL,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{img_base64}"}},
-                    ],
-                }
-            ],
-            max_tokens=1500,
-        )
-        result = response.choices[0].message.content
-        return {"analysis": result}
+        if user_id:
+            user_rate_limiter.acquire(user_id, cost)
+        else:
+            ip_rate_limiter.acquire(client_ip(request), cost)
+    except Rejected as e:
+        raise rejected_http_error(e)
+
+
+def charge_upstream(request: Request, user_id: Optional[str], cache_keys: List[str]) -> None:
+    """Spend one token per distinct cache miss this request will send upstream.
+
+    Called after the cache lookup with the missed keys: cache hits and misses that join an identical call
+    already in flight (analyze_inflight) cost nothing, so repeat uploads are never rate limited.
+    """
+    cost = len({key for key in cache_keys if not analyze_inflight.in_flight(key)})
+    if cost:
+        check_analyze_rate(request, user_id, cost)
+
+
+def require_vision_backend() -> None:
+    error = vision_backend.configuration_error()
+    if error:
+        raise HTTPException(status_code=500, detail=error)
+
+
+async def vision_complete(prompt: str, images: List[PreparedImage], max_tokens: int) -> str:
+    """One analysis from the configured vision backend; caller holds an admission slot."""
+    try:
+        return await vision_backend.complete(prompt, images, max_tokens)
+    except Rejected as e:
+        raise rejected_http_error(e)
     except Exception as e:
-        err_msg = str(e)
-        if "api_key" in err_msg.lower() or "authentication" in err_msg.lower():
-            raise HTTPException(status_code=500, detail="OpenAI API key invalid or missing. Check OPENAI_API_KEY.")
-        if "rate" in err_msg.lower() or "quota" in err_msg.lower():
-            raise HTTPException(status_code=429, detail="OpenAI rate limit or quota exceeded. Try again later.")
-        raise HTTPException(status_code=502, detail=f"OpenAI API error: {err_msg[:200]}")
+        raise vision_http_error(e)
+
+
+async def vision_stream(prompt: str, images: List[PreparedImage], max_tokens: int) -> TextStream:
+    try:
+        return await vision_backend.open_stream(prompt, images, max_tokens)
+    except Rejected as e:
+        raise rejected_http_error(e)
+    except Exception as e:
+        raise vision_http_error(e)
+
+
+async def acquire_upstream_slot() -> None:
+    try:
+        await upstream_admission.acquire()
+    except Rejected as e:
+        raise rejected_http_error(e)
+
+
+def vision_http_error(e: Exception) -> HTTPException:
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, Rejected):
+        return rejected_http_error(e)
+    ERRORS.inc(source="vision", type=type(e).__name__)
+    openai = loaded_openai()
+    if openai is None or not isinstance(e, openai.OpenAIError):
+        logger.error("Vision backend %s failed: %s", vision_backend.name, e)
+        return HTTPException(status_code=502, detail=f"Vision model error: {str(e)[:200]}")
+    if isinstance(e, openai.RateLimitError):
+        retry_after = retry_after_seconds(e)
+        return HTTPException(
+            status_code=429,
+            detail="OpenAI rate limit or quota exceeded. Try again later.",
+            headers={"Retry-After": str(max(1, int(retry_after or 30)))},
+        )
+    if isinstance(e, openai.APITimeoutError):
+        return HTTPException(status_code=504, detail="OpenAI API timed out. Try again later.")
+    err_msg = str(e)
+    if "api_key" in err_msg.lower() or "authentication" in err_msg.lower():
+        return HTTPException(status_code=500, detail="OpenAI API key invalid or missing. Check OPENAI_API_KEY.")
+    if "rate" in err_msg.lower() or "quota" in err_msg.lower():
+        return HTTPException(status_code=429, detail="OpenAI rate limit or quota exceeded. Try again later.")
+    return HTTPException(status_code=502, detail=f"OpenAI API error: {err_msg[:200]}")
+
+
+async def analysis_cache_key(contents: bytes, current_conditions: str, concerned_conditions: str, user_description: Optional[str]) -> str:
+    return make_key(
+        await run_in_threadpool(image_digest, contents),
+        vision_backend.model_id, current_conditions, concerned_conditions, user_description or "",
+    )
+
+
+async def analyze_upload(
+    contents: bytes,
+    mime: str,
+    current_conditions: str,
+    concerned_conditions: str,
+    user_description: Optional[str],
+    headers,
+    cache_key: Optional[str] = None,
+    charge: Optional[Callable[[str], None]] = None,
+) -> Tuple[str, str, bool]:
+    """Cached, coalesced, admission-controlled analysis of one image. Returns (analysis, X-Cache value, coalesced).
+
+    On a cache miss, charge(cache_key) runs right before the call is started or joined, with no await in
+    between, so it sees whether an identical call is in flight (see charge_upstream).
+    """
+    cache_key = cache_key or await analysis_cache_key(contents, current_conditions, concerned_conditions, user_description)
+    cached, tier = await run_in_threadpool(analysis_cache.get, cache_key)
+    if cached is not None:
+        return cached, f"HIT-{tier.upper()}", False
+    if charge is not None:
+        charge(cache_key)
+
+    async def run_analysis() -> str:
+        image = await preprocess_upload(contents, mime, headers)
+        prompt = analysis_prompt(current_conditions, concerned_conditions, user_description)
+        await acquire_upstream_slot()
+        try:
+            result = await vision_complete(prompt, [image], 1500)
+        finally:
+            upstream_admission.release()
+        if result:
+            await run_in_threadpool(analysis_cache.put, cache_key, result)
+        return result
+
+    result, shared = await analyze_inflight.do(cache_key, run_analysis)
+    return result, "MISS", shared
+
+
+@app.post("/analyze")
+async def analyze(
+    request: Request,
+    response: Response,
+    file: UploadFile = File(...),
+    current_conditions: str = Form("No current medical conditions"),
+    concerned_conditions: str = Form("None specified"),
+    user_description: Optional[str] = Form(""),
+    user_id: Optional[str] = Depends(get_current_user_id),
+):
+    require_vision_backend()
+    mime = validate_image_type(file)
+
+    contents = await read_upload_limited(file, int(MAX_UPLOAD_MB * 1024 * 1024))
+    result, cache_status, shared = await analyze_upload(
+        contents, mime, current_conditions, concerned_conditions, user_description, response.headers,
+        charge=lambda key: charge_upstream(request, user_id, [key]),
+    )
+    response.headers["X-Cache"] = cache_status
+    if shared:
+        response.headers["X-Coalesced"] = "1"
+    return {"analysis": result}
+
+
+def batch_item(index: int, file: UploadFile, started: float, **fields) -> dict:
+    return {"index": index, "filename": file.filename, **fields, "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+async def analyze_packed(files: List[UploadFile], uploads: List[bytes], mimes: List[str], keys: List[str], current_conditions: str, concerned_conditions: str, user_description: Optional[str], charge: Callable[[], None]):
+    """Cache hits are answered directly; all misses go upstream together in one multi-image request, after charge()."""
+    started = time.perf_counter()
+    items: List[Optional[dict]] = [None] * len(files)
+    misses = []
+    for i, key in enumerate(keys):
+        cached, tier = await run_in_threadpool(analysis_cache.get, key)
+        if cached is None:
+            misses.append(i)
+        else:
+            items[i] = batch_item(i, files[i], started, status="ok", analysis=cached, cache=f"HIT-{tier.upper()}")
+    if misses:
+        charge()
+    summary_text = None
+
+    async def prepare(i: int) -> Optional[PreparedImage]:
+        try:
+            return await preprocess_upload(uploads[i], mimes[i], {})
+        except HTTPException as e:
+            items[i] = batch_item(i, files[i], started, status="error", status_code=e.status_code, detail=e.detail)
+            return None
+
+    # Images that fail to decode get their own error item and are left out of the packed request
+    images = await asyncio.gather(*[prepare(i) for i in misses])
+    misses, images = [i for i, image in zip(misses, images) if image is not None], [image for image in images if image is not None]
+    if misses:
+        # A single remaining image (the rest cached or unreadable) is sent as a plain single-image request
+        packed = len(misses) > 1
+        prompt = analysis_prompt(current_conditions, concerned_conditions, user_description)
+        await acquire_upstream_slot()
+        try:
+            if packed:
+                text = await vision_complete(packed_prompt(len(misses), prompt), images, 1500 * len(misses) + 300)
+            else:
+                text = await vision_complete(prompt, images, 1500)
+        finally:
+            upstream_admission.release()
+        parts, summary_text = split_packed(text, len(misses)) if packed else ([text or None], None)
+        for i, part in zip(misses, parts):
+            if part is None:
+                items[i] = batch_item(i, files[i], started, status="error", status_code=502, detail="No analysis returned for this image.")
+                continue
+            await run_in_threadpool(analysis_cache.put, keys[i], part)
+            items[i] = batch_item(i, files[i], started, status="ok", analysis=part, cache="MISS")
+    return items, summary_text
+
+
+def batch_max_files(signed_in: bool, packed: bool) -> int:
+    """Images per batch: BATCH_MAX_FILES, and no more than the caller's burst unless the batch is packed.
+
+    An unpacked batch costs a token per image that misses the cache, all taken at once, so more images
+    than the bucket holds could never be admitted; a packed batch costs one token.
+    """
+    if packed:
+        return BATCH_MAX_FILES
+    return max(1, min(BATCH_MAX_FILES, ANALYZE_BURST if signed_in else ANALYZE_ANON_BURST))
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    current_conditions: str = Form("No current medical conditions"),
+    concerned_conditions: str = Form("None specified"),
+    user_description: Optional[str] = Form(""),
+    user_id: Optional[str] = Depends(get_current_user_id),
+):
+    """Analyze several photos of one meal against one medical profile.
+
+    Images are analyzed concurrently (at most BATCH_CONCURRENCY at a time), or in a single vision
+    request when BATCH_PACK_IMAGES is set. Returns per-image results with latency plus a meal
+    summary; a failed image does not fail the batch unless every image failed. See batch_max_files
+    for how many images a caller may send.
+    """
+    require_vision_backend()
+    packed = BATCH_PACK_IMAGES and vision_backend.packs_images and len(files) > 1
+    max_files = batch_max_files(bool(user_id), packed)
+    if len(files) > max_files:
+        signed_in = batch_max_files(True, packed)
+        hint = f" ({signed_in} when signed in)" if not user_id and signed_in > max_files else ""
+        raise HTTPException(status_code=400, detail=f"Too many images. Maximum is {max_files} per batch{hint}.")
+    mimes = [validate_image_type(f) for f in files]
+
+    started = time.perf_counter()
+    uploads = [await read_upload_limited(f, int(MAX_UPLOAD_MB * 1024 * 1024)) for f in files]
+    keys = [await analysis_cache_key(c, current_conditions, concerned_conditions, user_description) for c in uploads]
+    summary_text = None
+    if packed:
+        # One upstream request however many images miss the cache
+        items, summary_text = await analyze_packed(
+            files, uploads, mimes, keys, current_conditions, concerned_conditions, user_description,
+            charge=lambda: check_analyze_rate(request, user_id),
+        )
+    else:
+        # The whole batch is charged up front for its misses, so it is refused as a unit rather than image by image
+        hits = [(await run_in_threadpool(analysis_cache.get, key))[0] is not None for key in keys]
+        charge_upstream(request, user_id, [key for key, hit in zip(keys, hits) if not hit])
+        limit = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+
+        async def one(i: int) -> dict:
+            async with limit:
+                item_started = time.perf_counter()
+                try:
+                    result, cache_status, shared = await analyze_upload(
+                        uploads[i], mimes[i], current_conditions, concerned_conditions, user_description, {}, cache_key=keys[i],
+                    )
+                except HTTPException as e:
+                    retry = {"retry_after": e.headers["Retry-After"]} if e.headers and "Retry-After" in e.headers else {}
+                    return batch_item(i, files[i], item_started, status="error", status_code=e.status_code, detail=e.detail, **retry)
+                return batch_item(i, files[i], item_started, status="ok", analysis=result, cache=cache_status, coalesced=shared)
+
+        items = await asyncio.gather(*[one(i) for i in range(len(files))])
+
+    ok = [item["analysis"] for item in items if item["status"] == "ok"]
+    if not ok:
+        first = items[0]
+        headers = {"Retry-After": first["retry_after"]} if "retry_after" in first else None
+        raise HTTPException(status_code=first["status_code"], detail=first["detail"], headers=headers)
+    summary = meal_summary(ok)
+    if summary_text:
+        summary["text"] = summary_text
+    return {
+        "mode": "packed" if packed else "concurrent",
+        "items": items,
+        "summary": summary,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@app.post("/analyze/stream")
+async def analyze_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    current_conditions: str = Form("No current medical conditions"),
+    concerned_conditions: str = Form("None specified"),
+    user_description: Optional[str] = Form(""),
+    user_id: Optional[str] = Depends(get_current_user_id),
+):
+    """Server-Sent Events variant of /analyze.
+
+    Events: "token" {"text"} for each delta, "section" {"section", "title", "content"} as each
+    build_prompt section completes, then "done" {"analysis"} or "error" {"detail"}.
+    A client disconnect cancels the upstream completion.
+    """
+    require_vision_backend()
+    mime = validate_image_type(file)
+
+    contents = await read_upload_limited(file, int(MAX_UPLOAD_MB * 1024 * 1024))
+    cache_key = await analysis_cache_key(contents, current_conditions, concerned_conditions, user_description)
+    cached, tier = await run_in_threadpool(analysis_cache.get, cache_key)
+    if cached is not None:
+        async def replay():
+            for section in split_sections(cached):
+                yield sse_event("section", section)
+            yield sse_event("done", {"analysis": cached})
+
+        return StreamingResponse(replay(), media_type="text/event-stream", headers={**SSE_HEADERS, "X-Cache": f"HIT-{tier.upper()}"})
+
+    check_analyze_rate(request, user_id)  # only requests that reach the model cost a token
+    headers = {**SSE_HEADERS, "X-Cache": "MISS"}
+    image = await preprocess_upload(contents, mime, headers)
+    del contents
+    prompt = analysis_prompt(current_conditions, concerned_conditions, user_description)
+
+    # The admission slot is held until the stream finishes, not just until the first byte
+    await acquire_upstream_slot()
+    try:
+        stream = await vision_stream(prompt, [image], 1500)
+    except BaseException:
+        upstream_admission.release()
+        raise
+
+    async def events():
+        parser = SectionStreamParser()
+        try:
+            async for delta in stream:
+                yield sse_event("token", {"text": delta})
+                for section in parser.feed(delta):
+                    yield sse_event("section", section)
+            for section in parser.close():
+                yield sse_event("section", section)
+            result = parser.text
+            if result:
+                await run_in_threadpool(analysis_cache.put, cache_key, result)
+            yield sse_event("done", {"analysis": result})
+        except Exception as e:
+            logger.warning("Streaming analysis failed: %s", e)
+            yield sse_event("error", {"detail": vision_http_error(e).detail})
+        finally:
+            # Runs on client disconnect too (Starlette cancels this generator); closing the
+            # upstream response stops the model generating tokens nobody will read
+            with anyio.CancelScope(shield=True):
+                await stream.close()
+            upstream_admission.release()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
 
 
 if __name__ == "__main__":
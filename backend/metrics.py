@@ -0,0 +1,170 @@
+"""
+NutriMedAI in-process metrics.
+Minimal thread-safe counters, gauges and latency histograms (Prometheus-style cumulative buckets, optional
+labels), rendered in the Prometheus text exposition format for /metrics.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+# Seconds; covers sub-ms dictionary lookups up to multi-second upstream calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: LabelKey, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {",".join(f"{k}={v}" for k, v in key) or "total": value for key, value in self._values.items()}
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{_format_labels(key)} {_number(value)}" for key, value in items]
+        return lines
+
+
+class Gauge(Counter):
+    """Current value per label set: in-flight requests, queue depths, pool usage."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts..., +Inf count], sum, count
+        self._series: Dict[LabelKey, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Cumulative bucket counts per label set, plus sum/count and an estimated p50/p95."""
+        out = {}
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        for key, counts, total, count in items:
+            cumulative, running = {}, 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                running += c
+                cumulative["+Inf" if bound == float("inf") else f"{bound:g}"] = running
+            out[",".join(f"{k}={v}" for k, v in key) or "total"] = {
+                "count": count,
+                "sum": round(total, 6),
+                "p50": self._quantile(counts, count, 0.5),
+                "p95": self._quantile(counts, count, 0.95),
+                "buckets": cumulative,
+            }
+        return out
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, counts, total, count in items:
+            running = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                running += c
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {running}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_number(round(total, 6))}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def _quantile(self, counts, count: int, q: float):
+        # Upper bound of the bucket holding the q-th observation
+        if not count:
+            return None
+        target, running = q * count, 0
+        for bound, c in zip(self.buckets, counts):
+            running += c
+            if running >= target:
+                return bound
+        return "+Inf"
+
+
+def render_prometheus(metrics: Iterable) -> str:
+    """Text exposition format 0.0.4 for Counter/Gauge/Histogram objects; series of same-named metrics are merged."""
+    families: Dict[str, List[str]] = {}
+    for metric in metrics:
+        lines = metric.expose()
+        if metric.name in families:
+            families[metric.name].extend(lines[2:])
+        else:
+            families[metric.name] = lines
+    return "\n".join(line for lines in families.values() for line in lines) + "\n"
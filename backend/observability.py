@@ -0,0 +1,226 @@
+"""
+NutriMedAI request observability.
+Logging goes through a bounded queue to a background listener thread, so the event loop never blocks on
+stdout; records are JSON lines (or plain text) tagged with the current request id. RequestObserver is a
+pure ASGI middleware that assigns request ids, times every request by route template and logs one line
+per request.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import secrets
+import sys
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+try:
+    from .metrics import Counter, Gauge, Histogram
+except ImportError:  # started as `uvicorn main:app` from inside backend/
+    from metrics import Counter, Gauge, Histogram
+
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+# The ASGI scope of the current request; routing fills in scope["route"] before the endpoint runs
+_request_scope: ContextVar[Optional[dict]] = ContextVar("request_scope", default=None)
+
+# Client-supplied X-Request-ID is echoed only if it is short and log-safe
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+# Attributes every LogRecord has; anything else was passed via extra= and goes into the JSON line
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id", "color_message"}
+
+LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access", "nutrimedai.access")
+_plain = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:  # written directly, not via QueueLogHandler
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """Stamps the request id in the calling context, then enqueues without blocking (drops beyond max_queue)."""
+
+    def __init__(self, log_queue: queue.SimpleQueue, max_queue: int):
+        super().__init__(log_queue)
+        self.max_queue = max_queue
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve the message and traceback here, where args may still be mutable objects; the
+        # listener thread only formats strings. No copy: this handler is the only one on the root logger
+        record.request_id = request_id.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _plain.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # SimpleQueue (C, lock-free put) has no maxsize; the size check is approximate under threads, which is fine
+        if self.queue.qsize() >= self.max_queue:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+class _BatchFlushStreamHandler(logging.StreamHandler):
+    """Flushes only once the queue is drained, so a burst of records costs one write syscall, not one each."""
+
+    def __init__(self, stream, log_queue: queue.SimpleQueue):
+        super().__init__(stream)
+        self.log_queue = log_queue
+
+    def flush(self) -> None:
+        if self.log_queue.empty():
+            super().flush()
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        record.request_id = getattr(record, "request_id", "-")
+        return super().format(record)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[QueueLogHandler] = None
+_stream: Optional[logging.Handler] = None
+
+
+def setup_logging(fmt: str = "json", level: str = "INFO", max_queue: int = 10000) -> QueueLogHandler:
+    """Route the root and uvicorn loggers through one queue; a listener thread writes them to stdout."""
+    global _listener, _handler, _stream
+    if _handler is not None:
+        return _handler
+    # Skip per-record work nothing here prints (see "Optimization" in the logging HOWTO); findCaller's
+    # stack walk alone is a large share of a logging call
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    log_queue = queue.SimpleQueue()
+    stream = _BatchFlushStreamHandler(sys.stdout, log_queue)
+    if fmt == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(_TextFormatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    _handler = QueueLogHandler(log_queue, max_queue)
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(level.upper())
+    for name in LOGGERS:
+        # uvicorn installs its own (synchronous) handlers before importing the app; send everything via the root
+        logger = logging.getLogger(name)
+        logger.handlers = []
+        logger.propagate = True
+    # RequestObserver writes the access line (with route, latency and request id) instead
+    logging.getLogger("uvicorn.access").disabled = True
+    _stream = stream
+    _listener = logging.handlers.QueueListener(_handler.queue, stream, respect_handler_level=False)
+    _listener.start()
+    return _handler
+
+
+def stop_logging() -> None:
+    """Flush queued records; call at shutdown. Later records (server shutdown lines) are written directly."""
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        logging.getLogger().handlers = [_stream]
+        _handler = None
+
+
+def logging_stats() -> dict:
+    if _handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped}
+
+
+def _route_template(scope: dict) -> str:
+    # Route template ("/analyses/{analysis_id}"), never the raw path, to keep label cardinality bounded
+    return getattr(scope.get("route"), "path", None) or "unmatched"
+
+
+def request_route() -> str:
+    """Route template of the request being handled, for labelling metrics recorded deeper in the stack."""
+    scope = _request_scope.get()
+    return _route_template(scope) if scope is not None else "-"
+
+
+# ----- Per-request metrics and access log -----
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Request latency until the response body is sent, by method, route and status")
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled")
+ERRORS = Counter("errors_total", "Errors by source and exception class")
+access_logger = logging.getLogger("nutrimedai.access")
+
+
+class RequestObserver:
+    """ASGI middleware: X-Request-ID in and out, latency histogram by route template, one access log line.
+
+    Streaming responses are timed until their last body chunk, not just the headers.
+    """
+
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+        rid = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                value = value.decode("latin-1")
+                rid = value if _REQUEST_ID_RE.match(value) else None
+                break
+        rid = rid or secrets.token_hex(8)
+        token = request_id.set(rid)
+        scope_token = _request_scope.set(scope)
+        start = time.perf_counter()
+        status = 500
+        header = (b"x-request-id", rid.encode())
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [header]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            ERRORS.inc(source="request", type=type(e).__name__)
+            access_logger.exception("Unhandled request error")
+            raise
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            elapsed = time.perf_counter() - start
+            path = _route_template(scope)
+            HTTP_LATENCY.observe(elapsed, method=scope["method"], route=path, status=status)
+            access_logger.info(
+                "%s %s -> %s", scope["method"], scope["path"], status,
+                extra={"method": scope["method"], "route": path, "status": status, "duration_ms": round(elapsed * 1000, 2)},
+            )
+            _request_scope.reset(scope_token)
+            request_id.reset(token)
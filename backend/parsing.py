@@ -0,0 +1,164 @@
+"""
+NutriMedAI analysis text parsing.
+Splits model output into the sections mandated by build_prompt, incrementally while tokens stream in,
+and pulls typed facts (dish, key metrics, nutrition score) out of a finished analysis.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Section headers in the order build_prompt asks for them
+SECTION_HEADERS = [
+    "DISH",
+    "FOOD SUMMARY",
+    "KEY METRICS",
+    "CURRENT CONDITION SUMMARY",
+    "CONCERNED CONDITION SUMMARY",
+    "ALTERNATIVES",
+    "NUTRITION SCORE",
+]
+
+_HEADER_RE = re.compile(r"^\s*(" + "|".join(re.escape(h) for h in SECTION_HEADERS) + r")\s*:\s*(.*)$", re.IGNORECASE)
+_SEPARATOR_RE = re.compile(r"^\s*-{3,}\s*$")
+_SCORE_RE = re.compile(r"\b(\d{1,3})\s*/\s*100\b")
+
+
+def section_key(header: str) -> str:
+    return header.lower().replace(" ", "_")
+
+
+class SectionStreamParser:
+    """Feed text deltas; get back each section as soon as it is complete.
+
+    A section completes when the next header or a "---" separator arrives. NUTRITION SCORE
+    completes as soon as its "X/100" line is seen, so clients don't wait for end of stream.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._parts: List[str] = []
+        self._current = None
+        self._lines: List[str] = []
+        self._emitted = set()
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def _finish(self) -> List[Dict[str, str]]:
+        if self._current is None or self._current in self._emitted:
+            self._current, self._lines = None, []
+            return []
+        header = self._current
+        content = "\n".join(self._lines).strip()
+        self._emitted.add(header)
+        self._current, self._lines = None, []
+        return [{"section": section_key(header), "title": header, "content": content}]
+
+    def _line(self, line: str) -> List[Dict[str, str]]:
+        events: List[Dict[str, str]] = []
+        m = _HEADER_RE.match(line)
+        if m:
+            events += self._finish()
+            self._current = m.group(1).upper()
+            if m.group(2).strip():
+                self._lines.append(m.group(2).strip())
+        elif _SEPARATOR_RE.match(line):
+            events += self._finish()
+        elif self._current is not None:
+            self._lines.append(line)
+        if self._current == "NUTRITION SCORE" and any(_SCORE_RE.search(l) for l in self._lines):
+            events += self._finish()
+        return events
+
+    def feed(self, delta: str) -> List[Dict[str, str]]:
+        self._parts.append(delta)
+        self._buffer += delta
+        events: List[Dict[str, str]] = []
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            events += self._line(line)
+        return events
+
+    def close(self) -> List[Dict[str, str]]:
+        events: List[Dict[str, str]] = []
+        if self._buffer:
+            events += self._line(self._buffer)
+            self._buffer = ""
+        return events + self._finish()
+
+
+def split_sections(text: str) -> List[Dict[str, str]]:
+    """Parse a complete analysis into its sections."""
+    parser = SectionStreamParser()
+    return parser.feed(text) + parser.close()
+
+
+# KEY METRICS line: "Calories: 350-420 kcal | Protein: 32g | ... | Sodium: 640mg"
+_METRIC_RE = re.compile(r"([A-Za-z]+)\s*:\s*~?\s*(\d+(?:\.\d+)?)(?:\s*[-\u2013]\s*(\d+(?:\.\d+)?))?\s*(kcal|mg|g)?", re.IGNORECASE)
+METRIC_FIELDS = ("protein_g", "carbs_g", "fat_g", "fiber_g", "sugar_g", "sodium_mg")
+FACT_FIELDS = ("dish_name", "calories_min", "calories_max") + METRIC_FIELDS + ("nutrition_score",)
+
+
+def parse_key_metrics(line: str) -> Dict[str, Optional[float]]:
+    """Typed values from a KEY METRICS line; ranges give calories min/max and the midpoint elsewhere."""
+    out: Dict[str, Optional[float]] = {k: None for k in ("calories_min", "calories_max") + METRIC_FIELDS}
+    for name, low, high, unit in _METRIC_RE.findall(line or ""):
+        name, unit = name.lower(), unit.lower()
+        low_v = float(low)
+        high_v = float(high) if high else low_v
+        if name == "calories":
+            out["calories_min"], out["calories_max"] = low_v, high_v
+            continue
+        value = (low_v + high_v) / 2
+        if name == "sodium":
+            out["sodium_mg"] = value * 1000 if unit == "g" else value
+        elif f"{name}_g" in out:
+            out[f"{name}_g"] = value / 1000 if unit == "mg" else value
+    return out
+
+
+def extract_facts(text: str) -> Dict[str, Optional[float]]:
+    """dish_name, calorie range, macros (g), sodium (mg) and nutrition_score from a complete analysis; missing parts are None."""
+    sections = {s["section"]: s["content"] for s in split_sections(text or "")}
+    dish = (sections.get("dish") or "").split("\n", 1)[0].strip().strip('"').rstrip(".") or None
+    facts: Dict[str, Optional[float]] = {"dish_name": dish}
+    facts.update(parse_key_metrics(sections.get("key_metrics", "")))
+    score = _SCORE_RE.search(sections.get("nutrition_score", ""))
+    facts["nutrition_score"] = min(100, int(score.group(1))) if score else None
+    return facts
+
+
+def meal_summary(analyses: List[str]) -> dict:
+    """Combined view of several dishes from one meal: summed metrics and the mean nutrition score."""
+    facts = [extract_facts(a) for a in analyses]
+    totals = {}
+    for key in ("calories_min", "calories_max") + METRIC_FIELDS:
+        values = [f[key] for f in facts if f[key] is not None]
+        totals[key] = round(sum(values), 1) if values else None
+    scores = [f["nutrition_score"] for f in facts if f["nutrition_score"] is not None]
+    return {
+        "dishes": [f["dish_name"] for f in facts],
+        "totals": totals,
+        "nutrition_score": round(sum(scores) / len(scores)) if scores else None,
+    }
+
+
+# Packed batch responses: one "=== IMAGE k ===" block per image, then "=== MEAL SUMMARY ==="
+_PACKED_RE = re.compile(r"^\s*=+\s*(IMAGE\s+(\d+)|MEAL SUMMARY)\s*=+\s*$", re.IGNORECASE | re.MULTILINE)
+
+
+def split_packed(text: str, count: int) -> Tuple[List[Optional[str]], Optional[str]]:
+    """Split a multi-image response into per-image analyses (None where missing) and the meal summary text."""
+    items: List[Optional[str]] = [None] * count
+    summary = None
+    marks = list(_PACKED_RE.finditer(text or ""))
+    for m, nxt in zip(marks, marks[1:] + [None]):
+        body = text[m.end():nxt.start() if nxt else len(text)].strip()
+        if m.group(2) is None:
+            summary = body or None
+            continue
+        index = int(m.group(2)) - 1
+        if 0 <= index < count and body:
+            items[index] = body
+    return items, summary
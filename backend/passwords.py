@@ -0,0 +1,144 @@
+"""
+NutriMedAI password hashing.
+bcrypt runs in a bounded process pool (escaping the GIL and Starlette's shared threadpool) behind an
+admission limit, so a login burst queues here instead of starving every other endpoint.
+"""
+
+import asyncio
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+logger = logging.getLogger("uvicorn.error")
+
+_contexts: Dict[int, "CryptContext"] = {}
+
+
+def _context(rounds: int) -> "CryptContext":
+    ctx = _contexts.get(rounds)
+    if ctx is None:
+        # passlib is imported on first hash, in whichever process does the hashing, not at app import
+        from passlib.context import CryptContext
+
+        # Hashes with a different cost than `rounds` report needs_update, which drives rehash-on-login
+        ctx = _contexts[rounds] = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+    return ctx
+
+
+def hash_password_sync(password: str, rounds: int) -> str:
+    return _context(rounds).hash(password)
+
+
+def _load_context(rounds: int) -> None:
+    _context(rounds)
+
+
+def verify_password_sync(password: str, password_hash: str, rounds: int) -> Tuple[bool, Optional[str]]:
+    """Return (matches, new_hash); new_hash is set when the stored hash should be upgraded to `rounds`."""
+    ctx = _context(rounds)
+    if not ctx.verify(password, password_hash):
+        return False, None
+    return True, ctx.hash(password) if ctx.needs_update(password_hash) else None
+
+
+class HasherOverloaded(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Password hashing queue full; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """Async front end to a process pool with a cap on queued + running jobs."""
+
+    def __init__(self, rounds: int, workers: int, max_pending: int):
+        self.rounds = rounds
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+        self._completed = 0
+        self._restarts = 0
+        self._busy_seconds = 0.0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        pool = self._pool
+        if pool is None:
+            with self._lock:
+                if self._pool is None:
+                    # spawn: forking a process that already runs event-loop and threadpool threads is unsafe
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+                pool = self._pool
+        return pool
+
+    def _discard(self, pool: ProcessPoolExecutor) -> None:
+        """Drop a pool whose worker died (it never recovers by itself) so the next job spawns a new one."""
+        with self._lock:
+            if self._pool is not pool:
+                return  # another job already replaced it
+            self._pool = None
+            self._restarts += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _retry_after(self) -> int:
+        avg = self._busy_seconds / self._completed if self._completed else 0.25
+        return max(1, math.ceil(self._pending / self.workers * avg))
+
+    async def _submit(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise HasherOverloaded(self._retry_after())
+            self._pending += 1
+        start = time.perf_counter()
+        try:
+            pool = self._executor()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+            except BrokenProcessPool:
+                # A worker was killed (OOM, crash); the job itself is safe to repeat, so retry once on a fresh pool
+                logger.warning("Password hashing pool broke; restarting it and retrying the job")
+                self._discard(pool)
+                return await asyncio.get_running_loop().run_in_executor(self._executor(), fn, *args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._completed += 1
+                self._busy_seconds += time.perf_counter() - start
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(hash_password_sync, password, self.rounds)
+
+    async def verify(self, password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+        return await self._submit(verify_password_sync, password, password_hash, self.rounds)
+
+    def warm_up(self) -> None:
+        """Spawn a worker and load passlib in it, so the first login does not pay for either (blocking)."""
+        self._executor().submit(_load_context, self.rounds).result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "restarts": self._restarts,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
@@ -0,0 +1,72 @@
+"""
+NutriMedAI in-flight request coalescing.
+Concurrent callers with the same key share one execution of the underlying coroutine. Each caller
+waits through asyncio.shield, so one waiter being cancelled (client disconnect) never cancels the
+shared call for the others; the call is cancelled only once every waiter has gone.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Event-loop-local; call from coroutines on a single loop."""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._executed = 0
+        self._coalesced = 0
+        self._abandoned = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run fn() once per key across concurrent callers. Returns (result, shared)."""
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            self._executed += 1
+            call.task.add_done_callback(lambda _t, c=call: self._forget(key, c))
+        else:
+            self._coalesced += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Everyone who wanted this result has gone; stop paying for it. Forget the key first: the task
+                # may take a while to finish cancelling (work in a thread can't be interrupted), and a caller
+                # arriving meanwhile must start a fresh call rather than join one that ends in CancelledError
+                self._abandoned += 1
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+
+    def in_flight(self, key: str) -> bool:
+        """Whether a do(key, ...) started now would join an existing call instead of running fn."""
+        return key in self._calls
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Retrieve the outcome so abandoned calls don't log "exception was never retrieved"
+        if not call.task.cancelled():
+            call.task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "executed": self._executed,
+            "coalesced": self._coalesced,  # upstream calls saved
+            "abandoned": self._abandoned,
+            "waiters": {key[:16]: call.waiters for key, call in list(self._calls.items())[:20]},
+        }
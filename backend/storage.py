@@ -0,0 +1,353 @@
+"""
+NutriMedAI storage layer.
+Bounded SQLite connection pool (WAL mode, tuned pragmas) plus versioned schema migrations
+that run once per process instead of on every connection.
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+try:
+    from .blobs import parse_data_url
+    from .metrics import Histogram
+    from .parsing import FACT_FIELDS, extract_facts
+except ImportError:  # started as `uvicorn main:app` from inside backend/
+    from blobs import parse_data_url
+    from metrics import Histogram
+    from parsing import FACT_FIELDS, extract_facts
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the acquire timeout."""
+
+
+# ----- Migrations -----
+# Each migration is (version, description, fn(conn, context)). Append new ones; never edit or reorder applied ones.
+# context carries services a data migration needs (e.g. preview_store), passed through migrate(conn, **context).
+Migration = Tuple[int, str, Callable[[sqlite3.Connection, Dict[str, Any]], None]]
+
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> set:
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _m001_base_schema(conn: sqlite3.Connection, context: Dict[str, Any]) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS analyses (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            dish_name TEXT NOT NULL,
+            analysis_text TEXT NOT NULL,
+            preview TEXT,
+            created_at TEXT NOT NULL,
+            current_conditions TEXT DEFAULT '',
+            concerned_conditions TEXT DEFAULT '',
+            user_description TEXT DEFAULT '',
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+
+
+def _m002_profile_columns(conn: sqlite3.Connection, context: Dict[str, Any]) -> None:
+    # DBs created before profile columns existed (pre-migration get_db() used to patch these in on every call)
+    existing = _table_columns(conn, "analyses")
+    for col in ("current_conditions", "concerned_conditions", "user_description"):
+        if col not in existing:
+            conn.execute(f"ALTER TABLE analyses ADD COLUMN {col} TEXT DEFAULT ''")
+
+
+def _m003_preview_blobs(conn: sqlite3.Connection, context: Dict[str, Any]) -> None:
+    # Previews used to be stored inline as base64 data URLs; move them to the content-addressed blob store
+    conn.execute("ALTER TABLE analyses ADD COLUMN preview_hash TEXT")
+    conn.execute("ALTER TABLE analyses ADD COLUMN preview_mime TEXT")
+    store = context["preview_store"]
+    ids = [r[0] for r in conn.execute("SELECT id FROM analyses WHERE preview LIKE 'data:%'").fetchall()]
+    moved = 0
+    for i in range(0, len(ids), 200):
+        batch = ids[i:i + 200]
+        placeholders = ",".join("?" * len(batch))
+        for analysis_id, preview in conn.execute(f"SELECT id, preview FROM analyses WHERE id IN ({placeholders})", batch).fetchall():
+            parsed = parse_data_url(preview)
+            if parsed is None:
+                continue
+            mime, data = parsed
+            conn.execute(
+                "UPDATE analyses SET preview = NULL, preview_hash = ?, preview_mime = ? WHERE id = ?",
+                (store.put(data, mime), mime, analysis_id),
+            )
+            moved += 1
+    logger.info("Moved %s inline previews to the blob store", moved)
+
+
+def _m004_user_created_index(conn: sqlite3.Connection, context: Dict[str, Any]) -> None:
+    # Serves the per-user history listing (and its keyset cursor) without a scan + sort
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_analyses_user_created ON analyses(user_id, created_at DESC, id DESC)")
+
+
+def _m005_sync_versions(conn: sqlite3.Connection, context: Dict[str, Any]) -> None:
+    # Per-user change counter for ETags and `since=` delta sync; deletes leave tombstones
+    conn.execute("""
+        CREATE TABLE user_sync (
+            user_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE analysis_tombstones (
+            id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            deleted_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX idx_tombstones_user_version ON analysis_tombstones(user_id, version)")
+    conn.execute("ALTER TABLE analyses ADD COLUMN updated_version INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX idx_analyses_user_version ON analyses(user_id, updated_version)")
+    # Existing rows become version 1 so a client syncing from 0 receives them
+    conn.execute("UPDATE analyses SET updated_version = 1")
+    conn.execute("""
+        INSERT INTO user_sync (user_id, version, updated_at)
+        SELECT user_id, 1, strftime('%Y-%m-%dT%H:%M:%f', 'now') FROM analyses GROUP BY user_id
+    """)
+
+
+# Typed columns parsed from KEY METRICS / NUTRITION SCORE (dish_name already exists and stays user-editable)
+FACT_COLUMNS = tuple(f for f in FACT_FIELDS if f != "dish_name")
+
+
+def _m006_nutrition_facts(conn: sqlite3.Connection, context: Dict[str, Any]) -> None:
+    for col in FACT_COLUMNS:
+        conn.execute(f"ALTER TABLE analyses ADD COLUMN {col} {'INTEGER' if col == 'nutrition_score' else 'REAL'}")
+    assignments = ", ".join(f"{col} = ?" for col in FACT_COLUMNS)
+    last, parsed = 0, 0
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, analysis_text FROM analyses WHERE rowid > ? ORDER BY rowid LIMIT 500", (last,)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for rowid, text in rows:
+            facts = extract_facts(text)
+            updates.append([facts[col] for col in FACT_COLUMNS] + [rowid])
+        conn.executemany(f"UPDATE analyses SET {assignments} WHERE rowid = ?", updates)
+        parsed += len(rows)
+        last = rows[-1][0]
+    logger.info("Parsed nutrition facts for %s existing analyses", parsed)
+
+
+def _m007_search_index(conn: sqlite3.Connection, context: Dict[str, Any]) -> None:
+    # External-content FTS5 index over analyses, keyed by the table's implicit rowid and kept in sync by triggers.
+    # user_id is indexed too so searches can be scoped with a phrase match instead of filtering every user's hits.
+    # analyses has no INTEGER PRIMARY KEY, so a VACUUM may renumber rowids: follow one with
+    # INSERT INTO analyses_fts(analyses_fts) VALUES ('rebuild').
+    conn.execute("""
+        CREATE VIRTUAL TABLE analyses_fts USING fts5(
+            user_id, dish_name, analysis_text, user_description,
+            content='analyses', content_rowid='rowid', tokenize='porter unicode61 remove_diacritics 2'
+        )
+    """)
+    columns = "user_id, dish_name, analysis_text, user_description"
+    new_values = "new.user_id, new.dish_name, new.analysis_text, new.user_description"
+    old_values = "old.user_id, old.dish_name, old.analysis_text, old.user_description"
+    conn.execute(f"""
+        CREATE TRIGGER analyses_fts_insert AFTER INSERT ON analyses BEGIN
+            INSERT INTO analyses_fts (rowid, {columns}) VALUES (new.rowid, {new_values});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER analyses_fts_delete AFTER DELETE ON analyses BEGIN
+            INSERT INTO analyses_fts (analyses_fts, rowid, {columns}) VALUES ('delete', old.rowid, {old_values});
+        END
+    """)
+    # Covers the PATCH rename path; updates that only touch other columns (sync versions, facts) skip the index
+    conn.execute(f"""
+        CREATE TRIGGER analyses_fts_update AFTER UPDATE OF {columns} ON analyses BEGIN
+            INSERT INTO analyses_fts (analyses_fts, rowid, {columns}) VALUES ('delete', old.rowid, {old_values});
+            INSERT INTO analyses_fts (rowid, {columns}) VALUES (new.rowid, {new_values});
+        END
+    """)
+    # Default rank = bm25 with column weights user_id 0 (scope only), dish name 10, analysis text 1, description 3.
+    # ORDER BY rank lets FTS5 sort internally, so highlight()/snippet() only run for the rows returned.
+    conn.execute("INSERT INTO analyses_fts (analyses_fts, rank) VALUES ('rank', 'bm25(0.0, 10.0, 1.0, 3.0)')")
+    conn.execute("INSERT INTO analyses_fts (analyses_fts) VALUES ('rebuild')")
+
+
+def _m008_tombstone_retention(conn: sqlite3.Connection, context: Dict[str, Any]) -> None:
+    # Tombstones older than the retention horizon are pruned; pruned_version is the newest version pruned per
+    # user, so a `since=` below it is known to be missing deletes and gets a full-resync answer instead
+    conn.execute("ALTER TABLE user_sync ADD COLUMN pruned_version INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX idx_tombstones_user_deleted ON analysis_tombstones(user_id, deleted_at)")
+
+
+MIGRATIONS: List[Migration] = [
+    (1, "base users/analyses schema", _m001_base_schema),
+    (2, "analyses profile columns for legacy DBs", _m002_profile_columns),
+    (3, "move inline data-URL previews to the blob store", _m003_preview_blobs),
+    (4, "index analyses by (user_id, created_at)", _m004_user_created_index),
+    (5, "per-user sync versions and delete tombstones", _m005_sync_versions),
+    (6, "typed nutrition fact columns parsed from analysis_text", _m006_nutrition_facts),
+    (7, "FTS5 search index over dish name, analysis text and description", _m007_search_index),
+    (8, "tombstone retention: per-user pruned version and (user_id, deleted_at) index", _m008_tombstone_retention),
+]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn: sqlite3.Connection, **context: Any) -> int:
+    """Apply pending migrations, each in its own transaction. Returns the resulting schema version."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    for version, description, fn in MIGRATIONS:
+        # BEGIN IMMEDIATE takes the write lock up front so concurrent workers don't race the same migration
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            fn(conn, context)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, datetime('now'))",
+                (version, description),
+            )
+            conn.commit()
+            logger.info("DB migration %s applied: %s", version, description)
+        except Exception:
+            conn.rollback()
+            logger.exception("DB migration %s failed: %s", version, description)
+            raise
+    return schema_version(conn)
+
+
+# ----- Connection pool -----
+class ConnectionPool:
+    """Bounded, thread-safe pool of SQLite connections shared across FastAPI's threadpool workers."""
+
+    def __init__(self, path: Path, max_size: int = 8, timeout: float = 10.0, cache_size_kib: int = 4096):
+        self.path = Path(path)
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.cache_size_kib = cache_size_kib
+        # LIFO keeps the most recently used (warm page cache) connections in rotation
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._created = 0
+        self._in_use = 0
+        self._acquired = 0
+        self._waited = 0
+        self._timeouts = 0
+        self._wait_seconds = 0.0
+        self.hold_seconds = Histogram("db_connection_hold_seconds", "Time a connection was checked out (queries + commit), by route")
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=self.timeout)
+        conn.row_factory = sqlite3.Row
+        mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if str(mode).lower() != "wal":
+            logger.warning("SQLite WAL mode unavailable at %s (journal_mode=%s)", self.path, mode)
+        # NORMAL is durable across app crashes in WAL mode; only an OS crash can lose the last commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        with self._lock:
+            self._created += 1
+        return conn
+
+    @contextmanager
+    def connection(self, route: str = "-"):
+        """Check out a connection; route labels the hold-time histogram."""
+        if self._closed:
+            raise PoolTimeout("Connection pool is closed")
+        start = time.perf_counter()
+        waited = not self._slots.acquire(blocking=False)
+        if waited and not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No DB connection available within {self.timeout}s")
+        conn = None
+        held = time.perf_counter()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            with self._lock:
+                self._in_use += 1
+                self._acquired += 1
+                if waited:
+                    self._waited += 1
+                    self._wait_seconds += time.perf_counter() - start
+            held = time.perf_counter()
+            yield conn
+        finally:
+            if conn is not None:
+                self.hold_seconds.observe(time.perf_counter() - held, route=route)
+                self._release(conn)
+            self._slots.release()
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Connection is unusable; drop it and let the next acquire open a fresh one
+            logger.exception("Discarding broken DB connection")
+            conn.close()
+            return
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "open": self._idle.qsize() + self._in_use,
+                "idle": self._idle.qsize(),
+                "in_use": self._in_use,
+                "created": self._created,
+                "acquired": self._acquired,
+                "waited": self._waited,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(self._wait_seconds / self._waited * 1000, 3) if self._waited else 0.0,
+            }
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
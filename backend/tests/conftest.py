@@ -0,0 +1,109 @@
+import asyncio
+import io
+import os
+import tempfile
+import uuid
+
+import pytest
+
+# main reads its paths at import time; point every store at a throwaway directory before any test imports it
+_data_dir = tempfile.mkdtemp(prefix="nutrimedai-tests-")
+os.environ.setdefault("DB_PATH", os.path.join(_data_dir, "nutrimedai.db"))
+os.environ.setdefault("ANALYSIS_CACHE_PATH", os.path.join(_data_dir, "analysis_cache.db"))
+os.environ.setdefault("PREVIEW_STORE_PATH", os.path.join(_data_dir, "previews"))
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from .samples import ANALYSIS  # noqa: E402
+
+
+def photo(seed: int = 0, size=(64, 48), fmt: str = "JPEG") -> bytes:
+    """A small solid-colour image; different seeds give different bytes (and cache keys)."""
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new("RGB", size, ((seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256)).save(out, fmt)
+    return out.getvalue()
+
+
+class FakeVision:
+    """Vision backend answering every image with the sample analysis (packed format for several images)."""
+
+    name = "fake"
+    model_id = "fake-model"
+    packs_images = True
+
+    def __init__(self):
+        self.calls = []  # images per upstream call
+        self.delay = 0.0
+
+    def configuration_error(self):
+        return None
+
+    def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def complete(self, prompt, images, max_tokens) -> str:
+        self.calls.append(len(images))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if len(images) == 1:
+            return ANALYSIS
+        blocks = [f"=== IMAGE {k} ===\n{ANALYSIS}" for k in range(1, len(images) + 1)]
+        return "\n\n".join(blocks + ["=== MEAL SUMMARY ===\nA light meal."])
+
+    async def open_stream(self, prompt, images, max_tokens):
+        from backend.vision import TextStream
+
+        self.calls.append(len(images))
+
+        async def deltas():
+            for i in range(0, len(ANALYSIS), 40):
+                yield ANALYSIS[i:i + 40]
+
+        return TextStream(deltas())
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "calls": len(self.calls)}
+
+    def metrics(self) -> list:
+        return []
+
+
+@pytest.fixture
+def vision(monkeypatch, tmp_path):
+    """Swap in FakeVision with an empty result cache, fresh coalescing and full rate-limit buckets."""
+    from backend import main
+    from backend.cache import AnalysisCache
+    from backend.singleflight import SingleFlight
+    from backend.upstream import RateLimiter
+
+    fake = FakeVision()
+    monkeypatch.setattr(main, "vision_backend", fake)
+    monkeypatch.setattr(main, "analysis_cache", AnalysisCache(tmp_path / "analysis_cache.db"))
+    monkeypatch.setattr(main, "analyze_inflight", SingleFlight())
+    monkeypatch.setattr(main, "user_rate_limiter", RateLimiter(main.ANALYZE_RATE_PER_MINUTE, main.ANALYZE_BURST))
+    monkeypatch.setattr(main, "ip_rate_limiter", RateLimiter(main.ANALYZE_ANON_RATE_PER_MINUTE, main.ANALYZE_ANON_BURST))
+    yield fake
+    main.analysis_cache.close()
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+
+    from backend import main
+
+    # No `with`: the lifespan warm-up is skipped and the DB is opened (and migrated) on first use
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def auth():
+    """Bearer header for a fresh user id (tokens are not checked against the users table)."""
+    from backend import main
+
+    return {"Authorization": f"Bearer {main.create_access_token({'sub': str(uuid.uuid4())})}"}
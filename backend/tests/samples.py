@@ -0,0 +1,32 @@
+# A well-formed analysis in the format build_prompt asks for (same as bench/fake_openai.py's canned reply)
+ANALYSIS = """---
+DISH:
+Grilled chicken salad
+
+---
+FOOD SUMMARY:
+Grilled chicken over mixed greens with a light vinaigrette. A balanced, lean meal.
+
+---
+KEY METRICS:
+Calories: 350-420 kcal | Protein: 32g | Carbs: 14g | Fat: 18g | Fiber: 5g | Sugar: 6g | Sodium: 640mg
+
+---
+CURRENT CONDITION SUMMARY:
+Chicken: good protein.
+Dressing: moderate sodium - use less.
+[Reasoning] Lean protein and fibre help steady blood sugar.
+[Action] Use less dressing.
+
+---
+CONCERNED CONDITION SUMMARY:
+Greens: beneficial.
+[Benefit] High fibre supports heart health.
+
+---
+ALTERNATIVES:
+Request dressing on the side.
+
+---
+NUTRITION SCORE:
+78/100"""
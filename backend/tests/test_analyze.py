@@ -0,0 +1,91 @@
+import json
+
+from backend import main
+from backend.parsing import split_sections
+
+from .conftest import photo
+from .samples import ANALYSIS
+
+PROFILE = {"current_conditions": "Diabetes", "concerned_conditions": "Heart disease"}
+
+
+def analyze(client, image: bytes, headers=None, **form):
+    return client.post("/analyze", files={"file": ("meal.jpg", image, "image/jpeg")}, data={**PROFILE, **form}, headers=headers or {})
+
+
+def test_repeat_upload_is_answered_from_the_cache(client, vision):
+    image = photo(1)
+    first = analyze(client, image)
+    assert first.status_code == 200 and first.json() == {"analysis": ANALYSIS}
+    assert first.headers["x-cache"] == "MISS"
+    second = analyze(client, image)
+    assert second.status_code == 200 and second.json() == {"analysis": ANALYSIS}
+    assert second.headers["x-cache"] == "HIT-MEMORY"
+    assert vision.calls == [1]
+
+
+def test_cache_key_covers_the_profile_and_the_image(client, vision):
+    image = photo(2)
+    assert analyze(client, image).headers["x-cache"] == "MISS"
+    assert analyze(client, image, user_description="Is this OK for dinner?").headers["x-cache"] == "MISS"
+    assert analyze(client, photo(3)).headers["x-cache"] == "MISS"
+    assert len(vision.calls) == 3
+
+
+def sse_events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_sends_tokens_then_sections_then_done(client, vision):
+    r = client.post("/analyze/stream", files={"file": ("meal.jpg", photo(4), "image/jpeg")}, data=PROFILE)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/event-stream")
+    assert r.headers["x-cache"] == "MISS"
+    events = sse_events(r.text)
+    assert "".join(data["text"] for name, data in events if name == "token") == ANALYSIS
+    assert [data["section"] for name, data in events if name == "section"] == [s["section"] for s in split_sections(ANALYSIS)]
+    assert events[-1] == ("done", {"analysis": ANALYSIS})
+    # Each section is sent as soon as it completes, i.e. before the tokens that follow it
+    names = [name for name, _ in events]
+    assert names.index("section") < len(names) - 1 - names[::-1].index("token")
+
+
+def test_stream_cache_hit_replays_sections_without_tokens(client, vision):
+    image = photo(5)
+    client.post("/analyze/stream", files={"file": ("meal.jpg", image, "image/jpeg")}, data=PROFILE)
+    r = client.post("/analyze/stream", files={"file": ("meal.jpg", image, "image/jpeg")}, data=PROFILE)
+    assert r.headers["x-cache"] == "HIT-MEMORY"
+    events = sse_events(r.text)
+    assert [name for name, _ in events] == ["section"] * 7 + ["done"]
+    assert events[-1][1] == {"analysis": ANALYSIS}
+    assert vision.calls == [1]
+
+
+def test_cache_hits_are_not_rate_limited(client, vision):
+    image = photo(6)
+    statuses = [analyze(client, image).status_code for _ in range(main.ANALYZE_ANON_BURST + 3)]
+    assert statuses == [200] * (main.ANALYZE_ANON_BURST + 3)
+    assert vision.calls == [1]
+
+
+def test_upstream_calls_are_rate_limited_per_client(client, vision):
+    for seed in range(main.ANALYZE_ANON_BURST):
+        assert analyze(client, photo(10 + seed)).status_code == 200
+    refused = analyze(client, photo(20))
+    assert refused.status_code == 429 and int(refused.headers["retry-after"]) >= 1
+    assert analyze(client, photo(10)).status_code == 200  # still served from the cache
+    stream = client.post("/analyze/stream", files={"file": ("meal.jpg", photo(21), "image/jpeg")}, data=PROFILE)
+    assert stream.status_code == 429
+
+
+def test_forwarded_for_is_only_trusted_for_the_configured_hops(client, vision, monkeypatch):
+    monkeypatch.setattr(main, "TRUSTED_PROXY_HOPS", 1)
+    for seed in range(main.ANALYZE_ANON_BURST):
+        # A client prepending its own entries still lands in the bucket of the address the proxy appended
+        headers = {"X-Forwarded-For": f"10.0.0.{seed}, 203.0.113.7"}
+        assert analyze(client, photo(30 + seed), headers=headers).status_code == 200
+    assert analyze(client, photo(40), headers={"X-Forwarded-For": "10.9.9.9, 203.0.113.7"}).status_code == 429
+    assert analyze(client, photo(41), headers={"X-Forwarded-For": "198.51.100.1"}).status_code == 200
@@ -0,0 +1,58 @@
+from backend import main
+
+from .conftest import photo
+from .samples import ANALYSIS
+
+PROFILE = {"current_conditions": "Diabetes", "concerned_conditions": "None specified"}
+
+
+def batch(client, images, headers=None):
+    files = [("files", (f"dish{i}.jpg", image, "image/jpeg")) for i, image in enumerate(images)]
+    return client.post("/analyze/batch", files=files, data=PROFILE, headers=headers or {})
+
+
+def test_default_limits_admit_every_batch_size_they_advertise(client, vision, auth):
+    # Unpacked batches take a token per image, so the cap follows the caller's burst (3 anonymous, 5 signed in)
+    anonymous = batch(client, [photo(i) for i in range(main.ANALYZE_ANON_BURST)])
+    assert anonymous.status_code == 200 and anonymous.json()["mode"] == "concurrent"
+    assert [item["status"] for item in anonymous.json()["items"]] == ["ok"] * main.ANALYZE_ANON_BURST
+    signed_in = batch(client, [photo(10 + i) for i in range(main.ANALYZE_BURST)], headers=auth)
+    assert signed_in.status_code == 200 and len(signed_in.json()["items"]) == main.ANALYZE_BURST
+
+
+def test_too_many_images_reports_the_callers_cap(client, vision, auth):
+    r = batch(client, [photo(i) for i in range(main.ANALYZE_ANON_BURST + 1)])
+    assert r.status_code == 400
+    assert r.json()["detail"] == f"Too many images. Maximum is {main.ANALYZE_ANON_BURST} per batch ({main.ANALYZE_BURST} when signed in)."
+    r = batch(client, [photo(i) for i in range(main.ANALYZE_BURST + 1)], headers=auth)
+    assert r.status_code == 400 and r.json()["detail"] == f"Too many images. Maximum is {main.ANALYZE_BURST} per batch."
+    assert vision.calls == []
+
+
+def test_packed_batch_takes_the_full_batch_size_in_one_call(client, vision, monkeypatch):
+    monkeypatch.setattr(main, "BATCH_PACK_IMAGES", True)
+    r = batch(client, [photo(i) for i in range(main.BATCH_MAX_FILES)])
+    assert r.status_code == 200 and r.json()["mode"] == "packed"
+    assert [item["analysis"] for item in r.json()["items"]] == [ANALYSIS] * main.BATCH_MAX_FILES
+    assert r.json()["summary"]["text"] == "A light meal."
+    assert vision.calls == [main.BATCH_MAX_FILES]
+    assert batch(client, [photo(i) for i in range(main.BATCH_MAX_FILES + 1)]).status_code == 400
+
+
+def test_unreadable_image_fails_alone_in_a_packed_batch(client, vision, monkeypatch):
+    monkeypatch.setattr(main, "BATCH_PACK_IMAGES", True)
+    r = batch(client, [photo(1), b"\xff\xd8\xff not a jpeg", photo(2)])
+    assert r.status_code == 200
+    assert [item["status"] for item in r.json()["items"]] == ["ok", "error", "ok"]
+    assert r.json()["items"][1]["status_code"] == 400
+    assert vision.calls == [2]
+
+
+def test_repeat_batch_is_answered_from_the_cache(client, vision):
+    images = [photo(i) for i in range(main.ANALYZE_ANON_BURST)]
+    for _ in range(3):  # would exceed the anonymous bucket if hits were charged
+        r = batch(client, images)
+        assert r.status_code == 200
+    assert [item["cache"] for item in r.json()["items"]] == ["HIT-MEMORY"] * len(images)
+    assert len(vision.calls) == len(images)
+    assert r.json()["summary"]["nutrition_score"] == 78
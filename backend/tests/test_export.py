@@ -0,0 +1,74 @@
+import base64
+import json
+import uuid
+
+from backend import main
+
+from .conftest import photo
+from .samples import ANALYSIS
+
+NDJSON = {"Content-Type": "application/x-ndjson"}
+
+
+def other_user():
+    return {"Authorization": f"Bearer {main.create_access_token({'sub': str(uuid.uuid4())})}"}
+
+
+def export(client, auth, previews="none"):
+    r = client.get(f"/analyses/export?previews={previews}", headers=auth)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in r.text.splitlines()]
+
+
+def test_export_imports_into_another_account_unchanged(client, auth, monkeypatch):
+    monkeypatch.setattr(main, "EXPORT_INLINE_PAGE_ROWS", 2)  # several pages
+    preview = "data:image/jpeg;base64," + base64.b64encode(photo(7)).decode()
+    for i in range(5):
+        body = {"dish_name": f"Meal {i}", "analysis": ANALYSIS, "user_description": f"note {i}", "preview": preview if i == 1 else None}
+        client.post("/analyses", json=body, headers=auth)
+    exported = export(client, auth, "inline")
+    assert [row["dishName"] for row in exported] == [f"Meal {i}" for i in range(5)]
+    assert exported[1]["preview"] == preview and exported[0]["preview"] is None
+
+    target = other_user()
+    body = "".join(json.dumps(row) + "\n" for row in exported)
+    assert client.post("/analyses/import", content=body, headers={**target, **NDJSON}).json() == {"imported": 5, "skipped": 0, "errors": []}
+    imported = export(client, target, "inline")
+
+    def comparable(row):
+        return {k: v for k, v in row.items() if k != "id"}
+
+    assert [comparable(r) for r in imported] == [comparable(r) for r in exported]
+    assert {r["id"] for r in imported}.isdisjoint(r["id"] for r in exported)
+
+
+def test_import_reads_lines_split_across_chunks_and_reports_bad_ones(client, auth):
+    lines = [
+        json.dumps({"dishName": "Soup", "analysis": ANALYSIS, "date": "2024-05-01T12:00:00+02:00"}),
+        "not json",
+        json.dumps({"dishName": "Toast"}),
+        json.dumps({"analysis": ANALYSIS}),
+    ]
+    body = ("\n".join(lines) + "\n").encode()
+
+    def chunks():
+        for i in range(0, len(body), 7):
+            yield body[i:i + 7]
+
+    r = client.post("/analyses/import", content=chunks(), headers={**auth, **NDJSON})
+    assert r.json()["imported"] == 2 and r.json()["skipped"] == 2
+    assert r.json()["errors"] == [{"line": 2, "error": "invalid JSON"}, {"line": 3, "error": "analysis is required"}]
+    rows = export(client, auth)
+    assert [(row["dishName"], row["date"]) for row in rows][0] == ("Soup", "2024-05-01T10:00:00")
+    assert rows[1]["dishName"] == "Grilled chicken salad"  # taken from the analysis text
+    assert rows[0]["nutritionScore"] == 78
+
+
+def test_bulk_delete_reports_ids_it_could_not_delete(client, auth):
+    mine = [client.post("/analyses", json={"dish_name": "Salad", "analysis": ANALYSIS}, headers=auth).json()["id"] for _ in range(2)]
+    theirs = client.post("/analyses", json={"dish_name": "Salad", "analysis": ANALYSIS}, headers=other_user()).json()["id"]
+    r = client.post("/analyses/delete", json={"ids": [*mine, theirs, mine[0]]}, headers=auth)
+    assert r.json() == {"deleted": 2, "notFound": [theirs]}
+    assert export(client, auth) == []
+    too_many = [str(i) for i in range(main.BULK_DELETE_MAX_IDS + 1)]
+    assert client.post("/analyses/delete", json={"ids": too_many}, headers=auth).status_code == 400
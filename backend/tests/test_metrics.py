@@ -0,0 +1,34 @@
+import re
+
+from backend import main
+
+ROUTE = 'method="GET",route="/analyses/{analysis_id}/preview",status="404"'
+
+
+def scraped_count(client, headers=None) -> int:
+    r = client.get("/metrics", headers=headers or {})
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    found = re.search(r"^http_request_duration_seconds_count\{" + re.escape(ROUTE) + r"\} (\d+)$", r.text, re.M)
+    return int(found.group(1)) if found else 0
+
+
+def test_requests_are_counted_by_route_template_and_echo_a_request_id(client, vision):
+    before = scraped_count(client)
+    r = client.get("/analyses/not-a-real-id/preview", headers={"X-Request-ID": "trace-123"})
+    assert r.status_code == 404 and r.headers["x-request-id"] == "trace-123"
+    assert client.get("/analyses/other/preview", headers={"X-Request-ID": "bad id!"}).headers["x-request-id"] != "bad id!"
+    assert scraped_count(client) == before + 2  # scrapes themselves are not observed
+
+
+def test_scrape_exposes_every_family_once(client, vision):
+    text = client.get("/metrics").text
+    families = re.findall(r"^# TYPE (\S+) (\S+)$", text, re.M)
+    assert len(families) == len({name for name, _ in families})
+    assert {"http_requests_in_flight", "upstream_circuit_open", "log_queue_records"} <= {name for name, _ in families}
+
+
+def test_metrics_token_is_required_when_configured(client, vision, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "s3cret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert scraped_count(client, {"Authorization": "Bearer s3cret"}) >= 0
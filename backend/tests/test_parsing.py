@@ -0,0 +1,62 @@
+from backend.parsing import SectionStreamParser, extract_facts, split_packed, split_sections
+
+from .samples import ANALYSIS
+
+
+def test_split_sections_finds_every_section_in_order():
+    sections = split_sections(ANALYSIS)
+    assert [s["section"] for s in sections] == [
+        "dish", "food_summary", "key_metrics", "current_condition_summary",
+        "concerned_condition_summary", "alternatives", "nutrition_score",
+    ]
+    assert sections[0]["content"] == "Grilled chicken salad"
+    assert sections[-1]["content"] == "78/100"
+
+
+def test_streaming_one_character_at_a_time_matches_the_whole_text():
+    parser = SectionStreamParser()
+    events = []
+    for ch in ANALYSIS:
+        events += parser.feed(ch)
+    events += parser.close()
+    assert events == split_sections(ANALYSIS)
+    assert parser.text == ANALYSIS
+
+
+def test_section_is_emitted_when_the_next_one_starts():
+    parser = SectionStreamParser()
+    assert parser.feed("DISH: Omelette\nFOOD SUMMARY:\nEggs") == [{"section": "dish", "title": "DISH", "content": "Omelette"}]
+    assert parser.close() == [{"section": "food_summary", "title": "FOOD SUMMARY", "content": "Eggs"}]
+
+
+def test_nutrition_score_is_emitted_without_waiting_for_end_of_stream():
+    parser = SectionStreamParser()
+    parser.feed("NUTRITION SCORE:\n")
+    assert parser.feed("64/100\n") == [{"section": "nutrition_score", "title": "NUTRITION SCORE", "content": "64/100"}]
+    assert parser.feed("Trailing commentary\n") == []
+    assert parser.close() == []
+
+
+def test_extract_facts_from_a_complete_analysis():
+    facts = extract_facts(ANALYSIS)
+    assert facts["dish_name"] == "Grilled chicken salad"
+    assert (facts["calories_min"], facts["calories_max"]) == (350, 420)
+    assert facts["protein_g"] == 32 and facts["fiber_g"] == 5
+    assert facts["sodium_mg"] == 640
+    assert facts["nutrition_score"] == 78
+
+
+def test_extract_facts_converts_units_and_tolerates_missing_parts():
+    facts = extract_facts("KEY METRICS:\nCalories: ~500 kcal | Sodium: 1.2g | Sugar: 300mg\n")
+    assert (facts["calories_min"], facts["calories_max"]) == (500, 500)
+    assert facts["sodium_mg"] == 1200 and facts["sugar_g"] == 0.3
+    assert facts["dish_name"] is None and facts["protein_g"] is None and facts["nutrition_score"] is None
+    assert extract_facts("")["calories_min"] is None
+
+
+def test_split_packed_maps_blocks_to_images():
+    text = f"=== IMAGE 2 ===\n{ANALYSIS}\n\n=== IMAGE 1 ===\nfirst\n\n=== IMAGE 9 ===\nstray\n=== MEAL SUMMARY ===\nLight meal."
+    items, summary = split_packed(text, 3)
+    assert items == ["first", ANALYSIS, None]
+    assert summary == "Light meal."
+    assert split_packed("no markers at all", 2) == ([None, None], None)
@@ -0,0 +1,88 @@
+import base64
+import json
+
+import pytest
+
+from backend.blobs import parse_data_url
+
+from .conftest import photo
+from .samples import ANALYSIS
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(localStorage.token)</script></svg>'
+
+
+def data_url(data: bytes, mime: str) -> str:
+    return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+
+
+def create(client, auth, preview):
+    return client.post("/analyses", json={"dish_name": "Salad", "analysis": ANALYSIS, "preview": preview}, headers=auth)
+
+
+@pytest.mark.parametrize("value", [
+    data_url(SVG, "image/svg+xml"),
+    data_url(SVG, "image/png"),  # declared type doesn't match the bytes
+    data_url(photo(1, fmt="PNG"), "image/jpeg"),
+    data_url(b"<html><script></script></html>", "text/html"),
+    "https://example.com/meal.jpg",
+])
+def test_only_raster_data_urls_are_accepted(value):
+    assert parse_data_url(value) is None
+
+
+def test_parse_data_url_accepts_the_served_formats():
+    for fmt, mime in (("JPEG", "image/jpeg"), ("PNG", "image/png"), ("WEBP", "image/webp"), ("GIF", "image/gif")):
+        image = photo(2, fmt=fmt)
+        assert parse_data_url(data_url(image, mime)) == (mime, image)
+    assert parse_data_url(data_url(photo(2), "image/jpg"))[0] == "image/jpeg"
+
+
+def test_svg_preview_is_rejected(client, auth):
+    r = create(client, auth, data_url(SVG, "image/svg+xml"))
+    assert r.status_code == 400
+    assert client.get("/analyses", headers=auth).json() == []
+
+
+def test_preview_and_thumbnail_are_served_inert_with_304_revalidation(client, auth):
+    created = create(client, auth, data_url(photo(3), "image/jpeg")).json()
+    for url in (created["preview"], created["thumbnail"]):
+        r = client.get(url)
+        assert r.status_code == 200 and r.headers["content-type"] == "image/jpeg"
+        assert r.headers["x-content-type-options"] == "nosniff"
+        assert "sandbox" in r.headers["content-security-policy"]
+        assert r.content.startswith(b"\xff\xd8\xff")
+        again = client.get(url, headers={"If-None-Match": r.headers["etag"]})
+        assert again.status_code == 304 and again.content == b""
+    assert client.get(created["preview"] + "&size=300").status_code == 400
+
+
+def test_preview_needs_the_signature_or_the_owner(client, auth):
+    created = create(client, auth, data_url(photo(4), "image/jpeg")).json()
+    unsigned = f"/analyses/{created['id']}/preview"
+    assert client.get(unsigned).status_code == 404
+    assert client.get(unsigned, headers=auth).status_code == 200
+
+
+def test_import_skips_lines_with_an_unsafe_preview(client, auth):
+    lines = [
+        {"dishName": "Safe", "analysis": ANALYSIS, "preview": data_url(photo(5), "image/jpeg")},
+        {"dishName": "Unsafe", "analysis": ANALYSIS, "preview": data_url(SVG, "image/svg+xml")},
+        {"dishName": "Linked", "analysis": ANALYSIS, "preview": "/analyses/x/preview?sig=y"},  # dropped, not an error
+    ]
+    body = "".join(json.dumps(line) + "\n" for line in lines)
+    r = client.post("/analyses/import", content=body, headers={**auth, "Content-Type": "application/x-ndjson"})
+    assert r.json()["imported"] == 2
+    assert [e["line"] for e in r.json()["errors"]] == [2]
+    rows = {row["dishName"]: row for row in client.get("/analyses", headers=auth).json()}
+    assert set(rows) == {"Safe", "Linked"}
+    assert rows["Safe"]["preview"].startswith(f"/analyses/{rows['Safe']['id']}/preview") and rows["Linked"]["preview"] is None
+
+
+def test_blobs_of_other_types_stored_earlier_are_not_served(client, auth):
+    from backend import main
+
+    created = create(client, auth, data_url(photo(6), "image/jpeg")).json()
+    with main.get_db() as conn:
+        conn.execute("UPDATE analyses SET preview_mime = 'image/svg+xml' WHERE id = ?", (created["id"],))
+        conn.commit()
+    assert client.get(created["preview"]).status_code == 404
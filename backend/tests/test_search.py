@@ -0,0 +1,40 @@
+from .samples import ANALYSIS
+
+
+def create(client, auth, dish_name, analysis=ANALYSIS, description=""):
+    body = {"dish_name": dish_name, "analysis": analysis, "user_description": description}
+    return client.post("/analyses", json=body, headers=auth).json()["id"]
+
+
+def test_search_matches_stems_and_prefixes_and_highlights_escaped_text(client, auth):
+    create(client, auth, "Chicken <b>salad</b>", description="grilled at home")
+    create(client, auth, "Lentil soup", analysis="FOOD SUMMARY:\nA warming bowl of lentils.")
+    hits = client.get("/analyses/search?q=lentil", headers=auth).json()
+    assert [h["dishName"] for h in hits] == ["Lentil soup"]
+    assert "<mark>lentils</mark>" in hits[0]["snippet"]
+    [hit] = client.get("/analyses/search?q=chick", headers=auth).json()
+    assert hit["highlights"]["dishName"] == "<mark>Chicken</mark> &lt;b&gt;salad&lt;/b&gt;"
+    assert client.get("/analyses/search?q=chicken grilled", headers=auth).json()[0]["id"] == hit["id"]
+    assert client.get("/analyses/search?q=chicken soup", headers=auth).json() == []
+    assert client.get("/analyses/search?q=%22%2A", headers=auth).status_code == 400
+
+
+def test_search_pages_with_next_offset(client, auth):
+    ids = {create(client, auth, f"Salad {i}") for i in range(5)}
+    seen, offset = [], 0
+    while offset is not None:
+        r = client.get(f"/analyses/search?q=salad&limit=2&offset={offset}", headers=auth)
+        seen += [h["id"] for h in r.json()]
+        offset = r.headers.get("x-next-offset")
+    assert len(seen) == 5 and set(seen) == ids
+
+
+def test_search_only_sees_the_callers_rows(client, auth):
+    from backend import main
+
+    create(client, auth, "Mushroom risotto")
+    other = {"Authorization": f"Bearer {main.create_access_token({'sub': 'someone-else'})}"}
+    assert client.get("/analyses/search?q=risotto", headers=other).json() == []
+    r = client.get("/analyses/search?q=risotto", headers=auth)
+    assert len(r.json()) == 1
+    assert client.get("/analyses/search?q=risotto", headers={**auth, "If-None-Match": r.headers["etag"]}).status_code == 304
@@ -0,0 +1,114 @@
+import asyncio
+
+from backend.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flight, calls = SingleFlight(), []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("k", work) for _ in range(3)))
+        return calls, results, flight.stats()
+
+    calls, results, stats = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert [r for r, _ in results] == ["result"] * 3
+    assert [shared for _, shared in results] == [False, True, True]
+    assert stats["in_flight"] == 0 and stats["coalesced"] == 2
+
+
+def test_cancelled_waiter_does_not_cancel_the_others():
+    async def scenario():
+        flight, release = SingleFlight(), asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "result"
+
+        leaving = asyncio.ensure_future(flight.do("k", work))
+        staying = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return leaving, await staying, flight.stats()
+
+    leaving, (result, shared), stats = asyncio.run(scenario())
+    assert leaving.cancelled()
+    assert (result, shared) == ("result", True)
+    assert stats["abandoned"] == 0
+
+
+def test_call_is_cancelled_once_every_waiter_has_gone():
+    async def scenario():
+        flight, started, finished = SingleFlight(), asyncio.Event(), []
+
+        async def work():
+            started.set()
+            await asyncio.sleep(10)
+            finished.append(1)
+
+        waiters = [asyncio.ensure_future(flight.do("k", work)) for _ in range(2)]
+        await started.wait()
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        return finished, flight.stats()
+
+    finished, stats = asyncio.run(scenario())
+    assert finished == []
+    assert stats["abandoned"] == 1 and stats["in_flight"] == 0
+
+
+def test_errors_reach_every_waiter_and_the_key_is_freed():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream")
+
+        outcomes = await asyncio.gather(flight.do("k", fail), flight.do("k", fail), return_exceptions=True)
+
+        async def ok():
+            return "fresh"
+
+        return outcomes, await flight.do("k", ok)
+
+    outcomes, retry = asyncio.run(scenario())
+    assert all(isinstance(o, ValueError) for o in outcomes)
+    assert retry == ("fresh", False)
+
+
+def test_caller_arriving_while_an_abandoned_call_winds_down_gets_a_fresh_call():
+    async def scenario():
+        flight, started = SingleFlight(), asyncio.Event()
+
+        async def slow_to_cancel():
+            # Like work in run_in_threadpool: cancellation only lands once the current step finishes
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                await asyncio.sleep(0.05)
+                raise
+            return "stale"
+
+        async def fresh():
+            return "fresh"
+
+        leaving = asyncio.ensure_future(flight.do("k", slow_to_cancel))
+        await started.wait()
+        leaving.cancel()
+        await asyncio.gather(leaving, return_exceptions=True)
+        return await flight.do("k", fresh), flight.stats()
+
+    result, stats = asyncio.run(scenario())
+    assert result == ("fresh", False)
+    assert stats["abandoned"] == 1 and stats["executed"] == 2
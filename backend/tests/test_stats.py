@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+from backend import main
+
+from .samples import ANALYSIS
+
+
+def add(client, auth, created_at: str, analysis: str = ANALYSIS):
+    aid = client.post("/analyses", json={"dish_name": "", "analysis": analysis}, headers=auth).json()["id"]
+    with main.get_db() as conn:
+        conn.execute("UPDATE analyses SET created_at = ? WHERE id = ?", (created_at, aid))
+        conn.commit()
+
+
+def test_buckets_follow_local_days_and_weeks(client, auth):
+    add(client, auth, "2024-03-04T12:00:00")
+    add(client, auth, "2024-03-04T23:30:00")  # 2024-03-05 at UTC+2
+    add(client, auth, "2024-03-06T08:00:00", "KEY METRICS:\nCalories: 500 kcal | Sodium: 1g\n")
+    day = client.get("/analyses/stats?start=2024-03-01&end=2024-03-10&tz_offset=120", headers=auth).json()
+    assert [(b["start"], b["count"]) for b in day["buckets"]] == [("2024-03-04", 1), ("2024-03-05", 1), ("2024-03-06", 1)]
+    assert day["total"]["count"] == 3 and day["total"]["scored"] == 2
+    assert day["total"]["nutritionScore"] == {"min": 78, "avg": 78.0, "max": 78}
+    assert day["total"]["sodiumMg"] == 640 * 2 + 1000
+    week = client.get("/analyses/stats?period=week&start=2024-03-01&end=2024-03-10", headers=auth).json()
+    assert [(b["start"], b["count"]) for b in week["buckets"]] == [("2024-03-04", 3)]
+
+
+def test_invalid_ranges_are_rejected(client, auth):
+    assert client.get("/analyses/stats?period=month", headers=auth).status_code == 400
+    assert client.get("/analyses/stats?start=2024-03-10&end=2024-03-01", headers=auth).status_code == 400
+    assert client.get("/analyses/stats?start=2023-01-01&end=2024-03-01", headers=auth).status_code == 400
+
+
+def test_default_range_is_not_revalidated_once_the_day_changes(client, auth, monkeypatch):
+    add(client, auth, datetime.utcnow().isoformat())
+    first = client.get("/analyses/stats", headers=auth)
+    assert client.get("/analyses/stats", headers={**auth, "If-None-Match": first.headers["etag"]}).status_code == 304
+
+    class Tomorrow(datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime.utcnow() + timedelta(days=1)
+
+    monkeypatch.setattr(main, "datetime", Tomorrow)
+    later = client.get("/analyses/stats", headers={**auth, "If-None-Match": first.headers["etag"]})
+    assert later.status_code == 200 and later.headers["etag"] != first.headers["etag"]
+    assert later.json()["end"] != first.json()["end"]
+    # No Last-Modified for a defaulted range: the data didn't change, the window did
+    assert "last-modified" not in later.headers
+    assert "last-modified" in client.get("/analyses/stats?end=2024-03-10", headers=auth).headers
@@ -0,0 +1,124 @@
+import base64
+import sqlite3
+import threading
+
+import pytest
+
+from backend.blobs import BlobStore
+from backend.storage import MIGRATIONS, ConnectionPool, PoolTimeout, migrate, schema_version
+
+from .samples import ANALYSIS
+
+JPEG = b"\xff\xd8\xff\xe0 not really a jpeg"
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """A DB as created before migrations existed: no profile columns, previews inline as data URLs."""
+    conn = sqlite3.connect(tmp_path / "legacy.db")
+    conn.execute("CREATE TABLE users (id TEXT PRIMARY KEY, email TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL, created_at TEXT NOT NULL)")
+    conn.execute("""
+        CREATE TABLE analyses (
+            id TEXT PRIMARY KEY, user_id TEXT NOT NULL, dish_name TEXT NOT NULL,
+            analysis_text TEXT NOT NULL, preview TEXT, created_at TEXT NOT NULL
+        )
+    """)
+    for uid in ("u1", "u2"):
+        conn.execute("INSERT INTO users VALUES (?, ?, 'x', '2024-01-01')", (uid, f"{uid}@example.com"))
+    preview = "data:image/jpeg;base64," + base64.b64encode(JPEG).decode()
+    rows = [
+        ("a1", "u1", "Salad", ANALYSIS, preview, "2024-01-01T10:00:00"),
+        ("a2", "u1", "Soup", "no structured sections here", None, "2024-01-02T10:00:00"),
+        ("a3", "u2", "Salad", ANALYSIS, preview, "2024-01-03T10:00:00"),
+    ]
+    conn.executemany("INSERT INTO analyses VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_legacy_db_migrates_to_the_latest_version(legacy_db, tmp_path):
+    assert migrate(legacy_db, preview_store=BlobStore(tmp_path / "previews")) == MIGRATIONS[-1][0]
+    assert {"current_conditions", "concerned_conditions", "user_description"} <= {
+        r[1] for r in legacy_db.execute("PRAGMA table_info(analyses)")
+    }
+    # Running again is a no-op
+    assert migrate(legacy_db, preview_store=BlobStore(tmp_path / "previews")) == schema_version(legacy_db)
+    assert legacy_db.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == len(MIGRATIONS)
+
+
+def test_inline_previews_move_to_the_blob_store(legacy_db, tmp_path):
+    store = BlobStore(tmp_path / "previews")
+    migrate(legacy_db, preview_store=store)
+    rows = legacy_db.execute("SELECT id, preview, preview_hash, preview_mime FROM analyses ORDER BY id").fetchall()
+    assert [r[1] for r in rows] == [None, None, None]
+    assert rows[0][2] == rows[2][2] == BlobStore.digest(JPEG)  # identical images share one blob
+    assert rows[1][2] is None
+    assert store.path(rows[0][2], "image/jpeg").read_bytes() == JPEG
+
+
+def test_existing_rows_become_sync_version_1(legacy_db, tmp_path):
+    migrate(legacy_db, preview_store=BlobStore(tmp_path / "previews"))
+    assert {r[0] for r in legacy_db.execute("SELECT updated_version FROM analyses")} == {1}
+    assert legacy_db.execute("SELECT user_id, version FROM user_sync ORDER BY user_id").fetchall() == [("u1", 1), ("u2", 1)]
+    assert legacy_db.execute("SELECT COUNT(*) FROM analysis_tombstones").fetchone()[0] == 0
+
+
+def test_nutrition_facts_are_backfilled_from_analysis_text(legacy_db, tmp_path):
+    migrate(legacy_db, preview_store=BlobStore(tmp_path / "previews"))
+    facts = {
+        r[0]: r[1:]
+        for r in legacy_db.execute("SELECT id, calories_min, calories_max, protein_g, sodium_mg, nutrition_score FROM analyses")
+    }
+    assert facts["a1"] == facts["a3"] == (350, 420, 32, 640, 78)
+    assert facts["a2"] == (None, None, None, None, None)
+
+
+def test_search_index_covers_migrated_rows(legacy_db, tmp_path):
+    migrate(legacy_db, preview_store=BlobStore(tmp_path / "previews"))
+    hits = legacy_db.execute(
+        "SELECT a.id FROM analyses_fts JOIN analyses a ON a.rowid = analyses_fts.rowid WHERE analyses_fts MATCH 'chicken' ORDER BY a.id"
+    ).fetchall()
+    assert [h[0] for h in hits] == ["a1", "a3"]
+
+
+def test_pool_reuses_connections(tmp_path):
+    pool = ConnectionPool(tmp_path / "pool.db", max_size=2)
+    for _ in range(5):
+        with pool.connection() as conn:
+            conn.execute("SELECT 1")
+    stats = pool.stats()
+    assert stats["created"] == 1 and stats["acquired"] == 5 and stats["idle"] == 1
+    pool.close()
+
+
+def test_pool_times_out_when_every_connection_is_checked_out(tmp_path):
+    pool = ConnectionPool(tmp_path / "pool.db", max_size=1, timeout=0.05)
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with pool.connection():
+            held.set()
+            release.wait(5)
+
+    worker = threading.Thread(target=hold)
+    worker.start()
+    held.wait(5)
+    with pytest.raises(PoolTimeout):
+        with pool.connection():
+            pass
+    release.set()
+    worker.join()
+    assert pool.stats()["timeouts"] == 1
+    pool.close()
+
+
+def test_open_transaction_is_rolled_back_on_release(tmp_path):
+    pool = ConnectionPool(tmp_path / "pool.db", max_size=1)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.commit()
+        conn.execute("INSERT INTO t VALUES (1)")  # never committed
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    pool.close()
@@ -0,0 +1,100 @@
+import json
+
+from .samples import ANALYSIS
+
+
+def import_rows(client, auth, count: int) -> None:
+    body = "".join(json.dumps({"dishName": f"Meal {i}", "analysis": ANALYSIS}) + "\n" for i in range(count))
+    r = client.post("/analyses/import", content=body, headers={**auth, "Content-Type": "application/x-ndjson"})
+    assert r.status_code == 200 and r.json()["imported"] == count
+
+
+def sync_all(client, auth, since: int, limit: int):
+    """Follow hasMore/cursor like a client would; returns the final version, every change and the request count."""
+    changes, cursor, requests = [], None, 0
+    while True:
+        params = {"since": since, "limit": limit, "fields": "id,dishName", **({"cursor": cursor} if cursor else {})}
+        r = client.get("/analyses", params=params, headers=auth)
+        assert r.status_code == 200
+        page = r.json()
+        changes += page["changes"]
+        requests += 1
+        since, cursor = page["version"], page.get("cursor")
+        if not page["hasMore"]:
+            return since, changes, requests
+
+
+def test_delta_sync_returns_every_row_sharing_one_version(client, auth):
+    # An import commits its rows under a handful of versions, far more rows per version than one page holds
+    import_rows(client, auth, 25)
+    version, changes, requests = sync_all(client, auth, since=0, limit=10)
+    assert sorted(c["dishName"] for c in changes) == sorted(f"Meal {i}" for i in range(25))
+    assert len({c["id"] for c in changes}) == 25
+    assert requests == 3
+
+    import_rows(client, auth, 3)
+    _, changes, _ = sync_all(client, auth, since=version, limit=10)
+    assert sorted(c["dishName"] for c in changes) == ["Meal 0", "Meal 1", "Meal 2"]
+
+
+def test_sync_cursor_is_bound_to_its_since(client, auth):
+    import_rows(client, auth, 5)
+    page = client.get("/analyses", params={"since": 0, "limit": 2}, headers=auth).json()
+    assert page["hasMore"] and page["cursor"]
+    r = client.get("/analyses", params={"since": page["version"] + 1, "limit": 2, "cursor": page["cursor"]}, headers=auth)
+    assert r.status_code == 400
+
+
+def test_history_revalidates_with_304_until_it_changes(client, auth):
+    first = client.get("/analyses", headers=auth)
+    etag = first.headers["etag"]
+    assert client.get("/analyses", headers={**auth, "If-None-Match": etag}).status_code == 304
+    import_rows(client, auth, 1)
+    changed = client.get("/analyses", headers={**auth, "If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert int(changed.headers["x-sync-version"]) > int(first.headers["x-sync-version"])
+
+
+def test_delta_reports_deletions(client, auth):
+    import_rows(client, auth, 2)
+    version, changes, _ = sync_all(client, auth, since=0, limit=10)
+    gone = changes[0]["id"]
+    assert client.delete(f"/analyses/{gone}", headers=auth).status_code == 200
+    page = client.get("/analyses", params={"since": version}, headers=auth).json()
+    assert page["changes"] == [] and page["deleted"] == [gone]
+
+
+def test_expired_tombstones_are_pruned_and_older_clients_resync(client, auth):
+    from backend import main
+
+    import_rows(client, auth, 3)
+    before_delete, changes, _ = sync_all(client, auth, since=0, limit=10)
+    first, second, third = (c["id"] for c in changes)
+    client.delete(f"/analyses/{first}", headers=auth)
+    after_first, _, _ = sync_all(client, auth, since=before_delete, limit=10)
+    with main.get_db() as conn:
+        conn.execute("UPDATE analysis_tombstones SET deleted_at = '2000-01-01T00:00:00' WHERE id = ?", (first,))
+        conn.commit()
+    client.delete(f"/analyses/{second}", headers=auth)  # prunes the user's expired tombstones
+    with main.get_db() as conn:
+        assert [r[0] for r in conn.execute("SELECT id FROM analysis_tombstones WHERE id IN (?, ?)", (first, second))] == [second]
+
+    # A client that synced before the pruned delete can't get a complete delta any more
+    assert client.get("/analyses", params={"since": before_delete}, headers=auth).status_code == 410
+    page = client.get("/analyses", params={"since": after_first}, headers=auth).json()
+    assert page["deleted"] == [second]
+    _, changes, _ = sync_all(client, auth, since=0, limit=10)
+    assert [c["id"] for c in changes] == [third]
+
+
+def test_startup_prunes_every_users_expired_tombstones(client, auth):
+    from backend import main
+
+    import_rows(client, auth, 1)
+    aid = client.get("/analyses", headers=auth).json()[0]["id"]
+    client.delete(f"/analyses/{aid}", headers=auth)
+    with main.get_db() as conn:
+        conn.execute("UPDATE analysis_tombstones SET deleted_at = '2000-01-01T00:00:00' WHERE id = ?", (aid,))
+        assert main.prune_tombstones(conn) >= 1
+        conn.commit()
+        assert conn.execute("SELECT COUNT(*) FROM analysis_tombstones WHERE deleted_at < '2001'").fetchone()[0] == 0
@@ -0,0 +1,94 @@
+import pytest
+
+from backend import upstream
+from backend.upstream import CircuitBreaker, RateLimiter, Rejected
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(upstream.time, "monotonic", fake)
+    return fake
+
+
+def open_breaker(clock) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker
+
+
+def test_open_breaker_fails_fast_until_reset_timeout(clock):
+    breaker = open_breaker(clock)
+    clock.now += 10
+    with pytest.raises(Rejected) as refused:
+        breaker.before_call()
+    assert refused.value.status_code == 503 and refused.value.retry_after == 20
+    assert breaker.short_circuited == 1
+
+
+def test_half_open_lets_exactly_one_probe_through(clock):
+    breaker = open_breaker(clock)
+    clock.now += 31
+    breaker.before_call()  # the probe
+    assert breaker.state == "half_open"
+    with pytest.raises(Rejected):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_for_a_full_timeout(clock):
+    breaker = open_breaker(clock)
+    clock.now += 31
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 29
+    with pytest.raises(Rejected):
+        breaker.before_call()
+    clock.now += 2
+    breaker.before_call()
+    assert breaker.state == "half_open"
+
+
+def test_released_probe_lets_the_next_caller_probe(clock):
+    breaker = open_breaker(clock)
+    clock.now += 31
+    breaker.before_call()
+    breaker.release_probe()  # caller cancelled before the upstream answered
+    breaker.before_call()
+    assert breaker.state == "half_open"
+
+
+def test_rate_limiter_refills_over_time(clock):
+    limiter = RateLimiter(per_minute=60, burst=2)
+    limiter.acquire("ip")
+    limiter.acquire("ip")
+    with pytest.raises(Rejected) as refused:
+        limiter.acquire("ip")
+    assert refused.value.status_code == 429 and refused.value.retry_after == 1
+    clock.now += 1
+    limiter.acquire("ip")
+    limiter.acquire("other")  # buckets are per key
+
+
+def test_rate_limiter_refuses_cost_above_burst_without_retry_after(clock):
+    limiter = RateLimiter(per_minute=60, burst=4)
+    with pytest.raises(Rejected) as refused:
+        limiter.acquire("ip", cost=5)
+    assert refused.value.status_code == 400 and refused.value.retry_after is None
+    assert limiter.rejected == 1
+    limiter.acquire("ip", cost=4)  # the refused request took no tokens
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from backend.upstream import Rejected
+from backend.vision import MicroBatcher
+
+
+def recording_runner(batches, gate=None):
+    async def run_batch(items):
+        batches.append(list(items))
+        if gate is not None:
+            await gate.wait()
+        return [f"done:{item}" for item in items]
+
+    return run_batch
+
+
+def test_concurrent_submissions_are_grouped_up_to_max_batch():
+    async def scenario():
+        batches = []
+        batcher = MicroBatcher(recording_runner(batches), max_batch=3, max_wait=0.05, concurrency=1, max_queue=16)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+        await batcher.close()
+        return batches, results
+
+    batches, results = asyncio.run(scenario())
+    assert results == [f"done:{i}" for i in range(5)]
+    assert [len(b) for b in batches] == [3, 2]
+    assert sorted(i for b in batches for i in b) == list(range(5))
+
+
+def test_requests_arriving_while_workers_are_busy_go_out_together():
+    async def scenario():
+        batches, gate = [], asyncio.Event()
+        batcher = MicroBatcher(recording_runner(batches, gate), max_batch=8, max_wait=0.0, concurrency=1, max_queue=16)
+        first = asyncio.ensure_future(batcher.submit("a"))
+        await asyncio.sleep(0.01)  # "a" is running and holds the only worker
+        rest = [asyncio.ensure_future(batcher.submit(x)) for x in "bcd"]
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.gather(first, *rest)
+        await batcher.close()
+        return batches
+
+    assert asyncio.run(scenario()) == [["a"], ["b", "c", "d"]]
+
+
+def test_disconnected_callers_are_dropped_before_dispatch():
+    async def scenario():
+        batches, gate = [], asyncio.Event()
+        batcher = MicroBatcher(recording_runner(batches, gate), max_batch=8, max_wait=0.0, concurrency=1, max_queue=16)
+        first = asyncio.ensure_future(batcher.submit("a"))
+        await asyncio.sleep(0.01)
+        gone = asyncio.ensure_future(batcher.submit("gone"))
+        kept = asyncio.ensure_future(batcher.submit("kept"))
+        await asyncio.sleep(0.01)
+        gone.cancel()  # client disconnected while queued
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(first, kept)
+        await batcher.close()
+        return batches, kept.result()
+
+    batches, kept = asyncio.run(scenario())
+    assert batches == [["a"], ["kept"]]
+    assert kept == "done:kept"
+
+
+def test_batch_failure_reaches_every_caller_in_it():
+    async def scenario():
+        async def run_batch(items):
+            raise RuntimeError("engine crashed")
+
+        batcher = MicroBatcher(run_batch, max_batch=4, max_wait=0.02, concurrency=1, max_queue=16)
+        outcomes = await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+        await batcher.close()
+        return outcomes
+
+    assert all(isinstance(o, RuntimeError) for o in asyncio.run(scenario()))
+
+
+def test_full_queue_is_refused():
+    async def scenario():
+        gate = asyncio.Event()
+        batcher = MicroBatcher(recording_runner([], gate), max_batch=1, max_wait=0.0, concurrency=1, max_queue=2)
+        running = asyncio.ensure_future(batcher.submit("running"))
+        await asyncio.sleep(0.01)
+        held = asyncio.ensure_future(batcher.submit("held"))  # taken off the queue, waiting for the worker
+        await asyncio.sleep(0.01)
+        queued = [asyncio.ensure_future(batcher.submit(i)) for i in range(2)]
+        await asyncio.sleep(0.01)
+        try:
+            with pytest.raises(Rejected) as refused:
+                await asyncio.wait_for(batcher.submit("overflow"), 1)
+        finally:
+            gate.set()
+        await asyncio.gather(running, held, *queued)
+        await batcher.close()
+        return refused.value, batcher.rejected
+
+    refused, rejected = asyncio.run(scenario())
+    assert refused.status_code == 503 and rejected == 1
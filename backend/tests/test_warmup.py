@@ -0,0 +1,57 @@
+import asyncio
+
+from backend import warmup as warmup_module
+from backend.warmup import Warmup
+
+
+def flaky(failures: int, calls: list):
+    def step():
+        calls.append(len(calls))
+        if len(calls) <= failures:
+            raise OSError("disk not mounted yet")
+
+    return step
+
+
+def test_failed_step_is_retried_until_ready(monkeypatch):
+    monkeypatch.setattr(warmup_module, "RETRY_BASE_SECONDS", 0.01)
+
+    async def scenario():
+        warmup, db_calls, admin_calls = Warmup(), [], []
+        warmup.start("db", flaky(2, db_calls))
+        warmup.start("admin", flaky(0, admin_calls), after=("db",))
+        await warmup.wait("admin")  # returns after db's first failure instead of waiting out the retries
+        early = (warmup.stats()["steps"]["db"]["state"], list(admin_calls))
+        for _ in range(200):
+            if warmup.ready:
+                break
+            await asyncio.sleep(0.01)
+        return early, warmup.stats(), db_calls, admin_calls
+
+    early, stats, db_calls, admin_calls = asyncio.run(scenario())
+    assert early == ("failed", [])
+    assert stats["ready"] and stats["ready_after_seconds"] is not None
+    assert stats["steps"]["db"]["attempts"] == 3 and "error" not in stats["steps"]["db"]
+    assert len(db_calls) == 3 and admin_calls == [0]  # admin ran once, after db succeeded
+
+
+def test_backoff_is_capped(monkeypatch):
+    monkeypatch.setattr(warmup_module, "RETRY_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(warmup_module, "RETRY_MAX_SECONDS", 0.02)
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def recording_sleep(seconds):
+        delays.append(seconds)
+        await real_sleep(0)
+
+    async def scenario():
+        warmup, calls = Warmup(), []
+        monkeypatch.setattr(warmup_module.asyncio, "sleep", recording_sleep)
+        warmup.start("db", flaky(4, calls))
+        await warmup._tasks["db"]
+        return warmup.stats()
+
+    stats = asyncio.run(scenario())
+    assert delays == [0.01, 0.02, 0.02, 0.02]
+    assert (stats["steps"]["db"]["state"], stats["steps"]["db"]["attempts"]) == ("done", 5)
@@ -0,0 +1,277 @@
+"""
+NutriMedAI upstream protection for vision calls.
+Per-caller token buckets, a bounded admission queue in front of the model API, retries with
+jittered exponential backoff that honour Retry-After, and a circuit breaker that fails fast while
+the upstream is down.
+"""
+
+import asyncio
+import math
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Optional
+
+try:
+    from .metrics import Histogram
+except ImportError:  # started as `uvicorn main:app` from inside backend/
+    from metrics import Histogram
+
+
+class Rejected(Exception):
+    """Request refused before reaching the upstream; status/retry_after map straight onto the HTTP response.
+
+    retry_after is None when waiting would not help (the request itself has to change).
+    """
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float]):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after)) if retry_after is not None else None
+
+
+# ----- Token buckets -----
+class RateLimiter:
+    """Token bucket per key (user id or client IP). Idle buckets are dropped LRU beyond max_keys."""
+
+    def __init__(self, per_minute: float, burst: int, max_keys: int = 50000):
+        self.rate = per_minute / 60.0
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def acquire(self, key: str, cost: int = 1) -> None:
+        """Take cost tokens for key or raise Rejected: 429 while the bucket refills, 400 if cost exceeds a full bucket."""
+        if cost > self.burst:
+            # Discounting it to the burst would let large batches run more analyses per minute than the rate allows
+            with self._lock:
+                self.rejected += 1
+            raise Rejected(400, f"This request needs {cost} analyses but at most {self.burst} are allowed at once. Send fewer images.", None)
+        cost = max(1, cost)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return
+            self.rejected += 1
+            wait = (cost - bucket[0]) / self.rate if self.rate else 60
+        raise Rejected(429, "Too many analyses. Please wait a moment and try again.", wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"tracked_keys": len(self._buckets), "rejected": self.rejected}
+
+
+# ----- Admission queue -----
+class AdmissionQueue:
+    """At most max_in_flight upstream calls; up to max_queue callers wait (max_wait seconds each), the rest are refused."""
+
+    def __init__(self, max_in_flight: int, max_queue: int, max_wait: float):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.wait_seconds = Histogram("analyze_queue_wait_seconds", "Time /analyze calls waited for an upstream slot")
+
+    def _sem(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the serving event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    async def acquire(self) -> None:
+        sem = self._sem()
+        if not sem.locked():
+            # Free slot: Semaphore.acquire() takes it without yielding, so the next caller sees it taken
+            await sem.acquire()
+            self.wait_seconds.observe(0.0)
+            self.in_flight += 1
+            return
+        if self.queued >= self.max_queue:
+            self.rejected_full += 1
+            raise Rejected(503, "Analysis service is busy. Please try again shortly.", self.max_wait / 2 or 1)
+        self.queued += 1
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(sem.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            raise Rejected(503, "Analysis service is busy. Please try again shortly.", self.max_wait / 2 or 1)
+        finally:
+            self.queued -= 1
+            self.wait_seconds.observe(time.perf_counter() - start)
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._sem().release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_full,
+            "rejected_wait_timeout": self.rejected_timeout,
+            "wait_seconds": self.wait_seconds.snapshot(),
+        }
+
+
+# ----- Circuit breaker -----
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive upstream failures; after reset_timeout one probe call is let through."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.short_circuited = 0
+
+    def before_call(self) -> None:
+        if self.state == "open":
+            remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if remaining > 0:
+                self.short_circuited += 1
+                raise Rejected(503, "Analysis service is temporarily unavailable. Please try again shortly.", remaining)
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:
+                self.short_circuited += 1
+                raise Rejected(503, "Analysis service is temporarily unavailable. Please try again shortly.", 1)
+            self._probing = True
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self._failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._probing = False
+        self._failures += 1
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """A half-open probe ended without an upstream verdict (e.g. the caller was cancelled)."""
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self._failures, "short_circuited": self.short_circuited}
+
+
+# ----- Retries -----
+def loaded_openai():
+    """The openai package if it has been imported, else None.
+
+    The SDK takes ~0.4 s to import and is loaded on first use by OpenAIBackend; until then no exception can
+    be an OpenAI error, so classifying errors never has to import it.
+    """
+    return sys.modules.get("openai")
+
+
+def retryable_errors() -> tuple:
+    openai = loaded_openai()
+    if openai is None:
+        return ()
+    return (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def is_retryable(e: Exception) -> bool:
+    # An exhausted quota is a 429 too, but waiting will not fix it
+    return isinstance(e, retryable_errors()) and getattr(e, "code", None) != "insufficient_quota"
+
+
+def is_upstream_outage(e: Exception) -> bool:
+    """Errors that say the upstream is unhealthy (as opposed to rate limited or rejecting our request)."""
+    openai = loaded_openai()
+    return openai is not None and isinstance(e, (openai.APIConnectionError, openai.InternalServerError))
+
+
+def retry_after_seconds(e: Exception) -> Optional[float]:
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class RetryPolicy:
+    """Retries transient upstream errors (429, 5xx, connection/timeouts); Retry-After wins over the backoff schedule."""
+
+    def __init__(self, max_retries: int, base_delay: float, max_delay: float):
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+    def delay(self, attempt: int, e: Exception) -> float:
+        hinted = retry_after_seconds(e)
+        if hinted is not None:
+            return min(hinted, self.max_delay)
+        # Full jitter: uniform in [0, base * 2^attempt], capped
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def run(self, fn: Callable[[], Awaitable[Any]], breaker: CircuitBreaker) -> Any:
+        attempt = 0
+        while True:
+            breaker.before_call()
+            try:
+                result = await fn()
+            except retryable_errors() as e:
+                if is_upstream_outage(e):
+                    breaker.record_failure()
+                else:
+                    breaker.release_probe()
+                if not is_retryable(e) or attempt >= self.max_retries or breaker.state == "open":
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.delay(attempt, e))
+                attempt += 1
+                continue
+            except BaseException:
+                breaker.release_probe()
+                raise
+            breaker.record_success()
+            return result
+
+    def stats(self) -> dict:
+        return {"max_retries": self.max_retries, "retries": self.retries}
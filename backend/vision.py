@@ -0,0 +1,507 @@
+"""
+NutriMedAI vision backends.
+The interface behind /analyze: OpenAI chat completions, or a local model run on CPU in a dedicated
+process pool, fed by a micro-batching scheduler that groups concurrent requests. A deterministic stub
+engine stands in for real weights so the scheduler can be tested and benchmarked anywhere.
+"""
+
+import asyncio
+import hashlib
+import importlib
+import importlib.util
+import io
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from .blobs import parse_data_url
+    from .imaging import PreparedImage
+    from .metrics import Counter, Histogram
+    from .upstream import CircuitBreaker, Rejected, RetryPolicy
+except ImportError:  # started as `uvicorn main:app` from inside backend/
+    from blobs import parse_data_url
+    from imaging import PreparedImage
+    from metrics import Counter, Histogram
+    from upstream import CircuitBreaker, Rejected, RetryPolicy
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class TextStream:
+    """Async iterator of text deltas plus a close() that releases the underlying request."""
+
+    def __init__(self, deltas: AsyncIterator[str], close: Optional[Callable[[], Awaitable[None]]] = None):
+        self._deltas = deltas
+        self._close = close
+
+    def __aiter__(self):
+        return self._deltas
+
+    async def close(self) -> None:
+        if self._close is not None:
+            await self._close()
+
+
+async def _single(text: str):
+    if text:
+        yield text
+
+
+# ----- OpenAI -----
+def vision_messages(prompt: str, *images: PreparedImage) -> list:
+    return [
+        {
+            "role": "user",
+            "content": [{"type": "text", "text": prompt}] + [
+                {"type": "image_url", "image_url": {"url": image.data_url, "detail": image.detail}} for image in images
+            ],
+        }
+    ]
+
+
+async def _openai_deltas(stream, on_usage: Callable):
+    async for chunk in stream:
+        if chunk.usage is not None:  # final chunk when stream_options.include_usage is set
+            on_usage(chunk.usage)
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            yield delta
+
+
+class OpenAIBackend:
+    """Chat completions through one shared AsyncOpenAI client, behind the retry policy and circuit breaker."""
+
+    name = "openai"
+    packs_images = True  # answers several images in one completion (BATCH_PACK_IMAGES)
+
+    def __init__(self, api_key: str, model: str, timeout: float, max_connections: int, max_keepalive: int,
+                 keepalive_expiry: float, retry: RetryPolicy, breaker: CircuitBreaker):
+        self.api_key = api_key
+        self.model_id = model
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.retry = retry
+        self.breaker = breaker
+        self._client: Optional["AsyncOpenAI"] = None
+        self._client_lock = threading.Lock()
+        self.call_seconds = Histogram(
+            "openai_request_duration_seconds",
+            "OpenAI chat completion duration per attempt (streams: until response headers), by mode and outcome",
+        )
+        self.tokens = Counter("openai_tokens_total", "OpenAI tokens reported in response.usage, by kind")
+
+    def configuration_error(self) -> Optional[str]:
+        return None if self.api_key else "OpenAI API key not configured. Set OPENAI_API_KEY."
+
+    def client(self) -> "AsyncOpenAI":
+        """Application-lifetime async client; reusing it keeps TLS connections to OpenAI warm."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._build_client()
+        return self._client
+
+    def _build_client(self) -> "AsyncOpenAI":
+        # Imported here, not at module level: the SDK's type modules cost ~0.4 s, all of it on the cold start path
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        return AsyncOpenAI(
+            api_key=self.api_key,
+            timeout=httpx.Timeout(self.timeout, connect=10.0),
+            max_retries=0,  # retries are done by self.retry so they respect the breaker and admission queue
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+            ),
+        )
+
+    def start(self) -> None:
+        """Import the SDK and build the client; blocking, so run it off the event loop."""
+        if self.api_key:
+            self.client()
+
+    def record_usage(self, usage) -> None:
+        self.tokens.inc(usage.prompt_tokens or 0, kind="prompt")
+        self.tokens.inc(usage.completion_tokens or 0, kind="completion")
+
+    async def _create(self, mode: str, **kwargs):
+        """One attempt, timed; retry.run calls this again for retried attempts."""
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await self.client().chat.completions.create(model=self.model_id, **kwargs)
+        except BaseException as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            self.call_seconds.observe(time.perf_counter() - start, mode=mode, outcome=outcome)
+
+    async def complete(self, prompt: str, images: Sequence[PreparedImage], max_tokens: int) -> str:
+        completion = await self.retry.run(
+            lambda: self._create("complete", messages=vision_messages(prompt, *images), max_tokens=max_tokens),
+            self.breaker,
+        )
+        if completion.usage is not None:
+            self.record_usage(completion.usage)
+        return completion.choices[0].message.content or ""
+
+    async def open_stream(self, prompt: str, images: Sequence[PreparedImage], max_tokens: int) -> TextStream:
+        stream = await self.retry.run(
+            lambda: self._create(
+                "stream", messages=vision_messages(prompt, *images), max_tokens=max_tokens,
+                stream=True, stream_options={"include_usage": True},
+            ),
+            self.breaker,
+        )
+        return TextStream(_openai_deltas(stream, self.record_usage), stream.close)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "model": self.model_id}
+
+    def metrics(self) -> list:
+        return [self.call_seconds, self.tokens]
+
+
+# ----- Local engines (run inside pool workers) -----
+# (prompt, image data URLs, max new tokens) for one request
+BatchItem = Tuple[str, List[str], int]
+
+
+class StubEngine:
+    """Deterministic stand-in for a VLM: the output depends only on prompt and image bytes.
+
+    Simulates batched inference cost as batch_ms per forward pass plus item_ms per request, so
+    micro-batching shows the same amortisation it does with a real model.
+    """
+
+    DISHES = ["Grilled chicken salad", "Vegetable fried rice", "Margherita pizza", "Lentil soup", "Salmon with quinoa"]
+
+    def __init__(self, model: str, options: dict):
+        self.model_id = model or "stub"
+        self.batch_ms = float(options.get("stub_batch_ms", 200))
+        self.item_ms = float(options.get("stub_item_ms", 40))
+
+    def generate(self, batch: List[Tuple[str, List[bytes], int]]) -> List[str]:
+        time.sleep((self.batch_ms + self.item_ms * len(batch)) / 1000)
+        return [self._analysis(prompt, images) for prompt, images, _ in batch]
+
+    def _analysis(self, prompt: str, images: List[bytes]) -> str:
+        digest = hashlib.sha256(prompt.encode() + b"".join(images)).digest()
+        dish = self.DISHES[digest[0] % len(self.DISHES)]
+        calories = 250 + digest[1] * 2
+        return f"""---
+DISH:
+{dish}
+
+---
+FOOD SUMMARY:
+{dish} ({len(images)} image(s) analysed by the stub engine).
+
+---
+KEY METRICS:
+Calories: {calories}-{calories + 80} kcal | Protein: {10 + digest[2] % 30}g | Carbs: {20 + digest[3] % 50}g | Fat: {5 + digest[4] % 25}g | Fiber: {digest[5] % 10}g | Sugar: {digest[6] % 15}g | Sodium: {200 + digest[7] * 3}mg
+
+---
+CURRENT CONDITION SUMMARY:
+Main component: fine in a moderate portion.
+[Reasoning] Stub output for scheduler tests.
+
+---
+CONCERNED CONDITION SUMMARY:
+Main component: no specific concern.
+[Benefit] Stub output for scheduler tests.
+
+---
+ALTERNATIVES:
+Try a half portion with a side salad.
+
+---
+NUTRITION SCORE:
+{40 + digest[8] % 61}/100"""
+
+
+class SmolVLMEngine:
+    """Hugging Face SmolVLM-Instruct (or any AutoModelForVision2Seq checkpoint) on CPU; needs torch + transformers."""
+
+    def __init__(self, model: str, options: dict):
+        import torch
+        from transformers import AutoModelForVision2Seq, AutoProcessor
+
+        threads = int(options.get("threads") or 0)
+        if threads:
+            torch.set_num_threads(threads)
+        self.model_id = model
+        self.processor = AutoProcessor.from_pretrained(model)
+        # Left padding so every sequence in a batch ends at the generation boundary
+        self.processor.tokenizer.padding_side = "left"
+        self.model = AutoModelForVision2Seq.from_pretrained(model, torch_dtype=torch.float32).eval()
+
+    def generate(self, batch: List[Tuple[str, List[bytes], int]]) -> List[str]:
+        import torch
+        from PIL import Image
+
+        texts, images = [], []
+        for prompt, image_bytes, _ in batch:
+            content = [{"type": "image"} for _ in image_bytes] + [{"type": "text", "text": prompt}]
+            texts.append(self.processor.apply_chat_template([{"role": "user", "content": content}], add_generation_prompt=True))
+            images.append([Image.open(io.BytesIO(b)).convert("RGB") for b in image_bytes])
+        inputs = self.processor(text=texts, images=images, return_tensors="pt", padding=True)
+        with torch.inference_mode():
+            output = self.model.generate(**inputs, max_new_tokens=max(m for _, _, m in batch), do_sample=False)
+        generated = output[:, inputs["input_ids"].shape[1]:]
+        return [text.strip() for text in self.processor.batch_decode(generated, skip_special_tokens=True)]
+
+
+ENGINES = {"stub": StubEngine, "smolvlm": SmolVLMEngine}
+ENGINE_REQUIREMENTS = {"smolvlm": ("torch", "transformers")}
+
+
+def engine_class(spec: str):
+    """ENGINES name or "package.module:Class"."""
+    if spec in ENGINES:
+        return ENGINES[spec]
+    module, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+_engine = None
+_engine_error: Optional[str] = None
+
+
+def _init_worker(spec: str, model: str, options: dict) -> None:
+    global _engine, _engine_error
+    try:
+        _engine = engine_class(spec)(model, options)
+    except Exception as e:  # surfaced per request; a raising initializer would break the whole pool
+        _engine_error = f"{type(e).__name__}: {e}"
+        logger.exception("Local vision engine %r failed to load", spec)
+
+
+def _warm_up() -> bool:
+    return _engine is not None
+
+
+def _generate(batch: List[BatchItem]) -> List[str]:
+    if _engine is None:
+        raise RuntimeError(f"Local vision engine failed to load: {_engine_error}")
+    decoded = []
+    for prompt, data_urls, max_tokens in batch:
+        images = [parsed[1] for parsed in map(parse_data_url, data_urls) if parsed is not None]
+        decoded.append((prompt, images, max_tokens))
+    return _engine.generate(decoded)
+
+
+# ----- Micro-batching -----
+class MicroBatcher:
+    """Groups concurrent submissions into batches of up to max_batch, waiting at most max_wait seconds to fill one.
+
+    At most `concurrency` batches run at once (one per worker); while all are busy, new requests queue
+    up and go out together in the next batch. Beyond max_queue waiting requests, submit() is refused.
+    """
+
+    def __init__(self, run_batch: Callable[[list], Awaitable[list]], max_batch: int, max_wait: float, concurrency: int, max_queue: int):
+        self.run_batch = run_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(1, max_queue)
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: set = set()
+        self.rejected = 0
+        self.batch_sizes = Histogram("vision_batch_size", "Requests per local inference batch", buckets=(1, 2, 4, 8, 16, 32, 64))
+        self.queue_seconds = Histogram("vision_queue_seconds", "Time a local inference request waited before its batch started")
+        self.batch_seconds = Histogram("vision_batch_seconds", "Local inference batch duration")
+
+    def _ensure_started(self) -> None:
+        # Created lazily so the queue and scheduler task bind to the serving event loop
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._task = asyncio.get_running_loop().create_task(self._schedule())
+
+    async def submit(self, item):
+        self._ensure_started()
+        if self._queue.qsize() >= self.max_queue:
+            self.rejected += 1
+            raise Rejected(503, "Analysis model is busy. Please try again shortly.", self.max_wait + 1)
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future, time.perf_counter()))
+        return await future
+
+    async def _schedule(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # Wait for a free worker first: requests arriving meanwhile join this batch
+            await self._slots.acquire()
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                try:
+                    batch.append(self._queue.get_nowait() if remaining <= 0 else await asyncio.wait_for(self._queue.get(), remaining))
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+            batch = [entry for entry in batch if not entry[1].done()]  # callers that disconnected
+            if not batch:
+                self._slots.release()
+                continue
+            task = loop.create_task(self._dispatch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _dispatch(self, batch: list) -> None:
+        start = time.perf_counter()
+        for _, _, queued_at in batch:
+            self.queue_seconds.observe(start - queued_at)
+        self.batch_sizes.observe(len(batch))
+        try:
+            results = await self.run_batch([item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.batch_seconds.observe(time.perf_counter() - start)
+            self._slots.release()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(Rejected(503, "Analysis model is shutting down.", 5))
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches_running": len(self._running),
+            "rejected": self.rejected,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_seconds": self.queue_seconds.snapshot(),
+            "batch_seconds": self.batch_seconds.snapshot(),
+        }
+
+
+class LocalBackend:
+    """A local model in `workers` spawned processes (each loads the engine once), fed by a MicroBatcher.
+
+    Streaming is not incremental: open_stream() yields the whole analysis once the batch finishes.
+    """
+
+    name = "local"
+    packs_images = False  # small models do not follow the packed format; micro-batching shares the forward pass instead
+
+    def __init__(self, engine: str, model: str, workers: int, max_batch: int, max_wait: float, max_queue: int,
+                 max_new_tokens: int, options: Optional[Dict] = None):
+        self.engine = engine
+        self.model = model
+        self.workers = max(1, workers)
+        self.max_new_tokens = max_new_tokens
+        self.options = dict(options or {})
+        self.model_id = f"local/{engine}:{model}"
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.restarts = 0
+        self.batcher = MicroBatcher(self._run_batch, max_batch, max_wait, self.workers, max_queue)
+
+    def configuration_error(self) -> Optional[str]:
+        missing = [m for m in ENGINE_REQUIREMENTS.get(self.engine, ()) if importlib.util.find_spec(m) is None]
+        if missing:
+            return f"Local vision engine '{self.engine}' needs {', '.join(missing)} installed."
+        try:
+            engine_class(self.engine)
+        except (ImportError, AttributeError, ValueError):
+            return f"Unknown local vision engine '{self.engine}'."
+        return None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        pool = self._pool
+        if pool is None:
+            with self._lock:
+                if self._pool is None:
+                    # spawn: forking a process that already runs event-loop and threadpool threads is unsafe
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker,
+                        initargs=(self.engine, self.model, self.options),
+                    )
+                pool = self._pool
+        return pool
+
+    def _discard(self, pool: ProcessPoolExecutor) -> None:
+        """Drop a pool whose worker died (it never recovers by itself) so the next batch spawns a new one."""
+        with self._lock:
+            if self._pool is not pool:
+                return  # another batch already replaced it
+            self._pool = None
+            self.restarts += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def start(self) -> None:
+        """Spawn the workers and start loading weights without waiting for them."""
+        if self.configuration_error() is None:
+            pool = self._executor()
+            for _ in range(self.workers):
+                pool.submit(_warm_up)
+
+    async def _run_batch(self, items: List[BatchItem]) -> List[str]:
+        pool = self._executor()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, _generate, items)
+        except BrokenProcessPool:
+            # A worker was killed (usually OOM while loading or generating); retry the batch once on fresh workers
+            logger.warning("Local vision worker pool broke; restarting it and retrying the batch")
+            self._discard(pool)
+            return await asyncio.get_running_loop().run_in_executor(self._executor(), _generate, items)
+
+    async def complete(self, prompt: str, images: Sequence[PreparedImage], max_tokens: int) -> str:
+        return await self.batcher.submit((prompt, [image.data_url for image in images], min(max_tokens, self.max_new_tokens)))
+
+    async def open_stream(self, prompt: str, images: Sequence[PreparedImage], max_tokens: int) -> TextStream:
+        return TextStream(_single(await self.complete(prompt, images, max_tokens)))
+
+    async def close(self) -> None:
+        await self.batcher.close()
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name, "model": self.model_id, "workers": self.workers, "restarts": self.restarts,
+            "scheduler": self.batcher.stats(),
+        }
+
+    def metrics(self) -> list:
+        return [self.batcher.batch_sizes, self.batcher.queue_seconds, self.batcher.batch_seconds]
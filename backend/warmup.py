@@ -0,0 +1,111 @@
+"""
+NutriMedAI startup warm-up.
+The server accepts connections as soon as the app is imported; schema migrations, the admin account,
+the vision client and the password pool are prepared afterwards as named steps in worker threads.
+/healthz reports live from the first request and ready once every step has finished; a step that
+fails is retried with backoff, so an instance recovers from a transient error without a restart.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger("uvicorn.error")
+
+# A step started with when_idle=True waits for a moment with no requests in flight, but not longer than this
+IDLE_WAIT_MAX_SECONDS = 10.0
+# A failed step is run again after 1, 2, 4, ... seconds, at most this long apart, until it succeeds
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 60.0
+
+
+class Warmup:
+    """Background startup steps with per-step state and duration; requests that need one can await it."""
+
+    def __init__(self, busy: Callable[[], bool] = lambda: False):
+        self.busy = busy
+        self.started = time.perf_counter()
+        self.ready_after: Optional[float] = None
+        self._steps: Dict[str, dict] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._attempted: Dict[str, asyncio.Event] = {}
+        self._after: Dict[str, tuple] = {}
+
+    def start(self, name: str, fn: Callable[[], object], after: Iterable[str] = (), when_idle: bool = False) -> None:
+        """Run blocking fn() in a thread as step `name`, once the steps named in `after` have finished.
+
+        when_idle: also wait until busy() is false (up to IDLE_WAIT_MAX_SECONDS), for steps no request is
+        waiting on that would otherwise compete with one for the CPU.
+        """
+        self._steps[name] = {"state": "pending", "seconds": None, "attempts": 0}
+        self._attempted[name] = asyncio.Event()
+        self._after[name] = tuple(after)
+        deps = [self._tasks[dep] for dep in after]
+        self._tasks[name] = asyncio.get_running_loop().create_task(self._run(name, fn, deps, when_idle))
+
+    async def _run(self, name: str, fn: Callable[[], object], deps: list, when_idle: bool) -> None:
+        if deps:
+            await asyncio.wait(deps)
+        deadline = time.perf_counter() + IDLE_WAIT_MAX_SECONDS
+        while when_idle and self.busy() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        step = self._steps[name]
+        delay = RETRY_BASE_SECONDS
+        while True:
+            step["state"] = "running"
+            step["attempts"] += 1
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(fn)
+            except Exception as e:
+                # Requests don't wait for the retry: the step's own code path also runs on first real use
+                # (e.g. get_db -> init_db). Dependent steps do, and readiness follows once this one succeeds
+                step["state"] = "failed"
+                step["error"] = f"{type(e).__name__}: {e}"[:200]
+                logger.exception("Startup step %s failed (attempt %s); retrying in %.0f s", name, step["attempts"], delay)
+            else:
+                step["state"] = "done"
+                step.pop("error", None)
+            finally:
+                step["seconds"] = round(time.perf_counter() - start, 3)
+                self._attempted[name].set()
+            if step["state"] == "done":
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX_SECONDS)
+        if self.ready and self.ready_after is None:
+            self.ready_after = round(time.perf_counter() - self.started, 3)
+            logger.info("Warm-up complete in %.0f ms: %s", self.ready_after * 1000, {n: s["seconds"] for n, s in self._steps.items()})
+
+    async def wait(self, name: str) -> None:
+        """Wait for the first attempt at step `name` to end (no-op if unknown or already attempted).
+
+        Returns early if a step it runs after has failed, since it won't be attempted until that one recovers.
+        Cancelling the caller does not cancel the step.
+        """
+        for dep in self._after.get(name, ()):
+            await self.wait(dep)
+            if self._steps[dep]["state"] != "done":
+                return
+        attempted = self._attempted.get(name)
+        if attempted is not None:
+            await attempted.wait()
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._steps) and all(step["state"] == "done" for step in self._steps.values())
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "ready_after_seconds": self.ready_after,
+            "steps": {name: dict(step) for name, step in self._steps.items()},
+        }
+
+    def cancel(self) -> None:
+        """Stop waiting on unfinished steps at shutdown; a step already running in a thread runs to completion."""
+        for task in self._tasks.values():
+            task.cancel()
+        for attempted in self._attempted.values():
+            attempted.set()
@@ -4,6 +4,12 @@ import { useAuth } from './AuthContext'
 
 const API_BASE = import.meta.env.DEV ? (import.meta.env.VITE_API_URL || '/api') : '/api'
 
+/** Server-relative URLs (e.g. stored previews) are served by the API, so prefix them with API_BASE. */
+function apiUrl(url?: string | null): string | undefined {
+  if (!url) return undefined
+  return url.startsWith('/') ? `${API_BASE}${url}` : url
+}
+
 const iconCl = 'w-5 h-5 flex-shrink-0'
 const METRIC_ICONS: Record<string, React.ReactNode> = {
   calories: (
@@ -290,6 +296,8 @@ type AnalysisEntry = {
   userDescription: string
   analysis: string
   preview?: string
+  /** Small server-generated image for the history list; local-only entries fall back to the preview. */
+  thumbnail?: string
 }
 
 function analysesStorageKey(userId?: string) {
@@ -1030,14 +1038,15 @@ export default function App() {
       })
       if (res.ok) {
         const list = await res.json()
-        const entries: AnalysisEntry[] = (Array.isArray(list) ? list : []).map((r: { id: string; date: string; analysis: string; preview?: string; currentConditions?: string; concernedConditions?: string; userDescription?: string }) => ({
+        const entries: AnalysisEntry[] = (Array.isArray(list) ? list : []).map((r: { id: string; date: string; analysis: string; preview?: string; thumbnail?: string; currentConditions?: string; concernedConditions?: string; userDescription?: string }) => ({
           id: r.id,
           date: r.date,
           currentConditions: r.currentConditions ?? '',
           concernedConditions: r.concernedConditions ?? '',
           userDescription: r.userDescription ?? '',
           analysis: r.analysis,
-          preview: r.preview ?? undefined,
+          preview: apiUrl(r.preview),
+          thumbnail: apiUrl(r.thumbnail),
         }))
         setAnalysesList(entries)
       }
@@ -1056,14 +1065,15 @@ export default function App() {
           })
           if (res.ok) {
             const list = await res.json()
-            const entries: AnalysisEntry[] = (Array.isArray(list) ? list : []).map((r: { id: string; date: string; analysis: string; preview?: string; currentConditions?: string; concernedConditions?: string; userDescription?: string }) => ({
+            const entries: AnalysisEntry[] = (Array.isArray(list) ? list : []).map((r: { id: string; date: string; analysis: string; preview?: string; thumbnail?: string; currentConditions?: string; concernedConditions?: string; userDescription?: string }) => ({
               id: r.id,
               date: r.date,
               currentConditions: r.currentConditions ?? '',
               concernedConditions: r.concernedConditions ?? '',
               userDescription: r.userDescription ?? '',
               analysis: r.analysis,
-              preview: r.preview ?? undefined,
+              preview: apiUrl(r.preview),
+              thumbnail: apiUrl(r.thumbnail),
             }))
             setAnalysesList(entries)
             return
@@ -1192,7 +1202,8 @@ export default function App() {
                       concernedConditions: created.concernedConditions ?? concernedConditionsStr,
                       userDescription: created.userDescription ?? userDescription.trim(),
                       analysis: created.analysis,
-                      preview: created.preview ?? persistentPreview,
+                      preview: apiUrl(created.preview) ?? persistentPreview,
+                      thumbnail: apiUrl(created.thumbnail) ?? persistentPreview,
                     }
                   : e
               )
@@ -1572,6 +1583,9 @@ export default function App() {
                 key={entry.id}
                 className="flex items-stretch gap-1 rounded-lg border border-violet-200/50 bg-white/40 hover:bg-violet-50/80 transition-colors overflow-hidden"
               >
+                {(entry.thumbnail || entry.preview) && (
+                  <img src={entry.thumbnail || entry.preview} alt="" loading="lazy" className="w-12 h-12 self-center ml-2 rounded-md object-cover flex-shrink-0" />
+                )}
                 <button
                   type="button"
                   onClick={() => loadHistoryEntry(entry)}
@@ -1646,6 +1660,9 @@ export default function App() {
                     key={entry.id}
                     className="flex items-stretch gap-1 rounded-lg border border-violet-200/50 bg-white/40 hover:bg-violet-50/80 transition-colors overflow-hidden"
                   >
+                    {(entry.thumbnail || entry.preview) && (
+                      <img src={entry.thumbnail || entry.preview} alt="" loading="lazy" className="w-12 h-12 self-center ml-2 rounded-md object-cover flex-shrink-0" />
+                    )}
                     <button
                       type="button"
                       onClick={() => { loadHistoryEntry(entry); setMobileSidebarOpen(false) }}